@@ -2,6 +2,7 @@ import click
 
 from aggr.aggregator import aggregate
 from aggr.reformatter import reformat
+from aggr.run import run
 
 @click.group()
 def aggr():
@@ -9,4 +10,5 @@ def aggr():
   pass
 
 aggr.add_command(aggregate)
-aggr.add_command(reformat)
\ No newline at end of file
+aggr.add_command(reformat)
+aggr.add_command(run)
\ No newline at end of file
@@ -0,0 +1,53 @@
+from util.io.json_codec import dumps
+
+
+class AggregationRunner:
+  """
+    Applies multiple aggregators to the per-revision predictions of each entity pair in a single pass, e.g. over a reformatted file (see aggr reformat).
+    The predictions of each aggregator are written to its own file and its confusion counts are collected.
+  """
+
+  def __init__(self, aggregators: dict):
+    self.aggregators = aggregators
+    self.counts = {name: {"TP": 0, "TN": 0, "FP": 0, "FN": 0} for name in aggregators}
+
+  def run(self, entities, dests: dict):
+    """Aggregates the per-revision predictions of each entity pair of the iterable entities and writes the predictions of each aggregator to dests[name]."""
+
+    files = {name: open(dests[name], "w", encoding="utf-8") for name in self.aggregators}
+
+    try:
+      for rev_classifications in entities:
+        self.add(rev_classifications, files)
+    finally:
+      for file in files.values():
+        file.close()
+
+  def add(self, rev_classifications: list, files: dict = None):
+    """Aggregates the predictions of one entity pair with all aggregators."""
+
+    match = rev_classifications[0]["match"]
+
+    for name, aggr in self.aggregators.items():
+      prediction = aggr.aggr(rev_classifications)
+      self.counts[name][_outcome(prediction, match)] += 1
+
+      if files:
+        files[name].write(dumps({"match": prediction}) + "\n")
+
+  def metrics(self, name: str) -> dict:
+    """Returns the confusion counts, precision, recall and F1 of an aggregator."""
+
+    counts = self.counts[name]
+    TP, FP, FN = counts["TP"], counts["FP"], counts["FN"]
+
+    precision = TP / (TP + FP) if TP + FP != 0 else 1
+    recall = TP / (TP + FN) if TP + FN != 0 else 1
+    F1 = 2 * ((precision * recall) / (precision + recall)) if precision + recall != 0 else 0
+
+    return dict(counts, precision=precision, recall=recall, F1=F1)
+
+def _outcome(prediction: bool, match: bool) -> str:
+  if prediction:
+    return "TP" if match else "FP"
+  return "FN" if match else "TN"
@@ -1,58 +1,113 @@
-import json
+import inspect
 import logging
+import os
+from os.path import join
 import click
+from aggr.aggregation_runner import AggregationRunner
 from aggr.aggregators.majority_aggregator import MajorityAggregator
 from aggr.aggregators.newest_aggregator import NewestAggregator
+from aggr.aggregators.confidence_aggregator import ConfidenceAggregator
+from aggr.aggregators.time_decay_aggregator import TimeDecayAggregator
+from aggr.aggregators.any_aggregator import AnyAggregator
+from aggr.aggregators.all_aggregator import AllAggregator
+from util.io.json_codec import loads, dumps
+from util.io.compressed_io import open_compressed
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
 
-_aggr_builders = {
-  "majority": lambda s: MajorityAggregator(**s),
-  "newest": lambda s: NewestAggregator(**s),
+_aggr_classes = {
+  "majority": MajorityAggregator,
+  "newest": NewestAggregator,
+  "confidence": ConfidenceAggregator,
+  "time_decay": TimeDecayAggregator,
+  "any": AnyAggregator,
+  "all": AllAggregator,
 }
 
+AGGREGATORS = list(_aggr_classes.keys())
+
 @click.command()
 @click.argument('src', type=str)
 @click.argument('dest', type=str)
-@click.option('-aggr', '--aggregator', type=str, default='majority', help='The aggregator to use for aggregating the src classifications (majority)')
-@click.option('-gs', '--aggregator-settings', type=(str, bool), default=dict(), multiple=True, help='Settings passed to the selected aggregator')
+@click.option('-aggr', '--aggregator', type=click.Choice(AGGREGATORS), default=['majority'], multiple=True, help='The aggregators to use for aggregating the src classifications (majority). Can be repeated.')
+@click.option('-gs', '--aggregator-settings', type=(str, str), default=dict(), multiple=True, help='Settings passed to the selected aggregators that accept them. Prefix a setting with <aggregator>. to pass it to one aggregator only (e.g. time_decay.HALF_LIFE 180).')
 def aggregate(src, dest, aggregator, aggregator_settings):
   """Aggregates the per-revision predictions when using zipping.
      The input should first be reformatted using /aggr/reformatter.py
+     With a single aggregator, its predictions are written to dest. With multiple aggregators, dest is a directory
+     that gets the predictions of each aggregator (<aggregator>.json) and their metrics (metrics.json).
   """
-  
-  aggr = _aggr_builders[aggregator](dict(aggregator_settings))
-
-  entitiy_classifications = []
-
-  with open(src, "rb") as src_file:
-    entitiy_classifications = [json.loads(line) for line in src_file]
-
-  TP = 0
-  FP = 0
-  FN = 0
-  TN = 0
-  
-  with open(dest, "w", encoding="utf-8") as dest_file:
-
-    for rev_classifications in entitiy_classifications:
-      
-      prediction = aggr.aggr(rev_classifications)
-      match = rev_classifications[0]["match"]
-      if prediction and match:
-        TP += 1
-      elif not prediction and not match:
-        TN += 1
-      elif not prediction and match:
-        FN += 1
-      elif prediction and not match:
-        FP += 1
-      
-      dest_file.write(json.dumps({"match": prediction}, ensure_ascii=False) + "\n")
-
-  precision = TP / (TP + FP) if TP + FP != 0 else 1
-  recall = TP / (TP + FN) if TP + FP != 0 else 1
-  F1 = 2 * ((precision * recall) / (precision +  recall))
-
-  click.echo(f"Precision: {precision}, recall: {recall}, F1: {F1}")
\ No newline at end of file
+
+  with open_compressed(src, "rb") as src_file:
+    run_aggregators((loads(line) for line in src_file), dest, aggregator, aggregator_settings)
+
+def run_aggregators(entities, dest: str, aggregator: list, aggregator_settings: list):
+  """Applies the aggregators to the per-revision predictions of each entity pair and writes their predictions and metrics (see aggregate)."""
+
+  aggregators = _build_aggregators(list(dict.fromkeys(aggregator)), aggregator_settings)
+  runner = AggregationRunner(aggregators)
+
+  if len(aggregators) == 1:
+    dests = {name: dest for name in aggregators}
+  else:
+    os.makedirs(dest, exist_ok=True)
+    dests = {name: join(dest, f"{name}.json") for name in aggregators}
+
+  runner.run(entities, dests)
+
+  metrics = {name: runner.metrics(name) for name in aggregators}
+  for name, m in metrics.items():
+    prefix = f"{name}: " if len(aggregators) > 1 else ""
+    click.echo(f"{prefix}Precision: {m['precision']}, recall: {m['recall']}, F1: {m['F1']}")
+
+  if len(aggregators) > 1:
+    with open(join(dest, "metrics.json"), "w", encoding="utf-8") as file:
+      for name, m in metrics.items():
+        file.write(dumps(dict(m, aggregator=name)) + "\n")
+
+def _build_aggregators(names: list, settings: list) -> dict:
+  """
+    Creates the aggregators names, each one with the settings its __init__ accepts.
+    Raises a BadParameter for a setting that none of its aggregators accepts (e.g. a typo), instead of ignoring it.
+  """
+
+  accepted = {name: inspect.signature(_aggr_classes[name]).parameters for name in names}
+
+  for key, _ in settings:
+    targets = names
+    if "." in key:
+      prefix, key = key.split(".", 1)
+      targets = [prefix]
+      if prefix not in names:
+        raise click.BadParameter(f"The setting {prefix}.{key} is for {prefix}, which is not a selected aggregator.", param_hint="'-gs' / '--aggregator-settings'")
+    if not any([key in accepted.get(name, dict()) for name in targets]):
+      raise click.BadParameter(f"None of the aggregators {', '.join(targets)} accepts the setting {key}.", param_hint="'-gs' / '--aggregator-settings'")
+
+  aggregators = dict()
+  for name in names:
+    aggr_settings = _settings_of(name, settings)
+    aggregators[name] = _aggr_classes[name](**{key: value for key, value in aggr_settings.items() if key in accepted[name]})
+  return aggregators
+
+def _settings_of(name: str, settings: list) -> dict:
+  """Returns the settings for the aggregator name. Values are parsed as bool, int or float if possible."""
+
+  result = dict()
+  for key, value in settings:
+    if "." in key:
+      aggr_name, key = key.split(".", 1)
+      if aggr_name != name:
+        continue
+    result[key] = _parse_setting(value)
+  return result
+
+def _parse_setting(value: str):
+  if value.lower() in ["true", "false"]:
+    return value.lower() == "true"
+  for parse in [int, float]:
+    try:
+      return parse(value)
+    except ValueError:
+      pass
+  return value
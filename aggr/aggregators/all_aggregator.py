@@ -0,0 +1,8 @@
+from aggr.aggregators.base_aggregator import BaseAggregator
+
+
+class AllAggregator(BaseAggregator):
+  """Match only if all revision pairs were classified as match."""
+
+  def aggr(self, classifications: list) -> bool:
+    return all([p["prediction"] for p in classifications])
@@ -0,0 +1,8 @@
+from aggr.aggregators.base_aggregator import BaseAggregator
+
+
+class AnyAggregator(BaseAggregator):
+  """Match if any revision pair was classified as match."""
+
+  def aggr(self, classifications: list) -> bool:
+    return any([p["prediction"] for p in classifications])
@@ -0,0 +1,15 @@
+from aggr.aggregators.base_aggregator import BaseAggregator
+
+
+class ConfidenceAggregator(BaseAggregator):
+  """
+    Averages the match probabilities of all revision pairs. Ditto's confidence refers to the predicted label,
+    so the match probability of a non-match prediction is 1 - confidence.
+  """
+
+  def __init__(self, THRESHOLD: float = 0.5):
+    self.threshold = THRESHOLD
+
+  def aggr(self, classifications: list) -> bool:
+    probabilities = [p["predictionConfidence"] if p["prediction"] else 1 - p["predictionConfidence"] for p in classifications]
+    return sum(probabilities) / len(probabilities) >= self.threshold
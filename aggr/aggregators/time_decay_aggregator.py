@@ -0,0 +1,19 @@
+from aggr.aggregators.base_aggregator import BaseAggregator
+from util.wiki.wikilink_util import parse_wiki_date
+
+
+class TimeDecayAggregator(BaseAggregator):
+  """
+    Weighted vote of all revision pairs. The weight of a pair halves every HALF_LIFE days that its newer revision is older than the newest revision of the entity pair,
+    so that recent revisions count more.
+  """
+
+  def __init__(self, HALF_LIFE: float = 365, THRESHOLD: float = 0.5):
+    self.half_life = HALF_LIFE
+    self.threshold = THRESHOLD
+
+  def aggr(self, classifications: list) -> bool:
+    dates = [max(parse_wiki_date(p["date1"]), parse_wiki_date(p["date2"])) for p in classifications]
+    newest = max(dates)
+    weights = [0.5 ** ((newest - date).total_seconds() / 86400 / self.half_life) for date in dates]
+    return sum([w for w, p in zip(weights, classifications) if p["prediction"]]) / sum(weights) >= self.threshold
@@ -1,10 +1,15 @@
-import json
 import logging
 import click
+import numpy as np
+from util.io.json_codec import loads, dumps
+from util.io.compressed_io import open_compressed
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
 
+# Initial number of deduplicated prompts whose predictions are kept (the arrays double when full)
+_SHARED_CAPACITY = 1 << 16
+
 @click.command()
 @click.argument('idx', type=str) 
 @click.argument('src', type=str)
@@ -14,32 +19,75 @@ def reformat(idx, src, dest):
      idx should be the path to the .index file that is created when generating the prompts.
   """
 
-  with open(idx, "rb") as idx_file:
-    with open(src, "rb") as src_file:
-      with open(dest, "w", encoding="utf-8") as dest_file:
+  with open(dest, "w", encoding="utf-8") as dest_file:
+    for entity_predictions in join_predictions(idx, src):
+      dest_file.write(dumps(entity_predictions) + "\n")
+
+def read_index(path: str):
+  """
+    Yields the entity pairs of an .index file written by gen-prompts, one per line.
+    Indices of older versions that consist of a single JSON list are read as well.
+  """
+
+  with open_compressed(path, "rb") as file:
+    for line in file:
+      if line.lstrip().startswith(b"["):
+        yield from loads(line)
+      elif line.strip():
+        yield loads(line)
+
+def join_predictions(idx: str, src: str):
+  """
+    Joins the entity pairs of the index at idx with the per-revision predictions at src (one per prompt, in the same order).
+    Yields the list of predictions of each entity pair, so that only one entity pair is kept in memory.
+    Entity pairs without prompts (e.g. no schema was detected) are skipped.
+    If the index refers to deduplicated prompts (by line), the prediction of a prompt is shared by all pairs of revisions that refer to it.
+    The predictions of all deduplicated prompts are kept then, in arrays of 5 bytes per prompt (confidences as float32).
+  """
+
+  with open_compressed(src, "rb") as src_file:
+
+    # prediction and confidence of the deduplicated prompts read so far
+    shared_predictions = np.empty(_SHARED_CAPACITY, dtype=np.int8)
+    shared_confidences = np.empty(_SHARED_CAPACITY, dtype=np.float32)
+    shared = 0
+
+    for entity_pair in read_index(idx):
 
-        idx = json.loads(idx_file.readline())
+      if not entity_pair.get("revisions"):
+        continue
 
-        for entity_pair in idx:
+      entity_predictions = []
 
-          entity_predictions = []
+      for pair in entity_pair["revisions"]:
+        if "prompt" in pair:
+          # prompts are numbered in the order of their first use
+          while shared <= pair["prompt"]:
+            if shared == len(shared_predictions):
+              shared_predictions = np.concatenate([shared_predictions, np.empty_like(shared_predictions)])
+              shared_confidences = np.concatenate([shared_confidences, np.empty_like(shared_confidences)])
+            shared_predictions[shared], shared_confidences[shared] = _read_prediction(src_file)
+            shared += 1
+          prediction, prediction_confidence = bool(shared_predictions[pair["prompt"]]), float(shared_confidences[pair["prompt"]])
+        else:
+          prediction, prediction_confidence = _read_prediction(src_file)
+        
+        date1 = pair["left"]["revisionDate"]
+        date2 = pair["right"]["revisionDate"]
+        match = entity_pair["match"]
 
-          for pair in entity_pair["revisions"]:
-            classification = json.loads(src_file.readline())
-            
-            date1 = pair["left"]["revisionDate"]
-            date2 = pair["right"]["revisionDate"]
-            match = entity_pair["match"]
+        entity_predictions.append({
+          "date1": date1,
+          "date2": date2,
+          "match": match,
+          "prediction": prediction,
+          "predictionConfidence": prediction_confidence
+        })
 
-            prediction = True if classification["match"] == 1 else False
-            prediction_confidence = classification["match_confidence"]
+      yield entity_predictions
 
-            entity_predictions.append({
-              "date1": date1,
-              "date2": date2,
-              "match": match,
-              "prediction": prediction,
-              "predictionConfidence": prediction_confidence
-            })
+def _read_prediction(src_file) -> tuple:
+  """Reads the next classification of ditto's output as (prediction, confidence)."""
 
-          dest_file.write(json.dumps(entity_predictions, ensure_ascii=False) + "\n")
\ No newline at end of file
+  classification = loads(src_file.readline())
+  return classification["match"] == 1, classification["match_confidence"]
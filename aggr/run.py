@@ -0,0 +1,18 @@
+import click
+from aggr.aggregator import AGGREGATORS, run_aggregators
+from aggr.reformatter import join_predictions
+
+
+@click.command()
+@click.argument('idx', type=str)
+@click.argument('src', type=str)
+@click.argument('dest', type=str)
+@click.option('-aggr', '--aggregator', type=click.Choice(AGGREGATORS), default=['majority'], multiple=True, help='The aggregators to use (majority). Can be repeated.')
+@click.option('-gs', '--aggregator-settings', type=(str, str), default=dict(), multiple=True, help='Settings passed to the selected aggregators that accept them. Prefix a setting with <aggregator>. to pass it to one aggregator only.')
+def run(idx, src, dest, aggregator, aggregator_settings):
+  """Reformats and aggregates the per-revision predictions at src in a single pass, without an intermediate file.
+     idx should be the path to the .index file that is created when generating the prompts.
+     The outputs are the same as of aggregate.
+  """
+
+  run_aggregators(join_predictions(idx, src), dest, aggregator, aggregator_settings)
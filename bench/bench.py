@@ -0,0 +1,144 @@
+import datetime
+import json
+import logging
+import platform
+import subprocess
+from os.path import dirname, abspath
+import click
+
+from bench.generator import generate_dataset
+from bench.micro import run_micro
+from bench.e2e import run_e2e
+from util.io.json_codec import backend
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
+
+@click.group()
+def bench():
+  """Reproducible benchmarks on synthetic Wikipedia table histories."""
+  pass
+
+@click.command()
+@click.argument('dest', type=str)
+@click.option('-f', '--files', type=int, default=4, help='The number of files to generate.')
+@click.option('-t', '--tables', type=int, default=50, help='The number of tables per file.')
+@click.option('-r', '--rows', type=int, default=8, help='The max. number of rows per table.')
+@click.option('-hl', '--history', type=int, default=10, help='The max. number of revisions per table.')
+@click.option('-w', '--width', type=int, default=4, help='The max. number of columns per table.')
+@click.option('--seed', type=int, default=0, help='Seed of the generator.')
+def generate(dest, files, tables, rows, history, width, seed):
+  """Generates synthetic Stage-4 documents (the input of the filter command) at dest."""
+
+  paths = generate_dataset(dest, files, tables, rows, history, width, seed=seed)
+  click.echo(f"Generated {len(paths)} files with {files * tables} tables at {dest}")
+
+@click.command()
+@click.option('-o', '--output', type=str, default="bench-micro.json", help='Where to write the results.')
+@click.option('-n', '--number', type=int, default=3, help='How often each benchmark is repeated.')
+@click.option('-t', '--tables', type=int, default=40, help='The number of synthetic tables to benchmark on.')
+@click.option('-r', '--rows', type=int, default=8, help='The number of rows per table.')
+@click.option('-hl', '--history', type=int, default=12, help='The number of revisions per table.')
+@click.option('-w', '--width', type=int, default=4, help='The number of columns per table.')
+@click.option('--seed', type=int, default=0, help='Seed of the generator.')
+@click.option('-b', '--benchmark', type=str, multiple=True, help='Run only the given benchmarks.')
+def micro(output, number, tables, rows, history, width, seed, benchmark):
+  """Micro-benchmarks of the HTML, wikilink, date and similarity utils and of each formatter."""
+
+  config = dict(number=number, tables=tables, rows=rows, history=history, width=width, seed=seed)
+  results = run_micro(number, tables, rows, history, width, seed, list(benchmark))
+
+  for name, result in results.items():
+    click.echo(f"{name:<25} {result['us_per_op']:>10.1f} us/op {result['ops_per_s']:>12.1f} ops/s")
+
+  _write_results(output, "micro", config, results)
+
+@click.command()
+@click.argument('work_dir', type=str)
+@click.option('-o', '--output', type=str, default="bench-e2e.json", help='Where to write the results.')
+@click.option('-f', '--files', type=int, default=4, help='The number of files to generate.')
+@click.option('-t', '--tables', type=int, default=100, help='The number of tables per file.')
+@click.option('-r', '--rows', type=int, default=8, help='The max. number of rows per table.')
+@click.option('-hl', '--history', type=int, default=10, help='The max. number of revisions per table.')
+@click.option('-w', '--width', type=int, default=4, help='The max. number of columns per table.')
+@click.option('--seed', type=int, default=0, help='Seed of the generator.')
+@click.option('-s', '--size', type=int, default=100, help='The number of pairs to sample.')
+@click.option('-fmt', '--formatter', type=str, multiple=True, help='Formatters to time, e.g. ro_concat_hist:DISTINCT=True (default: ro_concat_hist).')
+@click.option('-p', '--processes', type=int, default=None, help='The number of processes to use per stage.')
+@click.option('--timeout', type=float, default=3600, help='Max. seconds per stage.')
+def e2e(work_dir, output, files, tables, rows, history, width, seed, size, formatter, processes, timeout):
+  """End-to-end timings of filter, sample and gen-prompts on synthetic data generated in work_dir (which is overwritten)."""
+
+  config = dict(files=files, tables=tables, rows=rows, history=history, width=width, seed=seed, size=size, formatters=list(formatter), processes=processes)
+  results = run_e2e(work_dir, files, tables, rows, history, width, seed, size, list(formatter), processes, timeout)
+
+  for name, result in results.items():
+    click.echo(f"{name:<40} {result['seconds']:>10.2f} s{'' if result.get('returncode', 0) == 0 else ' FAILED (' + str(result.get('error', ''))[-200:] + ')'}")
+
+  _write_results(output, "e2e", config, results)
+
+@click.command()
+@click.argument('base', type=str)
+@click.argument('other', type=str)
+@click.option('-t', '--threshold', type=float, default=.1, help='Relative slowdown that is reported as regression.')
+def compare(base, other, threshold):
+  """Compares two result files (e.g. of different commits) and reports regressions."""
+
+  with open(base, "rb") as file:
+    base = json.loads(file.read())
+  with open(other, "rb") as file:
+    other = json.loads(file.read())
+
+  click.echo(f"{base['commit']} -> {other['commit']}")
+
+  regressions = 0
+  key = "min_s" if base["kind"] == "micro" else "seconds"
+
+  for name, result in base["results"].items():
+    if name not in other["results"]:
+      continue
+
+    before = result[key]
+    after = other["results"][name][key]
+    change = (after - before) / before if before > 0 else 0
+
+    flag = ""
+    if change > threshold:
+      flag = "REGRESSION"
+      regressions += 1
+    elif change < -threshold:
+      flag = "improved"
+
+    click.echo(f"{name:<40} {before:>10.4f} -> {after:>10.4f} ({change * 100:+.1f}%) {flag}")
+
+  click.echo(f"{regressions} regression(s)")
+
+bench.add_command(generate)
+bench.add_command(micro)
+bench.add_command(e2e)
+bench.add_command(compare)
+
+def _write_results(path: str, kind: str, config: dict, results: dict):
+  output = {
+    "kind": kind,
+    "commit": _git_commit(),
+    "time": datetime.datetime.now().isoformat(),
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "json": backend(),
+    "config": config,
+    "results": results
+  }
+
+  with open(path, "w", encoding="utf-8") as file:
+    file.write(json.dumps(output, ensure_ascii=False, indent=2))
+
+  logging.info(f"Wrote results to {path}")
+
+def _git_commit() -> str:
+  try:
+    repo = dirname(dirname(abspath(__file__)))
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo, capture_output=True, check=True).stdout.decode().strip()
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo, capture_output=True, check=True).stdout.strip()
+    return commit + ("-dirty" if dirty else "")
+  except (OSError, subprocess.CalledProcessError):
+    return None
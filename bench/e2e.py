@@ -0,0 +1,77 @@
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from os.path import join, exists, dirname, abspath
+from shutil import rmtree
+
+from bench.generator import generate_dataset
+
+_CLI = join(dirname(dirname(abspath(__file__))), "cli.py")
+
+def run_e2e(work_dir: str, files: int = 4, tables: int = 100, rows: int = 8, history: int = 10, width: int = 4, seed: int = 0,
+            size: int = 100, formatters: list = None, processes: int = None, timeout: float = 3600) -> dict:
+  """
+    Generates a synthetic Stage-4 dataset in work_dir/raw and times the filter, sample and gen-prompts commands on it.
+    Each stage runs as separate process via cli.py, so that its multiprocessing setup is the same as in a real run.
+    Later stages are skipped if a stage fails. Keep size well below the number of filtered rows, the negative sampler
+    needs enough rows to follow the similarity distribution of the matches.
+  """
+
+  raw = join(work_dir, "raw")
+  if exists(work_dir):
+    rmtree(work_dir)
+
+  start = time.perf_counter()
+  generate_dataset(raw, files, tables, rows, history, width, seed=seed)
+  results = {"generate": {"seconds": time.perf_counter() - start, "bytes": _dir_size(raw)}}
+
+  filtered = join(work_dir, "filtered")
+  train = join(work_dir, "train")
+  prompts = join(work_dir, "prompts")
+  for d in [filtered, train, prompts]:
+    os.makedirs(d)
+
+  processes = ["-p", str(processes)] if processes else []
+
+  results["filter"] = _run_stage(["filter", raw, filtered, "--force"] + processes, timeout)
+  results["filter"]["bytes"] = _dir_size(filtered)
+  if results["filter"]["returncode"] != 0:
+    return results
+
+  results["sample"] = _run_stage(["sample", filtered, train, "-s", str(size)] + processes, timeout)
+  results["sample"]["bytes"] = _dir_size(train)
+  if results["sample"]["returncode"] != 0:
+    return results
+
+  for formatter in formatters or ["ro_concat_hist"]:
+    name, _, settings = formatter.partition(":")
+    args = ["gen-prompts", train, prompts, "-fmt", name, "-n", formatter.replace(":", "_").replace("=", "")]
+    for setting in [s for s in settings.split(",") if s]:
+      key, _, value = setting.partition("=")
+      args += ["-fs", key, value or "True"]
+    results[f"gen-prompts:{formatter}"] = _run_stage(args, timeout)
+
+  return results
+
+def _run_stage(args: list, timeout: float) -> dict:
+  logging.info(f"Running {' '.join(args[:1])}")
+  start = time.perf_counter()
+
+  # a new session allows to kill the stage's worker processes on timeout
+  process = subprocess.Popen([sys.executable, _CLI] + args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
+  try:
+    _, stderr = process.communicate(timeout=timeout)
+    result = {"seconds": time.perf_counter() - start, "returncode": process.returncode}
+    if process.returncode != 0:
+      result["error"] = stderr.decode("utf-8", errors="replace")[-2000:]
+  except subprocess.TimeoutExpired:
+    os.killpg(process.pid, signal.SIGKILL)
+    process.communicate()
+    result = {"seconds": time.perf_counter() - start, "returncode": None, "error": "timeout"}
+  return result
+
+def _dir_size(path: str) -> int:
+  return sum([os.path.getsize(join(d, f)) for d, _, files in os.walk(path) for f in files])
@@ -0,0 +1,140 @@
+import datetime
+import json
+import os
+from os.path import join
+import numpy as np
+
+# Words used for entity names and cell values. A small vocabulary makes non-matching rows similar enough
+# for the negative sampler to follow the similarity distribution of the matches.
+_WORDS = [
+  "north", "south", "river", "lake", "city", "county", "saint", "new", "old", "port", "mount", "valley",
+  "union", "royal", "central", "east", "west", "grand", "little", "upper", "lower", "fort", "green", "bay",
+  "red", "black", "white", "stone", "bridge", "field", "wood", "hill", "park", "spring", "castle", "harbor"
+]
+
+_COLUMNS = ["Name", "Year", "Team", "Country", "Result", "Notes", "Location", "Position", "Score", "Club", "Role", "Status"]
+
+_DATE_FORMAT = "%b %d, %Y, %I:%M:%S %p"
+
+def format_wiki_date(date: datetime.datetime) -> str:
+  """Formats the date like revisionDate in the Stage-4 output (the inverse of parse_wiki_date)."""
+
+  return date.strftime(_DATE_FORMAT)
+
+def generate_entities(n: int, seed: int = 0) -> list:
+  """
+    Returns n distinct entity (page) names. Entities come in families that share most words of their names
+    (e.g. "Fort Hill" and "Fort Hill Park"), so that different entities can be as similar as matching rows.
+  """
+
+  rnd = np.random.default_rng(seed)
+  entities = set()
+  while len(entities) < n:
+    base = list(rnd.choice(_WORDS, rnd.integers(2, 4), replace=False))
+    for _ in range(4):
+      entities.add(" ".join(base + list(rnd.choice(_WORDS, rnd.integers(0, 2)))).title())
+  return sorted(entities)[:n]
+
+def generate_table(rnd: np.random.Generator, table_id: int, entities: list, rows: int, history: int, width: int) -> dict:
+  """
+    Generates one Stage-4-shaped table document with the given number of rows, (max.) revisions per row and columns.
+    The first column is the subject column and links to one of the entities.
+  """
+
+  page_title = " ".join(rnd.choice(_WORDS, 2)).title() + f" ({table_id})"
+  columns = [_COLUMNS[0]] + list(rnd.choice(_COLUMNS[1:], width - 1, replace=False))
+
+  # the revisions of the table, one every 1 to 120 days
+  start = datetime.datetime(2008, 1, 1) + datetime.timedelta(days=int(rnd.integers(0, 4000)))
+  offsets = np.cumsum(rnd.integers(1, 120, history))
+  revision_ids = [table_id * 10000 + i for i in range(history)]
+  revision_dates = [start + datetime.timedelta(days=int(d), seconds=int(rnd.integers(0, 86400))) for d in offsets]
+
+  schemas = dict()
+  for i, revision_id in enumerate(revision_ids):
+    # rarely, a column gets renamed
+    header = columns if rnd.random() > .05 else columns[:-1] + [columns[-1] + " (old)"]
+    schemas[str(revision_id)] = "<tr>" + "".join([f"<th>{c}</th>" for c in header]) + "</tr>"
+
+  table_rows = []
+  for row_idx in range(rows):
+
+    entity = entities[rnd.integers(0, len(entities))]
+    values = [_cell_value(rnd, c) for c in columns[1:]]
+
+    # each row lives for a random range of the table's revisions
+    first = int(rnd.integers(0, max(1, history // 3)))
+    last = int(rnd.integers(min(history - 1, first + 2), history))
+
+    revisions = []
+    for i in range(first, last + 1):
+
+      # change some values from time to time, some revisions do not touch the row at all
+      for c in range(len(values)):
+        if rnd.random() < .4:
+          values[c] = _cell_value(rnd, columns[c + 1])
+
+      cells = [{"columnId": 0, "content": _subject_cell(rnd, entity)}]
+      cells += [{"columnId": c + 1, "content": f"<td>{v}</td>"} for c, v in enumerate(values)]
+
+      revisions.append({
+        "revisionID": revision_ids[i],
+        "revisionDate": format_wiki_date(revision_dates[i]),
+        "position": row_idx,
+        "cells": cells,
+        "similarityFirst": 1.0,
+        "similarityLast": 1.0,
+        "contentType": "text/html"
+      })
+
+    table_rows.append({"clusterId": row_idx, "revisions": revisions})
+
+  return {
+    "pageID": table_id,
+    "pageTitle": page_title,
+    "tableID": f"{table_id}-0",
+    "lastRevisionID": revision_ids[-1],
+    "lastTable": schemas[str(revision_ids[-1])],
+    "subjectColumnIndex": 0,
+    "subjectColumnProbability": float(rnd.uniform(.9, 1.5)),
+    "schemas": schemas,
+    "rows": table_rows
+  }
+
+def generate_dataset(dest: str, files: int = 4, tables: int = 50, rows: int = 8, history: int = 10, width: int = 4, entities: int = None, seed: int = 0) -> list:
+  """
+    Writes files * tables synthetic Stage-4 documents to dest (one json file per input shard) and returns the file paths.
+    rows, history and width are the max. number of rows per table, revisions per table and columns.
+  """
+
+  rnd = np.random.default_rng(seed)
+  entities = generate_entities(entities if entities else max(10, files * tables * rows // 8), seed)
+
+  os.makedirs(dest, exist_ok=True)
+  paths = []
+
+  for f in range(files):
+    path = join(dest, f"synthetic-{f}.json")
+    with open(path, "w", encoding="utf-8") as file:
+      for t in range(tables):
+        doc = generate_table(rnd, f * tables + t + 1, entities, int(rnd.integers(3, rows + 1)), int(rnd.integers(3, history + 1)), int(rnd.integers(2, width + 1)))
+        file.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    paths.append(path)
+
+  return paths
+
+def _subject_cell(rnd: np.random.Generator, entity: str) -> str:
+  # Stage-4 contains both, rendered html links and raw [[wikilinks]]
+  if rnd.random() < .5:
+    return f'<td><a href="/wiki/{entity.replace(" ", "_")}" title="{entity}">{entity}</a></td>'
+  return f"<td>[[{entity}]]</td>"
+
+def _cell_value(rnd: np.random.Generator, column: str) -> str:
+  if column in ["Year"]:
+    return str(rnd.integers(1950, 2023))
+  if column in ["Score", "Position", "Result"]:
+    return f"{rnd.integers(0, 10)}–{rnd.integers(0, 10)}" if rnd.random() < .5 else str(rnd.integers(1, 40))
+  if rnd.random() < .2:
+    word = rnd.choice(_WORDS).title()
+    return f'<a href="/wiki/{word}" title="{word}">{word}</a>'
+  return " ".join(rnd.choice(_WORDS, rnd.integers(1, 3))).title()
@@ -0,0 +1,116 @@
+import time
+import numpy as np
+
+from bench.generator import generate_entities, generate_table
+from sampling.ditto_prompt import _fmt_builders
+from util.html.html_util import get_cols, get_text
+from util.io.json_codec import loads, dumpb, load_fields
+from util.sim.jaccard import jaccard_similarity
+from util.rev.revision_util import intern_schemas, resolve_schemas
+from util.sampling.pair_set import PairSet, pair_key
+from util.wiki.wiki_table_util import get_tr
+from util.wiki.wikilink_util import extract_wikilink, parse_wiki_date
+
+# Formatter configurations to benchmark (see the docs of the formatter classes)
+FORMATTER_CONFIGS = {
+  "nhNewest": ("nohist", dict(NEWEST=True)),
+  "nhNearest": ("nohist", dict(NEWEST=True, ALIGN=True)),
+  "ao": ("concat_hist", dict(DESC=True)),
+  "aoUnq": ("concat_hist_distinct", dict(SEP=False)),
+  "aoTime_dmy": ("concat_hist_time", dict(Y=True, M=True, D=True)),
+  "ro": ("ro_concat_hist", dict()),
+  "roUnq": ("ro_concat_hist", dict(DISTINCT=True)),
+  "roTime_dmy": ("ro_concat_hist_time", dict(Y=True, M=True, D=True)),
+}
+
+def build_rows(n_tables: int = 40, rows: int = 8, history: int = 12, width: int = 4, seed: int = 0) -> list:
+  """Generates synthetic rows with interned schemas, as in the pairs written by the sample command."""
+
+  rnd = np.random.default_rng(seed)
+  entities = generate_entities(max(10, n_tables * rows // 4), seed)
+  result = []
+
+  for t in range(n_tables):
+    doc = generate_table(rnd, t + 1, entities, rows, history, width)
+    for row in doc["rows"]:
+      intern_schemas(row, doc["schemas"])
+      row["pageTitle"] = doc["pageTitle"]
+      row["subjectColumnIndex"] = doc["subjectColumnIndex"]
+      result.append(row)
+
+  return result
+
+def run_micro(number: int = 3, n_tables: int = 40, rows: int = 8, history: int = 12, width: int = 4, seed: int = 0, only: list = None) -> dict:
+  """
+    Runs the micro-benchmarks and returns a dict with the timings of each benchmark.
+    Each benchmark is executed number times on the same synthetic input; min and mean are reported per operation.
+    Benchmarks with state (e.g. a set that keys are added to) get a fresh one from their setup for each repeat.
+  """
+
+  data = build_rows(n_tables, rows, history, width, seed)
+  revisions = [rev for row in data for rev in row["revisions"]]
+  schemas = [row["schemas"][rev["schemaId"]] for row in data for rev in row["revisions"]]
+  trs = [get_tr(rev) for rev in revisions]
+  dates = [rev["revisionDate"] for rev in revisions]
+  texts = [get_text(get_tr(row["revisions"][-1]), row["pageTitle"], " ").lower() for row in data]
+  text_pairs = [(texts[i], texts[(i * 7 + 1) % len(texts)]) for i in range(len(texts))]
+  pairs = [{"match": False, "row1": data[i], "row2": data[(i * 7 + 1) % len(data)]} for i in range(len(data))]
+  lines = [dumpb(pair) for pair in pairs]
+  # rows as seen by the formatters
+  resolved = [resolve_schemas(loads(dumpb(row))) for row in data]
+  row_pairs = [(resolved[i], resolved[(i * 7 + 1) % len(resolved)]) for i in range(len(resolved))]
+  # the keys of the sampled pairs of rows (by their index), as deduplicated by the sample command
+  pair_keys = [pair_key(i, (i * 7 + 1) % len(data)) for i in range(len(data))]
+
+  benchmarks = {
+    "get_cols": (lambda tr: get_cols(tr), trs),
+    "get_cols_schema": (lambda schema: get_cols(schema), schemas),
+    "get_text": (lambda tr: get_text(tr, "Page"), trs),
+    "extract_wikilink": (lambda tr: extract_wikilink(tr, "Page", 0), trs),
+    "parse_wiki_date": (parse_wiki_date, dates),
+    "jaccard_similarity": (lambda p: jaccard_similarity(p[0], p[1]), text_pairs),
+    "json_loads": (loads, lines),
+    "json_dumps": (dumpb, pairs),
+    "json_load_fields": (lambda line: load_fields(line, ["match"]), lines),
+    "resolve_schemas": (lambda pair: (resolve_schemas(pair["row1"]), resolve_schemas(pair["row2"])), [loads(line) for line in lines]),
+    "pair_set": (lambda key, seen: key in seen or seen.add(key), pair_keys, lambda: PairSet(len(pair_keys))),
+  }
+
+  for name, (builder, settings) in FORMATTER_CONFIGS.items():
+    fmt = _fmt_builders[builder](settings)
+    # formatters may reorder the given list of revisions
+    benchmarks[f"format_{name}"] = (lambda p, fmt=fmt: fmt.format_entry(list(p[0]["revisions"]), list(p[1]["revisions"])), row_pairs)
+
+  results = dict()
+  for name, (fn, inputs, *setup) in benchmarks.items():
+    if only and name not in only:
+      continue
+    results[name] = _measure(fn, inputs, number, *setup)
+
+  return results
+
+def _measure(fn, inputs: list, number: int, setup=None) -> dict:
+  """Times fn on each input. If setup is given, it is called before each repeat (not timed) and its result is passed to fn with each input."""
+
+  durations = []
+  for _ in range(number):
+    if setup is None:
+      start = time.perf_counter()
+      for i in inputs:
+        fn(i)
+    else:
+      state = setup()
+      start = time.perf_counter()
+      for i in inputs:
+        fn(i, state)
+    durations.append(time.perf_counter() - start)
+
+  ops = len(inputs)
+  return {
+    "ops": ops,
+    "repeats": number,
+    "min_s": min(durations),
+    "mean_s": sum(durations) / number,
+    "us_per_op": min(durations) / ops * 1e6,
+    "ops_per_s": ops / min(durations)
+  }
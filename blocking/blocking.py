@@ -0,0 +1,249 @@
+import os
+import re
+import zlib
+from multiprocessing import Pool
+from shutil import rmtree
+from os.path import join, exists, getsize, relpath
+import logging
+import click
+import numpy as np
+
+from sampling.sampling import PairWriter
+from sampling.row_store import RowStoreWriter, merge_row_stores, ROW_STORE_NAME
+from util.html.html_util import get_text
+from util.wiki.wiki_table_util import get_tr
+from util.wiki.wikilink_result import WikilinkResult
+from util.io.json_codec import loads, dumps
+from util.io.compressed_io import list_json_files, open_compressed
+from util.rotating_file_writer import write_manifest, MANIFEST_EXTENSION
+from util.profiling.profiler import profiled
+from util.metrics.stage_metrics import MetricsReporter, init_metrics, incr, timer, flush_metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
+
+# token: rows that share a token of their newest revision
+# sorted: rows whose newest revisions are close to each other when sorted by text (sorted neighbourhood)
+# history: rows that share a token of any of their revisions
+METHODS = ["token", "sorted", "history"]
+
+_CANDIDATES_NAME = "candidates"
+_STATS_FILE_NAME = "blocking.stats"
+
+@click.command()
+@click.argument('src', type=str)
+@click.argument('dest', type=str)
+@click.option('-m', '--method', type=click.Choice(METHODS), default=["token", "sorted"], multiple=True, help='The blocking methods to combine (token, sorted). Can be repeated.')
+@click.option('-w', '--window', type=int, default=10, help='Window size of the sorted neighbourhood method.')
+@click.option('-mbs', '--max-block-size', type=int, default=500, help='Blocks of tokens shared by more rows are skipped (e.g. stop words).')
+@click.option('-so', '--stats-only', type=bool, default=False, is_flag=True, help='Only report the quality of the blocks without writing the candidate pairs.')
+@click.option('-p', '--processes', type=int, default=None, help='The number of processes to use. If not given, the CPU\'s max. will be used.')
+@click.option('-mi', '--metrics-interval', type=float, default=30, help='Seconds between two progress reports.')
+@click.option('-mf', '--metrics-file', type=str, default=None, help='If given, progress reports are appended to this file as JSON lines.')
+def block(src, dest, method, window, max_block_size, stats_only, processes, metrics_interval, metrics_file):
+  """
+    Generates the candidate pairs of all rows of the filter output at src, without comparing all pairs of rows.
+    The blocks of the selected methods are built in parallel shards (by key) and their pairs are combined.
+
+    The candidate pairs are written to dest/candidates-<n>.json in the format of sample (the match is derived from the wikilinks)
+    and listed in dest/candidates.manifest, so that gen-prompts and predict can format them. Like in a sample, the pairs refer to their rows
+    by [tableID, rowIdx] and each row is written once to the row store dest/rows.
+    The pair completeness (share of matching pairs that are candidates), pair quality (share of candidates that match) and the
+    reduction ratio (share of all pairs that are not candidates) of each method and their combination are logged and written to dest/blocking.stats.
+  """
+
+  if not exists(dest):
+    os.makedirs(dest)
+
+  files = sorted(list_json_files(src))
+  shards = processes or os.cpu_count()
+  history = "history" in method
+
+  reporter = MetricsReporter("block", metrics_interval, metrics_file, totals={"files": len(files)})
+
+  with reporter, Pool(processes, initializer=init_metrics, initargs=(reporter.queue, metrics_interval)) as p:
+
+    # ===== Read rows =====
+    logging.info(f"Reading the rows of {len(files)} files")
+    rows = [row for file_rows in p.starmap(profiled(_read_rows), [(src, f, history) for f in files]) for row in file_rows]
+
+    pointers = [row[0] for row in rows]
+    _, links = np.unique([row[1] for row in rows], return_inverse=True)
+    n = len(rows)
+    logging.info(f"Found {n} rows")
+
+    # ===== Build blocks =====
+    candidates = dict()
+    for m in method:
+      with timer(m):
+        if m == "sorted":
+          candidates[m] = _sorted_neighbourhood([row[2] for row in rows], window)
+        else:
+          keys = [row[3] for row in rows] if m == "token" else [row[4] for row in rows]
+          shard_pairs = p.starmap(profiled(_block_pairs), [(postings, n, max_block_size) for postings in _shard_postings(keys, shards)])
+          candidates[m] = np.unique(np.concatenate(shard_pairs))
+      logging.info(f"{m}: {len(candidates[m])} candidate pairs")
+
+    combined = np.unique(np.concatenate(list(candidates.values()))) if len(candidates) > 1 else list(candidates.values())[0]
+
+    # ===== Quality =====
+    stats = {m: _quality(pairs, links, n) for m, pairs in candidates.items()}
+    if len(candidates) > 1:
+      stats["combined"] = _quality(combined, links, n)
+
+    for name, quality in stats.items():
+      logging.info(f"{name}: {quality['candidates']} candidates, pair completeness: {quality['pairCompleteness']}, pair quality: {quality['pairQuality']}, reduction ratio: {quality['reductionRatio']}")
+
+    with open(join(dest, _STATS_FILE_NAME), "w", encoding="utf-8") as file:
+      file.write(dumps({"methods": list(method), "window": window, "maxBlockSize": max_block_size, "rows": n, "stats": stats}))
+
+    # ===== Output =====
+    if stats_only:
+      return
+
+    reporter.set_total("pairs", len(combined))
+
+    rows_dir = join(dest, ROW_STORE_NAME)
+    if exists(rows_dir):
+      rmtree(rows_dir)
+    os.makedirs(rows_dir)
+
+    # each row is written to the row store by the first shard with a pair of it, the other shards skip it
+    owner = np.full(n, -1, dtype=np.int64)
+
+    input = []
+    for shard, pairs in enumerate(np.array_split(combined, shards)):
+      left, right = pairs // n, pairs % n
+      shard_pointers = [(pointers[i], pointers[j], bool(links[i] == links[j])) for i, j in zip(left.tolist(), right.tolist())]
+
+      ids = np.unique(np.concatenate([left, right]))
+      owner[ids[owner[ids] == -1]] = shard
+      skipped = [(pointers[i][3], pointers[i][2]) for i in ids[owner[ids] != shard].tolist()]
+
+      input.append((src, join(dest, f"{_CANDIDATES_NAME}-{shard + 1}.json"), rows_dir, f"{ROW_STORE_NAME}-{shard + 1}", shard_pointers, skipped))
+
+    for _, dest_path, *_ in input:
+      if exists(dest_path):
+        os.remove(dest_path)
+
+    p.starmap(profiled(_write_pairs), input)
+
+  store = merge_row_stores(rows_dir, [store_name for _, _, _, store_name, _, _ in input])
+
+  parts = [{"name": f"{_CANDIDATES_NAME}-{shard + 1}.json", "bytes": getsize(path), "lines": len(shard_pointers)} for shard, (_, path, _, _, shard_pointers, _) in enumerate(input) if exists(path)]
+  write_manifest(join(dest, _CANDIDATES_NAME + MANIFEST_EXTENSION), parts, {"rows": relpath(store, dest)})
+  logging.info(f"Wrote {len(combined)} candidate pairs to {len(parts)} files")
+
+def _read_rows(src_dir: str, file_name: str, history: bool) -> list:
+  """
+    Returns (pointer, link identifier, text of the newest revision, tokens of the newest revision, tokens of all revisions) of each row in the file.
+    The pointer is the (file_name, byte_offset, row_idx, table_id) of the row as used by sample. The tokens of all revisions are only computed if history is set.
+  """
+
+  rows = []
+
+  with open_compressed(join(src_dir, file_name), "rb") as src_file:
+
+    offset = 0
+
+    for line in src_file:
+
+      doc = loads(line)
+      page_title = doc["pageTitle"]
+
+      for row_idx, row in enumerate(doc["rows"]):
+
+        link = WikilinkResult.from_dict(row["link"])
+        text = get_text(get_tr(row["revisions"][-1]), page_title, " ").lower()
+        tokens = _tokens(text)
+
+        history_tokens = None
+        if history:
+          history_tokens = set(tokens)
+          # revisions that only changed in other rows of the table have the same row
+          for tr in set([get_tr(rev) for rev in row["revisions"][:-1]]):
+            history_tokens.update(_tokens(get_text(tr, page_title, " ").lower()))
+
+        rows.append(((file_name, offset, row_idx, doc["tableID"]), link.identifier, text, tokens, history_tokens))
+
+      offset = src_file.tell()
+      incr("rows", len(doc["rows"]))
+
+  incr("files")
+  flush_metrics()
+
+  return rows
+
+def _tokens(text: str) -> set:
+  return set([t for t in re.split(r"\W", text) if t])
+
+def _shard_postings(keys: list, shards: int) -> list:
+  """Distributes the ids of the rows with each key to shards by the key's hash. keys holds the set of keys of each row."""
+
+  postings = [dict() for _ in range(shards)]
+  for row_id, row_keys in enumerate(keys):
+    for key in row_keys:
+      postings[zlib.crc32(key.encode("utf-8")) % shards].setdefault(key, []).append(row_id)
+  return postings
+
+def _block_pairs(postings: dict, n: int, max_block_size: int) -> np.ndarray:
+  """
+    Returns the distinct pairs of rows that share a block as sorted array of keys (smaller id * n + larger id).
+    Blocks with a single row or more than max_block_size rows are skipped.
+  """
+
+  pairs = [np.empty(0, dtype=np.int64)]
+  for row_ids in postings.values():
+    if 1 < len(row_ids) <= max_block_size:
+      ids = np.array(row_ids, dtype=np.int64)
+      left, right = np.triu_indices(len(ids), 1)
+      pairs.append(ids[left] * n + ids[right])
+    else:
+      incr("skipped_blocks")
+
+  incr("blocks", len(postings))
+  flush_metrics()
+
+  return np.unique(np.concatenate(pairs))
+
+def _sorted_neighbourhood(texts: list, window: int) -> np.ndarray:
+  """Returns the distinct pairs of rows that are less than window positions apart when sorted by text, as sorted array of keys (see _block_pairs)."""
+
+  n = len(texts)
+  order = np.argsort(np.array(texts, dtype=object), kind="stable").astype(np.int64)
+
+  pairs = [np.empty(0, dtype=np.int64)]
+  for distance in range(1, min(window, n)):
+    left, right = order[:-distance], order[distance:]
+    pairs.append(np.minimum(left, right) * n + np.maximum(left, right))
+
+  return np.unique(np.concatenate(pairs))
+
+def _quality(pairs: np.ndarray, links: np.ndarray, n: int) -> dict:
+  """Computes the quality of the candidate pairs, given the link of each row (matches share a link)."""
+
+  link_sizes = np.bincount(links)
+  matches = int((link_sizes * (link_sizes - 1) // 2).sum())
+  found = int((links[pairs // n] == links[pairs % n]).sum())
+  all_pairs = n * (n - 1) // 2
+
+  return {
+    "candidates": len(pairs),
+    "matches": matches,
+    "foundMatches": found,
+    "pairCompleteness": found / matches if matches else None,
+    "pairQuality": found / len(pairs) if len(pairs) else None,
+    "reductionRatio": 1 - len(pairs) / all_pairs if all_pairs else None
+  }
+
+def _write_pairs(src_dir: str, dest_path: str, rows_dir: str, store_name: str, pairs: list, skipped: list):
+  """Writes the (pointer1, pointer2, match) pairs in the format of sample and their rows to the row store store_name, except for the skipped ones (keys)."""
+
+  # PairWriter expects the row's content as 5th value of a pointer (not needed here)
+  with RowStoreWriter(rows_dir, name=store_name) as row_store:
+    row_store.skip(skipped)
+    with PairWriter(src_dir, dest_path, row_store) as writer:
+      for pointer1, pointer2, match in pairs:
+        writer.add(pointer1 + (None,), pointer2 + (None,), match)
+        incr("pairs")
+
+  flush_metrics()
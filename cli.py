@@ -9,22 +9,41 @@ from sampling.ditto_prompt import gen_prompts
 
 from filtering.filtering import filter
 
+from blocking.blocking import block
+
 from aggr.reformatter import reformat
 from aggr.aggr import aggr
 
 from eval.eval import eval
 
+from clustering.clustering import cluster
+
+from predict.predict import predict
+
+from bench.bench import bench
+
+from util.profiling.profiler import start_profiling, PROFILE_MODES
+
 @click.group()
-def entry_point():
-  pass
+@click.option('--profile', type=click.Choice(PROFILE_MODES), default=None, help='Profile the command (including its worker processes) with cProfile or a sampling profiler.')
+@click.option('--profile-dir', type=str, default="profile", help='Where to write the merged profile (profile.txt, profile.collapsed).')
+@click.option('--profile-interval', type=float, default=0.005, help='Seconds between two stack samples of the sampling profiler.')
+@click.pass_context
+def entry_point(ctx, profile, profile_dir, profile_interval):
+  if profile:
+    ctx.call_on_close(start_profiling(profile, profile_dir, profile_interval))
 
 entry_point.add_command(filter)
 entry_point.add_command(sample)
+entry_point.add_command(block)
 entry_point.add_command(label)
 entry_point.add_command(gen_prompts)
 entry_point.add_command(reformat)
 entry_point.add_command(aggr)
+entry_point.add_command(predict)
+entry_point.add_command(cluster)
 entry_point.add_command(eval)
+entry_point.add_command(bench)
 
 if __name__ == "__main__":
   entry_point()
\ No newline at end of file
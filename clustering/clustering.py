@@ -0,0 +1,245 @@
+import math
+import os
+import shutil
+from multiprocessing import Pool
+from os.path import join, exists
+import logging
+import click
+import numpy as np
+
+from clustering.union_find import UnionFind
+from clustering.correlation import correlation_clusters
+from eval.engine import cluster_scores
+from util.wiki.wikilink_result import WikilinkResult
+from util.io.json_codec import loads, dumps, dumpb
+from util.io.compressed_io import list_json_files, open_compressed
+from util.profiling.profiler import profiled
+from util.metrics.stage_metrics import MetricsReporter, init_metrics, incr, timer, flush_metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
+
+_CLUSTERS_FILE_NAME = "clusters.json"
+_STATS_FILE_NAME = "clustering.stats"
+_SPILL_DIR_NAME = ".edges"
+
+# Edges of a spill file: root of the component, the two rows and the weight
+_EDGE_DTYPE = np.dtype([("root", np.int64), ("left", np.int64), ("right", np.int64), ("weight", np.float64)])
+# Number of edges that are buffered per spill file
+_SPILL_BUFFER = 1 << 16
+# Max. absolute weight of an edge (log-odds of a confidence of 1 - 1e-6)
+_MAX_WEIGHT = math.log((1 - 1e-6) / 1e-6)
+
+@click.command()
+@click.argument('src', type=str, nargs=-1, required=True)
+@click.option('-o', '--output', type=str, required=True, help='Directory of the clusters (clusters.json) and their stats (clustering.stats).')
+@click.option('-t', '--truth', type=str, default=None, help='Output of filter with the rows\' wikilinks. If given, the clusters are evaluated against the rows\' links.')
+@click.option('-cc', '--correlation', type=bool, default=False, is_flag=True, help='Resolve clusters with contradicting predictions by correlation clustering, weighted by the confidences.')
+@click.option('-it', '--iterations', type=int, default=10, help='Max. number of local improvement rounds of the correlation clustering.')
+@click.option('-sh', '--shards', type=int, default=16, help='Number of files the edges of contradicting clusters are spilled to.')
+@click.option('-p', '--processes', type=int, default=None, help='The number of processes to use. If not given, the CPU\'s max. will be used.')
+@click.option('-mi', '--metrics-interval', type=float, default=30, help='Seconds between two progress reports.')
+@click.option('-mf', '--metrics-file', type=str, default=None, help='If given, progress reports are appended to this file as JSON lines.')
+def cluster(src, output, truth, correlation, iterations, shards, processes, metrics_interval, metrics_file):
+  """
+    Consolidates pairwise predictions into entities (clusters of rows). src are prediction files of predict -fmt, whose lines list the
+    [tableID, rowIdx] of their two rows. Rows that are connected by predicted matches end up in the same cluster (transitive closure).
+
+    Predicted non-matches within a cluster are contradictions. They are counted and, with -cc, the affected clusters are split by correlation
+    clustering: the confidence of each prediction is turned into a weight (log-odds of a match, summed over parallel predictions) and the
+    sum of the weights within clusters is maximized.
+
+    The predictions are streamed, only the rows are kept in memory. With -cc, the edges of contradicting clusters are spilled to disk.
+  """
+
+  if not exists(output):
+    os.makedirs(output)
+
+  # id of each row by (tableID, rowIdx), rows of the truth first
+  ids = dict()
+  rows = []
+  uf = UnionFind()
+  true_links = None
+
+  reporter = MetricsReporter("cluster", metrics_interval, metrics_file)
+
+  with reporter, Pool(processes, initializer=init_metrics, initargs=(reporter.queue, metrics_interval)) as p:
+
+    if truth:
+      files = sorted(list_json_files(truth))
+      logging.info(f"Reading the links of the rows in {len(files)} files")
+      links = []
+      for file_rows in p.starmap(profiled(_read_links), [(truth, f) for f in files]):
+        for table_id, row_idx, link in file_rows:
+          _intern(ids, rows, uf, table_id, row_idx)
+          links.append(link)
+      _, true_links = np.unique(links, return_inverse=True)
+
+    # ===== Transitive closure of the matches =====
+    logging.info("Merging the matches")
+    edges = 0
+    for left, right, weight in _read_edges(src, ids, rows, uf):
+      edges += 1
+      incr("predictions")
+      if weight > 0:
+        uf.union(left, right)
+    labels = uf.labels()
+    logging.info(f"{edges} predictions of {len(rows)} rows")
+
+    # ===== Contradictions =====
+    spill_dir = join(output, _SPILL_DIR_NAME)
+    if correlation:
+      shutil.rmtree(spill_dir, ignore_errors=True)
+      os.makedirs(spill_dir)
+
+    with _EdgeSpiller(spill_dir, shards) if correlation else _NoSpiller() as spiller:
+      conflicts = 0
+      conflicted = set()
+      for left, right, weight in _read_edges(src, ids, rows, uf):
+        root = labels[left]
+        if root != labels[right]:
+          continue
+        if weight <= 0:
+          conflicts += 1
+          conflicted.add(int(root))
+        spiller.add(root, left, right, weight)
+
+    logging.info(f"{conflicts} predicted non-matches within {len(conflicted)} clusters")
+
+    # ===== Correlation clustering =====
+    if correlation and conflicted:
+      logging.info(f"Splitting {len(conflicted)} clusters by correlation clustering")
+      conflicted_roots = np.array(sorted(conflicted), dtype=np.int64)
+      input = [(path, conflicted_roots, iterations) for path in spiller.paths]
+      next_label = len(rows)
+      for components in p.starmap(profiled(_cluster_shard), input):
+        for nodes, component_labels in components:
+          _, component_labels = np.unique(component_labels, return_inverse=True)
+          labels[nodes] = next_label + component_labels
+          next_label += component_labels.max() + 1
+
+    shutil.rmtree(spill_dir, ignore_errors=True)
+
+  # ===== Output =====
+  _, labels = np.unique(labels, return_inverse=True)
+
+  with open(join(output, _CLUSTERS_FILE_NAME), "wb") as file:
+    for (table_id, row_idx), label in zip(rows, labels.tolist()):
+      file.write(dumpb({"tableID": table_id, "rowIdx": row_idx, "cluster": label}) + b"\n")
+
+  stats = {"rows": len(rows), "predictions": edges, "clusters": int(labels.max()) + 1 if len(rows) else 0, "contradictions": conflicts, "contradictingClusters": len(conflicted), "correlation": correlation}
+
+  if truth:
+    stats["scores"] = cluster_scores(labels[:len(true_links)], true_links)
+    scores = stats["scores"]
+    logging.info(f"Pairwise precision: {scores['precision']}, recall: {scores['recall']}, F1: {scores['F1']}")
+    logging.info(f"B-cubed precision: {scores['bcubedPrecision']}, recall: {scores['bcubedRecall']}, exact clusters: {scores['exactClusters']}")
+
+  with open(join(output, _STATS_FILE_NAME), "w", encoding="utf-8") as file:
+    file.write(dumps(stats))
+
+def _intern(ids: dict, rows: list, uf: UnionFind, table_id, row_idx: int) -> int:
+  key = (table_id, row_idx)
+  id = ids.get(key)
+  if id is None:
+    id = ids[key] = uf.add()
+    rows.append(key)
+  return id
+
+def _read_edges(paths: list, ids: dict, rows: list, uf: UnionFind):
+  """Yields the two row ids and the weight (log-odds of a match) of each prediction in the files. Unknown rows are added."""
+
+  for path in paths:
+    with open_compressed(path, "rb") as file:
+      for line in file:
+        prediction = loads(line)
+        if "rows" not in prediction:
+          raise click.BadParameter(f"{path} has predictions without rows (use predict -fmt)", param_hint="src")
+
+        (table1, row1), (table2, row2) = prediction["rows"]
+        left = _intern(ids, rows, uf, table1, row1)
+        right = _intern(ids, rows, uf, table2, row2)
+
+        yield left, right, _weight(prediction["match"] == 1, prediction.get("match_confidence"))
+
+def _weight(match: bool, confidence: float) -> float:
+  """The log-odds of a match, given the prediction and its confidence. Predictions without confidence weigh 1 (-1)."""
+
+  if confidence is None:
+    return 1. if match else -1.
+
+  probability = confidence if match else 1 - confidence
+  if probability <= 0 or probability >= 1:
+    return _MAX_WEIGHT if probability >= 1 else -_MAX_WEIGHT
+  return max(-_MAX_WEIGHT, min(_MAX_WEIGHT, math.log(probability / (1 - probability))))
+
+def _read_links(src_dir: str, file_name: str) -> list:
+  """Returns (tableID, rowIdx, link identifier) of each row in the file."""
+
+  rows = []
+  with open_compressed(join(src_dir, file_name), "rb") as src_file:
+    for line in src_file:
+      doc = loads(line)
+      for row_idx, row in enumerate(doc["rows"]):
+        rows.append((doc["tableID"], row_idx, WikilinkResult.from_dict(row["link"]).identifier))
+      incr("tables")
+
+  flush_metrics()
+  return rows
+
+def _cluster_shard(path: str, conflicted_roots: np.ndarray, iterations: int) -> list:
+  """Splits the contradicting clusters whose edges were spilled to path. Returns the rows and new (local) labels of each cluster."""
+
+  edges = np.fromfile(path, dtype=_EDGE_DTYPE) if exists(path) else np.empty(0, dtype=_EDGE_DTYPE)
+  edges = edges[np.isin(edges["root"], conflicted_roots)]
+  edges = edges[np.argsort(edges["root"], kind="stable")]
+
+  components = []
+  roots, starts = np.unique(edges["root"], return_index=True)
+  for start, end in zip(starts, list(starts[1:]) + [len(edges)]):
+    component = edges[start:end]
+    nodes, local = np.unique(np.concatenate([component["left"], component["right"]]), return_inverse=True)
+    with timer("correlation"):
+      labels = correlation_clusters(len(nodes), local[:len(component)], local[len(component):], component["weight"], iterations)
+    components.append((nodes, labels))
+    incr("split_clusters")
+
+  flush_metrics()
+  return components
+
+class _EdgeSpiller:
+  """Appends the edges within clusters to one of shards files by their cluster's root, so that each cluster is in a single file."""
+
+  def __init__(self, dir: str, shards: int):
+    self.paths = [join(dir, f"edges-{i}.bin") for i in range(shards)]
+    self._buffers = [[] for _ in range(shards)]
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    for shard in range(len(self.paths)):
+      self._flush(shard)
+
+  def add(self, root: int, left: int, right: int, weight: float):
+    shard = int(root) % len(self.paths)
+    self._buffers[shard].append((root, left, right, weight))
+    if len(self._buffers[shard]) >= _SPILL_BUFFER:
+      self._flush(shard)
+
+  def _flush(self, shard: int):
+    if self._buffers[shard]:
+      with open(self.paths[shard], "ab") as file:
+        np.array(self._buffers[shard], dtype=_EDGE_DTYPE).tofile(file)
+      self._buffers[shard] = []
+
+class _NoSpiller:
+  """Drops the edges (without correlation clustering)."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    pass
+
+  def add(self, root: int, left: int, right: int, weight: float):
+    pass
@@ -0,0 +1,52 @@
+from collections import defaultdict
+import numpy as np
+
+def correlation_clusters(n: int, left: np.ndarray, right: np.ndarray, weights: np.ndarray, iterations: int = 10) -> np.ndarray:
+  """
+    Clusters the nodes 0..n-1 of a component, so that the sum of the weights of the edges within clusters is (approximately) maximal.
+    Positive weights are evidence for a match, negative ones against it, missing edges are neutral.
+    Starts from the clusters of pivots (KwikCluster, in the order of the positive weighted degree) and moves single nodes to the neighbouring cluster
+    with the highest gain until no move improves the clustering or the iterations are used up. Returns the cluster label of each node.
+  """
+
+  # sum parallel edges (e.g. one per zipped revision pair)
+  adjacency = [defaultdict(float) for _ in range(n)]
+  for u, v, w in zip(left.tolist(), right.tolist(), weights.tolist()):
+    if u != v:
+      adjacency[u][v] += w
+      adjacency[v][u] += w
+
+  degrees = [sum([w for w in neighbours.values() if w > 0]) for neighbours in adjacency]
+  labels = [-1] * n
+
+  for pivot in sorted(range(n), key=lambda v: (-degrees[v], v)):
+    if labels[pivot] >= 0:
+      continue
+    labels[pivot] = pivot
+    for v, w in adjacency[pivot].items():
+      if w > 0 and labels[v] < 0:
+        labels[v] = pivot
+
+  # labels >= n are singletons that were split off
+  for _ in range(iterations):
+    moved = False
+
+    for v in range(n):
+      gains = defaultdict(float)
+      for u, w in adjacency[v].items():
+        gains[labels[u]] += w
+
+      current = gains.get(labels[v], 0)
+      best = max(gains, key=lambda label: (gains[label], -label), default=None)
+
+      if best is not None and best != labels[v] and gains[best] > current and gains[best] > 0:
+        labels[v] = best
+        moved = True
+      elif current < 0:
+        labels[v] = n + v
+        moved = True
+
+    if not moved:
+      break
+
+  return np.array(labels, dtype=np.int64)
@@ -0,0 +1,52 @@
+from array import array
+import numpy as np
+
+class UnionFind:
+  """
+    Disjoint sets of the ids 0..n-1 backed by two arrays of 8 bytes per id (parent and size), so that it holds tens of millions of ids.
+    find compresses paths (path halving) and union attaches the smaller set to the larger one.
+  """
+
+  def __init__(self, n: int = 0):
+    self._parent = array("q", range(n))
+    self._size = array("q", [1]) * n
+
+  def __len__(self):
+    return len(self._parent)
+
+  def add(self) -> int:
+    """Adds a singleton set and returns its id."""
+
+    id = len(self._parent)
+    self._parent.append(id)
+    self._size.append(1)
+    return id
+
+  def find(self, x: int) -> int:
+    parent = self._parent
+    while parent[x] != x:
+      parent[x] = parent[parent[x]]
+      x = parent[x]
+    return x
+
+  def union(self, x: int, y: int) -> bool:
+    """Merges the sets of x and y. Returns False if they were already in the same set."""
+
+    x, y = self.find(x), self.find(y)
+    if x == y:
+      return False
+    if self._size[x] < self._size[y]:
+      x, y = y, x
+    self._parent[y] = x
+    self._size[x] += self._size[y]
+    return True
+
+  def labels(self) -> np.ndarray:
+    """Returns the root of each id's set."""
+
+    parent = np.frombuffer(self._parent, dtype=np.int64).copy()
+    while True:
+      grandparent = parent[parent]
+      if np.array_equal(grandparent, parent):
+        return parent
+      parent = grandparent
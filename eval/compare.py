@@ -1,6 +1,6 @@
 import click
 
-from eval.metrics import compute_metrics
+from eval.engine import load_predictions, load_truth, error_matrix
 
 @click.command() 
 @click.argument('base_src', type=str)
@@ -11,17 +11,7 @@ def compare(base_src, compare_src, truth):
      truth should be the file with the ground truth labels.
   """
   
-  bTP, bTN, bFP, bFN = compute_metrics(base_src, truth)
-  cTP, cTN, cFP, cFN = compute_metrics(compare_src, truth)
-
-  bT = [tp or tn for tp, tn in zip(bTP, bTN)]
-  cT = [tp or tn for tp, tn in zip(cTP, cTN)]
-
-  bases = [bT, bFP, bFN]
-  comps = [cT, cFP, cFN]
-
-
-  results = [[len([1 for c, v in zip(cVals, bVals) if c and v]) for cVals in comps] for bVals in bases]
+  results = error_matrix(load_predictions(base_src), load_predictions(compare_src), load_truth(truth))
 
   click.echo(f"--------------- Comp ---------------")
   click.echo(f"       TP/TN,    FP,    FN")
@@ -0,0 +1,136 @@
+import numpy as np
+
+from util.io.json_codec import load_fields
+from util.io.compressed_io import open_compressed
+
+# Columns of a confusion matrix as returned by confusion
+TP, TN, FP, FN = range(4)
+
+# Number of bootstrap samples that are drawn at once. Each one needs 4 bytes per prediction.
+_BOOTSTRAP_CHUNK = 64
+
+def load_predictions(path: str) -> np.ndarray:
+  """
+    Reads a file with one prediction per line (ditto's output or the output of aggr aggregate) as boolean array.
+    Raises a ValueError for a line without match (e.g. of an .index file), instead of reading it as non-match.
+  """
+
+  predictions = []
+  with open_compressed(path, "rb") as file:
+    for line_idx, line in enumerate(file):
+      fields = load_fields(line, ["match"])
+      if "match" not in fields:
+        raise ValueError(f"Line {line_idx + 1} of {path} is no prediction (it has no match)")
+      predictions.append(fields["match"] == 1)
+  return np.array(predictions, dtype=bool)
+
+def load_truth(path: str) -> np.ndarray:
+  """Reads the labels (third column) of a prompt file (e.g. test.txt.s) as boolean array."""
+
+  with open_compressed(path, "r", encoding="utf-8") as file:
+    return np.array([line.strip().split('\t')[2].strip() == str(1) for line in file], dtype=bool)
+
+def outcomes(predictions: np.ndarray, truth: np.ndarray) -> np.ndarray:
+  """
+    Returns the outcome (TP, TN, FP or FN) of each prediction.
+    predictions is a boolean array of shape (n) or (files, n), truth a boolean array of shape (n).
+  """
+
+  if predictions.shape[-1] != truth.shape[0]:
+    raise ValueError(f"Got {predictions.shape[-1]} predictions for {truth.shape[0]} labels")
+
+  # FN=3, FP=2, TN=1, TP=0
+  return np.where(predictions == truth, np.where(truth, TP, TN), np.where(truth, FN, FP))
+
+def confusion(predictions: np.ndarray, truth: np.ndarray) -> np.ndarray:
+  """Returns the confusion matrices (TP, TN, FP, FN counts) of shape (4) or (files, 4) for the predictions of one or multiple files."""
+
+  outcome = outcomes(np.atleast_2d(predictions), truth)
+  matrices = np.stack([(outcome == i).sum(axis=-1) for i in range(4)], axis=-1)
+  return matrices if predictions.ndim > 1 else matrices[0]
+
+def scores(matrices: np.ndarray) -> np.ndarray:
+  """Returns precision, recall and F1 (last axis) for confusion matrices of any shape (..., 4). Undefined scores are nan."""
+
+  tp, fp, fn = [matrices[..., i].astype(float) for i in [TP, FP, FN]]
+  with np.errstate(divide="ignore", invalid="ignore"):
+    precision = tp / (tp + fp)
+    recall = tp / (tp + fn)
+    f1 = 2 * tp / (2 * tp + fp + fn)
+  return np.stack([precision, recall, f1], axis=-1)
+
+def error_matrix(base: np.ndarray, compare: np.ndarray, truth: np.ndarray) -> np.ndarray:
+  """
+    Compares the outcomes of two prediction files. Returns a 3x3 matrix whose rows are the base's outcomes (TP/TN, FP, FN)
+    and whose columns are the outcomes of compare.
+  """
+
+  # merge TP and TN into one class (0)
+  base_outcome = np.maximum(outcomes(base, truth) - 1, 0)
+  compare_outcome = np.maximum(outcomes(compare, truth) - 1, 0)
+  return np.bincount(base_outcome * 3 + compare_outcome, minlength=9).reshape(3, 3)
+
+def bootstrap(predictions: np.ndarray, truth: np.ndarray, samples: int = 1000, alpha: float = 0.05, seed: int = None) -> np.ndarray:
+  """
+    Computes bootstrap confidence intervals of precision, recall and F1 for the predictions of one or multiple files.
+    All files are evaluated on the same resamples of the pairs. Returns the lower and upper bounds with shape ([files,] 3, 2).
+  """
+
+  outcome = outcomes(np.atleast_2d(predictions), truth)
+  # one-hot outcomes of shape (n, files * 4)
+  one_hot = np.concatenate([(outcome == i).T for i in range(4)], axis=1).astype(np.int32)
+
+  rng = np.random.default_rng(seed)
+  n = truth.shape[0]
+  files = outcome.shape[0]
+  matrices = []
+
+  for start in range(0, samples, _BOOTSTRAP_CHUNK):
+    size = min(_BOOTSTRAP_CHUNK, samples - start)
+    # how often each pair is drawn by each resample
+    weights = rng.multinomial(n, np.full(n, 1 / n), size=size).astype(np.int32)
+    counts = weights @ one_hot
+    matrices.append(counts.reshape(size, 4, files).transpose(0, 2, 1))
+
+  resampled = scores(np.concatenate(matrices))
+  bounds = np.nanquantile(resampled, [alpha / 2, 1 - alpha / 2], axis=0)
+  intervals = np.moveaxis(bounds, 0, -1)
+  return intervals if predictions.ndim > 1 else intervals[0]
+
+def cluster_scores(predicted: np.ndarray, truth: np.ndarray) -> dict:
+  """
+    Compares a clustering of the same items with the true one, given the cluster label of each item.
+    Returns the pairwise precision, recall and F1 (of the pairs within clusters), B-cubed precision and recall,
+    and the share of true clusters (with more than one item) that were found exactly.
+  """
+
+  # contingency of the predicted and true clusters
+  (pred_ids, true_ids), overlap = np.unique(np.stack([predicted, truth]), axis=1, return_counts=True)
+  pred_labels, pred_sizes = np.unique(predicted, return_counts=True)
+  true_labels, true_sizes = np.unique(truth, return_counts=True)
+
+  def _pairs(sizes):
+    return int((sizes.astype(np.int64) * (sizes - 1) // 2).sum())
+
+  both, pred_pairs, true_pairs = _pairs(overlap), _pairs(pred_sizes), _pairs(true_sizes)
+  precision = both / pred_pairs if pred_pairs else float("nan")
+  recall = both / true_pairs if true_pairs else float("nan")
+
+  # size of the predicted and true cluster of each cell of the contingency
+  pred_of_cell = pred_sizes[np.searchsorted(pred_labels, pred_ids)]
+  true_of_cell = true_sizes[np.searchsorted(true_labels, true_ids)]
+  n = len(predicted)
+
+  exact = (overlap == pred_of_cell) & (overlap == true_of_cell) & (overlap > 1)
+
+  return {
+    "items": n,
+    "clusters": len(pred_sizes),
+    "trueClusters": len(true_sizes),
+    "precision": precision,
+    "recall": recall,
+    "F1": 2 * both / (pred_pairs + true_pairs) if pred_pairs + true_pairs else float("nan"),
+    "bcubedPrecision": float((overlap ** 2 / pred_of_cell).sum() / n) if n else float("nan"),
+    "bcubedRecall": float((overlap ** 2 / true_of_cell).sum() / n) if n else float("nan"),
+    "exactClusters": int(exact.sum()) / int((true_sizes > 1).sum()) if (true_sizes > 1).any() else float("nan")
+  }
@@ -2,6 +2,7 @@ import click
 
 from eval.metrics import metrics
 from eval.compare import compare
+from eval.grid import grid
 
 @click.group()
 def eval():
@@ -9,4 +10,5 @@ def eval():
   pass
 
 eval.add_command(metrics)
-eval.add_command(compare)
\ No newline at end of file
+eval.add_command(compare)
+eval.add_command(grid)
\ No newline at end of file
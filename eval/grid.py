@@ -0,0 +1,101 @@
+import os
+from os.path import isfile, join, splitext
+import click
+import numpy as np
+
+from eval.engine import load_predictions, load_truth, confusion, scores, bootstrap
+from util.io.compressed_io import codec_of, extension_of
+from util.io.json_codec import dumps
+
+# Extensions of prediction files in directories (ditto writes .jsonl, aggr aggregate .json), optionally compressed. Other files (e.g. .index or .blocks) are ignored.
+_PREDICTION_EXTENSIONS = [".json", ".jsonl"]
+
+@click.command()
+@click.argument('src', type=str, nargs=-1, required=True)
+@click.option('-t', '--truth', type=str, multiple=True, required=True, help='File with ground truth labels (e.g. test.txt.s). Can be repeated, e.g. for multiple sizes.')
+@click.option('-b', '--bootstrap-samples', type=int, default=1000, help='Number of bootstrap samples for the 95% confidence intervals (0 to disable).')
+@click.option('-s', '--seed', type=int, default=None, help='Seed for the bootstrap samples.')
+@click.option('-o', '--output', type=str, default=None, help='If given, the results are also written to this file as JSON lines.')
+def grid(src, truth, bootstrap_samples, seed, output):
+  """
+    Evaluates many prediction files at once, e.g. of all formats, sizes and aggregators. src are prediction files or directories that
+    are searched for .json and .jsonl files. Each prediction file is evaluated on the truth file with the same number of labels.
+    All predictions on the same truth are evaluated on the same bootstrap samples.
+  """
+
+  truths = {path: load_truth(path) for path in truth}
+  by_length = dict()
+  for path, labels in truths.items():
+    if len(labels) in by_length:
+      raise click.BadParameter(f"{path} and {by_length[len(labels)]} have the same number of labels", param_hint="truth")
+    by_length[len(labels)] = path
+
+  # group the prediction files by their truth
+  groups = dict()
+  for path in _find_prediction_files(src):
+    try:
+      predictions = load_predictions(path)
+    except ValueError as e:
+      # files found in directories may be other outputs (e.g. the metrics.json of aggr aggregate)
+      if path in src:
+        raise click.BadParameter(str(e), param_hint="src")
+      click.echo(f"Skipping {path}: {e}", err=True)
+      continue
+    if len(predictions) not in by_length:
+      click.echo(f"Skipping {path}: no truth with {len(predictions)} labels", err=True)
+      continue
+    groups.setdefault(by_length[len(predictions)], []).append((path, predictions))
+
+  results = []
+  for truth_path, files in groups.items():
+    predictions = np.stack([p for _, p in files])
+    matrices = confusion(predictions, truths[truth_path])
+    file_scores = scores(matrices)
+    intervals = bootstrap(predictions, truths[truth_path], bootstrap_samples, seed=seed) if bootstrap_samples > 0 else None
+
+    for i, (path, _) in enumerate(files):
+      result = {
+        "predictions": path,
+        "truth": truth_path,
+        "confusion": dict(zip(["TP", "TN", "FP", "FN"], matrices[i].tolist())),
+        "precision": file_scores[i][0],
+        "recall": file_scores[i][1],
+        "f1": file_scores[i][2]
+      }
+      if intervals is not None:
+        result["ci"] = dict(zip(["precision", "recall", "f1"], intervals[i].tolist()))
+      results.append(result)
+
+  results.sort(key=lambda r: (r["truth"], -np.nan_to_num(r["f1"], nan=-1)))
+
+  click.echo(f"{'F1':>7} {'P':>7} {'R':>7} {'F1 95% CI':>17}  predictions")
+  for result in results:
+    ci = f"[{_percent(result['ci']['f1'][0])}, {_percent(result['ci']['f1'][1])}]" if "ci" in result else ""
+    click.echo(f"{_percent(result['f1']):>7} {_percent(result['precision']):>7} {_percent(result['recall']):>7} {ci:>17}  {result['predictions']}")
+
+  if output:
+    with open(output, "w", encoding="utf-8") as file:
+      for result in results:
+        file.write(dumps(result) + "\n")
+
+def _find_prediction_files(paths: list) -> list:
+  files = []
+  for path in paths:
+    if isfile(path):
+      files.append(path)
+      continue
+    for root, _, names in os.walk(path):
+      for name in sorted(names):
+        if _is_prediction_file(name):
+          files.append(join(root, name))
+  return sorted(files)
+
+def _is_prediction_file(name: str) -> bool:
+  """True if the extension of name (without a compression suffix) is one of prediction files, e.g. pred.jsonl.gz but not pred.jsonl.index."""
+
+  compression = extension_of(codec_of(name))
+  stem = name[:-len(compression)] if compression else name
+  return splitext(stem)[1] in _PREDICTION_EXTENSIONS
+
+def _percent(value: float) -> str:
+  return "nan" if np.isnan(value) else f"{round(value * 100, 2)}%"
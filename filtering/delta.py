@@ -0,0 +1,226 @@
+import logging
+import os
+from multiprocessing import Pool
+from os.path import join, exists, basename
+
+from util.cache.stage_cache import file_fingerprint
+from util.io.compressed_io import list_json_files, strip_json_extension, open_compressed
+from util.io.json_codec import loads, dumpb, load_fields
+
+# Directory in the filter's dest that stores the tables changed by deltas and the index of all tables
+_DELTA_DIR = ".delta"
+_INDEX_FILE = "tables.index"
+
+class TableStore:
+  """
+    Locates the current Stage-4 version of each table: in the base files at src or, if a delta changed the table, in the overlay files at dest/.delta.
+    Each table is assigned to a stem, the name of the filter output it belongs to (e.g. part0 for the base file part0.json).
+
+    The index (tableID -> stem, file, offset and whether the file is an overlay) is stored in dest/.delta/tables.index.
+    Base files are only indexed again if they changed since they were indexed.
+  """
+
+  def __init__(self, src: str, dest: str):
+    self.src = src
+    self.dir = join(dest, _DELTA_DIR)
+    self._files = dict()
+    self._tables = dict()
+
+    index_path = join(self.dir, _INDEX_FILE)
+    if exists(index_path):
+      with open(index_path, "rb") as file:
+        index = loads(file.read())
+      self._files = index["files"]
+      self._tables = index["tables"]
+
+  @staticmethod
+  def exists(dest: str) -> bool:
+    """True if deltas were applied to the filter output at dest."""
+
+    return exists(join(dest, _DELTA_DIR, _INDEX_FILE))
+
+  def refresh(self, processes: int = None):
+    """Indexes the base files that are new or changed since they were indexed."""
+
+    changed = []
+    for file_name in list_json_files(self.src):
+      fingerprint = file_fingerprint(join(self.src, file_name))
+      if self._files.get(file_name) != fingerprint:
+        changed.append((file_name, fingerprint))
+
+    if len(changed) == 0:
+      return
+
+    logging.info(f"Indexing the tables of {len(changed)} files")
+    changed_names = set([file_name for file_name, _ in changed])
+    self._tables = {table_id: location for table_id, location in self._tables.items() if location[3] or location[1] not in changed_names}
+
+    with Pool(processes) as p:
+      indices = p.starmap(_index_file, [(self.src, file_name) for file_name, _ in changed])
+
+    for (file_name, fingerprint), index in zip(changed, indices):
+      stem = strip_json_extension(file_name)
+      for table_id, offset in index:
+        # tables that were changed by a delta stay in the overlay
+        if table_id not in self._tables:
+          self._tables[table_id] = (stem, file_name, offset, False)
+      self._files[file_name] = fingerprint
+
+  def apply(self, delta_paths: list) -> dict:
+    """
+      Merges the tables of the given delta files into their current versions and writes the results to a new overlay file.
+      Tables that are not known yet are assigned to the stem delta-<name of the delta file>.
+      Returns the changed tables per stem (stem -> tableID -> location).
+    """
+
+    os.makedirs(self.dir, exist_ok=True)
+    overlay_name = f"overlay-{len([f for f in os.listdir(self.dir) if f.startswith('overlay-')]) + 1}.json"
+    changed = dict()
+
+    deltas = []
+    for delta_path in delta_paths:
+      default_stem = "delta-" + strip_json_extension(basename(delta_path))
+      with open_compressed(delta_path, "rb") as file:
+        deltas.extend([(default_stem, loads(line)) for line in file])
+
+    # read the current versions of the changed tables at once, so that each file is read in the order of the offsets
+    current = read_tables(self.src, self.dir, {delta["tableID"]: self._tables[delta["tableID"]] for _, delta in deltas if delta["tableID"] in self._tables})
+
+    # merge all deltas first, a table might be changed by multiple deltas
+    merged = dict()
+    for default_stem, delta in deltas:
+      table_id = delta["tableID"]
+      if table_id in merged:
+        stem, doc = merged[table_id]
+      else:
+        location = self._tables.get(table_id)
+        stem, doc = (location[0], current[table_id]) if location else (default_stem, None)
+      merged[table_id] = (stem, merge_delta(doc, delta))
+
+    with open(join(self.dir, overlay_name), "wb") as file:
+      for table_id, (stem, doc) in merged.items():
+        location = (stem, overlay_name, file.tell(), True)
+        file.write(dumpb(doc) + b"\n")
+        self._tables[table_id] = location
+        changed.setdefault(stem, dict())[table_id] = location
+
+    logging.info(f"Merged {len(merged)} changed tables into {overlay_name}")
+    return changed
+
+  def overlays(self) -> dict:
+    """Returns the tables that were changed by deltas per stem (stem -> tableID -> location)."""
+
+    overlays = dict()
+    for table_id, location in self._tables.items():
+      if location[3]:
+        overlays.setdefault(location[0], dict())[table_id] = location
+    return overlays
+
+  def overlay_files(self, overlay: dict) -> list:
+    """Returns the paths of the overlay files that contain the given tables (tableID -> location)."""
+
+    return sorted(set([join(self.dir, location[1]) for location in overlay.values()]))
+
+  def read(self, location) -> dict:
+    """Reads the table at the given location."""
+
+    return read_table(self.src, self.dir, location)
+
+  def save(self):
+    os.makedirs(self.dir, exist_ok=True)
+    path = join(self.dir, _INDEX_FILE)
+    with open(path + ".tmp", "wb") as file:
+      file.write(dumpb({"files": self._files, "tables": self._tables}))
+    os.replace(path + ".tmp", path)
+
+def read_table(src: str, overlay_dir: str, location) -> dict:
+  """Reads the table at a location of the TableStore."""
+
+  _, file_name, offset, is_overlay = location
+  with open_compressed(join(overlay_dir if is_overlay else src, file_name), "rb") as file:
+    file.seek(offset)
+    return loads(file.readline())
+
+def read_tables(src: str, overlay_dir: str, locations: dict) -> dict:
+  """
+    Reads the tables at the given locations of the TableStore (tableID -> location) and returns them by tableID.
+    Each file is opened once and read in the order of the offsets, so that compressed files without block table are decompressed only once.
+  """
+
+  files = dict()
+  for table_id, (_, file_name, offset, is_overlay) in locations.items():
+    files.setdefault(join(overlay_dir if is_overlay else src, file_name), []).append((offset, table_id))
+
+  tables = dict()
+  for path, offsets in files.items():
+    with open_compressed(path, "rb") as file:
+      for offset, table_id in sorted(offsets):
+        file.seek(offset)
+        tables[table_id] = loads(file.readline())
+  return tables
+
+def iter_tables(src: str, overlay_dir: str, file_name: str, overlay: dict):
+  """
+    Yields the tables of the base file, replacing the ones that were changed by deltas with their version in the overlay.
+    Tables of the overlay that are not in the base file are yielded at the end. file_name might be None if the stem has no base file.
+  """
+
+  remaining = dict(overlay)
+
+  if file_name:
+    with open_compressed(join(src, file_name), "rb") as file:
+      for line in file:
+        if remaining:
+          table_id = load_fields(line, ["tableID"])["tableID"]
+          if table_id in remaining:
+            yield read_table(src, overlay_dir, remaining.pop(table_id))
+            continue
+        yield loads(line)
+
+  for location in remaining.values():
+    yield read_table(src, overlay_dir, location)
+
+def merge_delta(base: dict, delta: dict) -> dict:
+  """
+    Merges the revisions of a delta into the current version of a table. Both are Stage-4 documents.
+    Top-level properties (e.g. pageTitle, lastRevisionID or subjectColumnIndex) are taken from the delta and the schemas are united.
+    Rows are matched by their clusterId. Revisions with an existing revisionID replace the old ones, new rows are appended.
+  """
+
+  if base is None:
+    return delta
+
+  doc = dict(base)
+  doc.update({k: v for k, v in delta.items() if k not in ["rows", "schemas"]})
+  doc["schemas"] = {**base.get("schemas", dict()), **delta.get("schemas", dict())}
+
+  rows = {row["clusterId"]: row for row in base["rows"]}
+  for delta_row in delta.get("rows", []):
+
+    row = rows.get(delta_row["clusterId"])
+    if row is None:
+      rows[delta_row["clusterId"]] = delta_row
+      continue
+
+    revisions = {rev["revisionID"]: rev for rev in row["revisions"]}
+    revisions.update({rev["revisionID"]: rev for rev in delta_row["revisions"]})
+
+    row = dict(row)
+    row.update({k: v for k, v in delta_row.items() if k != "revisions"})
+    # revision ids increase over time
+    row["revisions"] = sorted(revisions.values(), key=lambda rev: rev["revisionID"])
+    rows[delta_row["clusterId"]] = row
+
+  doc["rows"] = list(rows.values())
+  return doc
+
+def _index_file(src_dir: str, file_name: str) -> list:
+  """Returns the tableID and byte offset of each table in the file."""
+
+  index = []
+  with open_compressed(join(src_dir, file_name), "rb") as file:
+    offset = 0
+    for line in file:
+      index.append((load_fields(line, ["tableID"])["tableID"], offset))
+      offset = file.tell()
+  return index
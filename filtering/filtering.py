@@ -1,17 +1,22 @@
-import datetime
-from os import listdir
-from os.path import isfile, join, exists
+import os
+from collections import Counter
+from os.path import join, exists
 from multiprocessing import Pool
-import json
 import logging
-import re
 from click import echo
 import numpy as np
 import click
-from util.wiki.wiki_table_util import get_tr
 
-from util.wiki.wikilink_util import extract_wikilink, parse_wiki_date
-from util.html.html_util import get_text, contains_list
+from util.io.json_codec import loads, dumpb, load_fields
+from util.io.compressed_io import COMPRESSIONS, BLOCK_TABLE_SUFFIX, list_json_files, strip_json_extension, extension_of, open_compressed
+from util.rotating_file_writer import RotatingFileWriter, MANIFEST_EXTENSION, read_manifest, write_manifest
+from util.cache.stage_cache import StageCache, CACHE_MODES, file_fingerprint
+from util.profiling.profiler import profiled
+from util.metrics.stage_metrics import MetricsReporter, init_metrics, incr, timer, flush_metrics
+from util.dist.claims import WorkClaims, run_claimed
+from util.tasks.task_runner import TaskRunner, REJECTS_DIR, reject
+from filtering.delta import TableStore, iter_tables, read_table
+from filtering.rules import RuleEngine, RowContext, TableContext, row_rules, table_rules
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
 
@@ -19,52 +24,275 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(pr
 # between precision and recall.
 _THRESHOLD = 0.969
 
+# Manually labeled subject columns (tableID -> true subject column index).
+# Loaded once by the parent and handed to each worker by _init_worker.
+_labeled_subject_cols = dict()
+
+# Directory of the lease files of the distributed mode (see WorkClaims)
+_CLAIMS_DIR = join(".claims", "filter")
+
+# The filter rules of tables and rows, checked cheapest first (see filtering/rules.py). Each process has its own engines.
+_table_rules = RuleEngine(table_rules(_THRESHOLD))
+_row_rules = RuleEngine(row_rules())
+
 @click.command()
 @click.argument('src', type=str)
 @click.argument('dest', type=str)
 @click.option('-l', '--labeled', type=str, default=None, help='Path to labeled subject column file (see the label sub-col command)')
-@click.option('-f', '--force', type=bool, default=False, is_flag=True, help='Overwrite already processed files at dest.')
+@click.option('-f', '--force', type=bool, default=False, is_flag=True, help='Process all files, even if their output at dest is up to date.')
 @click.option('-p', '--processes', type=int, default=None, help='The number of processes to use. If not given, the CPU\'s max. will be used.')
-def filter(src, dest, labeled, force, processes):
-  """Implementation of the filtering stage of the data creation pipeline."""
+@click.option('-c', '--compression', type=click.Choice(COMPRESSIONS), default="none", help='Compression of the output files (none).')
+@click.option('-mb', '--max-mb', type=float, default=200, help='Max. (uncompressed) size of an output part in MB.')
+@click.option('-cm', '--cache-mode', type=click.Choice(CACHE_MODES), default="stat", help='Detect changed inputs by size and modification time (stat) or by their content (hash).')
+@click.option('-d', '--delta', type=str, multiple=True, help='Stage-4 file with new revisions of changed tables. Only the changed tables are filtered again (can be repeated).')
+@click.option('-dist', '--distributed', type=bool, default=False, is_flag=True, help='Share the files with the other nodes that run the same command on a shared filesystem. Files are claimed through lease files in dest/.claims.')
+@click.option('-lt', '--lease-ttl', type=float, default=60, help='Seconds after which the files of a node without heartbeat are claimed by other nodes (with -dist).')
+@click.option('-rt', '--retries', type=int, default=2, help='Retries of a failing file (with exponential backoff) before it is skipped.')
+@click.option('-mi', '--metrics-interval', type=float, default=30, help='Seconds between two progress reports.')
+@click.option('-mf', '--metrics-file', type=str, default=None, help='If given, progress reports are appended to this file as JSON lines.')
+def filter(src, dest, labeled, force, processes, compression, max_mb, cache_mode, delta, distributed, lease_ttl, retries, metrics_interval, metrics_file):
+  """
+    Implementation of the filtering stage of the data creation pipeline.
+    Input files can be plain or compressed (.json, .json.gz, .json.xz, .json.zst).
+    The output of each input file is written to size-bounded parts <name>-<n>.json, listed in <name>.manifest.
+    Files whose output is up to date (same input, options and code) are skipped.
+
+    Deltas (e.g. extracted from a newer Wikipedia dump) contain the new revisions of changed tables in the format of Stage 4.
+    They are merged into the tables at src (see TableStore) and only the output of the changed tables is updated.
+
+    With -dist, the files are processed by all nodes (machines or processes) that run the same command with the same dest on a shared filesystem.
+    Each node claims the files it processes (see util/dist/claims.py), files of crashed nodes are claimed again after the lease ttl,
+    and each node reports the stats of all nodes once all files are done. A file completed in a previous distributed run with the same
+    input, options and code is not processed again, even with -f (remove dest/.claims to start over).
+
+    Tables that can not be read or filtered are written to dest/.rejects/<name>.json with their error and skipped.
+    Files that fail are retried and skipped after the last retry, the skipped files and rejected tables are listed at the end.
+    The command fails (non-zero exit code) if files were skipped.
+  """
+
+  if distributed and delta:
+    raise click.BadParameter("deltas can not be applied by multiple nodes", param_hint="delta")
+
+  cache = StageCache(dest, "filter", {
+    "threshold": _THRESHOLD,
+    "labeled": file_fingerprint(labeled, "hash"),
+    "compression": compression,
+    "maxMB": max_mb
+  }, [__name__, "filtering.delta", "filtering.rules", "util.rev.fingerprint", "util.html.html_util", "util.wiki.wikilink_util", "util.wiki.wikilink_result", "util.wiki.wiki_table_util", "util.wiki.wikitemplate_util"], cache_mode)
 
   # get the files
-  src_files = set(f for f in listdir(src) if isfile(join(src, f)) and f.endswith(".json"))
-  # process only the files that are not yet in dest
-  if not force:
-    dest_files = set(f for f in listdir(dest) if isfile(join(dest, f)) and f.endswith(".json"))
-    src_files = src_files - dest_files
+  src_files = {strip_json_extension(f): f for f in list_json_files(src)}
+
+  # tables changed by deltas replace their version at src
+  store = TableStore(src, dest) if delta or TableStore.exists(dest) else None
+  changed = dict()
+  if delta:
+    os.makedirs(dest, exist_ok=True)
+    store.refresh(processes)
+    changed = store.apply(delta)
+    store.save()
+  overlays = store.overlays() if store else dict()
+
+  keys = {stem: cache.key([join(src, src_files[stem]) if stem in src_files else None] + (store.overlay_files(overlays[stem]) if stem in overlays else [])) for stem in set(src_files) | set(overlays)}
+
+  if delta:
+    # update the output of the changed tables only, unless there is no output yet
+    refilter_stems = [stem for stem in changed if stem not in src_files or exists(join(dest, stem + MANIFEST_EXTENSION))]
+    stems = [stem for stem in changed if stem not in refilter_stems]
+  else:
+    # process only the files whose output is not up to date, stems without input file consist of overlay tables only
+    stems = [stem for stem in keys if force or not cache.is_valid(stem, keys[stem])]
+    refilter_stems = [stem for stem in stems if stem not in src_files]
+    stems = [stem for stem in stems if stem in src_files]
+    changed = {stem: overlays[stem] for stem in refilter_stems}
+
+  logging.info(f'Found {len(stems) + len(refilter_stems)} files to process.')
+  if len(stems) + len(refilter_stems) == 0:
+    logging.info("All outputs are up to date.")
+    return
 
-  logging.info(f'Found {len(src_files)} files to process.')
+  # Use manually labeled columns if existant
+  labeled_subject_cols = _load_labeled_subject_cols(labeled)
+
+  reporter = MetricsReporter("filter", metrics_interval, metrics_file, totals={"files": len(stems) + len(refilter_stems)})
+  overlay_dir = store.dir if store else None
+  runner = TaskRunner("filter", join(dest, REJECTS_DIR), retries)
 
   # start processes
-  with Pool(processes) as p:
-    input = [(src, dest, file, labeled) for file in src_files]
+  with reporter, Pool(processes, initializer=_init_worker, initargs=(labeled_subject_cols, reporter.queue, metrics_interval)) as p:
+    input = [(src, dest, src_files[stem], compression, max_mb, cache, keys[stem], overlays.get(stem), overlay_dir) for stem in stems]
+    refilter_input = [(src, dest, stem, changed[stem], compression, max_mb, cache, keys[stem], overlay_dir) for stem in refilter_stems]
     try:
-      results =  np.array(p.starmap(_filter_file, input))
-
-      # print stats
-      skipped_tables = sum(results[:,0])
-      matched_tables = sum(results[:,1])
-      skipped_rows = sum(results[:,2])
-      matched_rows = sum(results[:,3])
-      hist_lens = [val for sublist in results[:,4] for val in sublist]
-      row_lens = [val for sublist in results[:,5] for val in sublist]
-    
-      echo(f"#Ignored tables={skipped_tables}")
-      echo(f"#Accepted tables={matched_tables}")
-      echo(f"#Ignored rows={skipped_rows}")
-      echo(f"#Accepted rows={matched_rows}")
-      echo(f"Histories per row: max={np.max(hist_lens)}, avg={np.mean(hist_lens)}, median={np.median(hist_lens)}")
-      echo(f"Rows per table: max={np.max(row_lens)}, avg={np.mean(row_lens)}, median={np.median(row_lens)}")
+      if distributed:
+        tasks = {stem: (runner.wrap(profiled(_filter_file), stem), args) for stem, args in zip(stems, input)}
+        tasks.update({stem: (runner.wrap(profiled(_refilter_file), stem), args) for stem, args in zip(refilter_stems, refilter_input)})
+        results = _run_distributed(p, dest, tasks, keys, processes, lease_ttl)
+        results = runner.collect(list(results.keys()), list(results.values()))
+      else:
+        results = runner.starmap(p, profiled(_filter_file), input, stems) + runner.starmap(p, profiled(_refilter_file), refilter_input, refilter_stems)
+      if results:
+        _print_stats(results)
+      if runner.summary():
+        raise click.ClickException(f"Skipped {len(runner.failures)} of {len(runner.tasks)} files that failed, see the log above.")
 
       logging.info("Processed all files.")
     except KeyboardInterrupt:
       p.terminate()
       logging.info("Aborting")
 
+def _run_distributed(p: Pool, dest: str, tasks: dict, keys: dict, processes: int, lease_ttl: float) -> dict:
+  """Runs the tasks (stem -> (fn, args)) that this node claims and returns the results of all nodes by stem, once all stems are done."""
+
+  with WorkClaims(join(dest, _CLAIMS_DIR), lease_ttl) as claims:
+    own = run_claimed(p, tasks, claims, processes or os.cpu_count(), keys)
+    records = claims.results(list(tasks))
+
+  logging.info(f"Processed {len(own)} of {len(tasks)} files, files per node: {dict(Counter([record['node'] for record in records.values()]))}")
+  return {stem: record["result"] for stem, record in records.items()}
+
+def _print_stats(results: list):
+  results = np.array(results, dtype=object)
+  skipped_tables = sum(results[:,0])
+  matched_tables = sum(results[:,1])
+  skipped_rows = sum(results[:,2])
+  matched_rows = sum(results[:,3])
+  hist_lens = [val for sublist in results[:,4] for val in sublist]
+  row_lens = [val for sublist in results[:,5] for val in sublist]
+
+  echo(f"#Ignored tables={skipped_tables}")
+  echo(f"#Accepted tables={matched_tables}")
+  echo(f"#Ignored rows={skipped_rows}")
+  echo(f"#Accepted rows={matched_rows}")
+  if len(hist_lens) > 0:
+    echo(f"Histories per row: max={np.max(hist_lens)}, avg={np.mean(hist_lens)}, median={np.median(hist_lens)}")
+    echo(f"Rows per table: max={np.max(row_lens)}, avg={np.mean(row_lens)}, median={np.median(row_lens)}")
+
+def _load_labeled_subject_cols(labeled_file: str) -> dict:
+  """
+    Reads the labeled subject column file (see the label sub-col command) and
+    returns a dict that maps each tableID to its true subject column index.
+  """
+
+  labeled_subject_cols = dict()
 
-def _filter_file(src_dir: str, dest_dir: str, file_name: str, labeled_file: str):
+  if labeled_file and exists(labeled_file):
+    logging.info(f"Found file with labeled subject columns at {labeled_file}")
+    with open(labeled_file, "rb") as file:
+      for line in file:
+        doc = loads(line)
+        labeled_subject_cols[doc["tableID"]] = doc["trueSubjectColumnIndex"]
+    logging.info(f"Loaded {len(labeled_subject_cols)} labeled subject columns")
+
+  return labeled_subject_cols
+
+def _init_worker(labeled_subject_cols: dict, metrics_queue, metrics_interval: float):
+  """Initializes a worker process with the labeled subject columns loaded by the parent and connects it to the metrics reporter."""
+
+  global _labeled_subject_cols
+  _labeled_subject_cols = labeled_subject_cols
+  init_metrics(metrics_queue, metrics_interval)
+
+def _filter_file(src_dir: str, dest_dir: str, file_name: str, compression: str="none", max_mb: float=200, cache: StageCache=None, cache_key: str=None, overlay: dict=None, overlay_dir: str=None):
+  """Filters all tables of an input file. Tables in overlay (tableID -> location, see TableStore) are replaced by their version changed by deltas."""
+
+  # remove the output of a previous run
+  stem = strip_json_extension(file_name)
+  if cache:
+    cache.invalidate(stem)
+  manifest_path = join(dest_dir, stem + MANIFEST_EXTENSION)
+  if exists(manifest_path):
+    for part in read_manifest(manifest_path)["parts"]:
+      _remove_output(dest_dir, part["name"])
+  dest_file = RotatingFileWriter(dest_dir, "wb", base_name=f"{stem}-", extension=".json" + extension_of(compression), max_MB=max_mb, manifest=manifest_path)
+  dest_file.clear()
+  for f in list_json_files(dest_dir):
+    if strip_json_extension(f) == stem:
+      _remove_output(dest_dir, f)
+
+  with dest_file:
+    if overlay:
+      stats = _filter_tables(iter_tables(src_dir, overlay_dir, file_name, overlay), dest_file)
+    else:
+      stats = _filter_tables(_read_tables(join(src_dir, file_name)), dest_file)
+
+  if cache:
+    cache.store(stem, cache_key, [part["name"] for part in dest_file.parts] + [stem + MANIFEST_EXTENSION])
+  
+  logging.info(f'Processed {file_name}.')
+  incr("files")
+  flush_metrics()
+  
+  return stats
+
+def _refilter_file(src_dir: str, dest_dir: str, stem: str, changed: dict, compression: str="none", max_mb: float=200, cache: StageCache=None, cache_key: str=None, overlay_dir: str=None):
+  """
+    Updates the output of stem with the tables that were changed by deltas (tableID -> location, see TableStore).
+    All other tables are copied from the previous output without parsing them. Returns the stats of the changed tables only.
+  """
+
+  if cache:
+    cache.invalidate(stem)
+
+  manifest_path = join(dest_dir, stem + MANIFEST_EXTENSION)
+  old_parts = read_manifest(manifest_path)["parts"] if exists(manifest_path) else []
+  extension = ".json" + extension_of(compression)
+
+  # write to temporary parts first, the old parts are read while writing
+  tmp_file = RotatingFileWriter(dest_dir, "wb", base_name=f"{stem}~", extension=extension, max_MB=max_mb)
+  tmp_file.clear()
+  kept_tables = 0
+
+  with tmp_file:
+    for part in old_parts:
+      with open_compressed(join(dest_dir, part["name"]), "rb") as file:
+        for line in file:
+          if load_fields(line, ["tableID"])["tableID"] not in changed:
+            tmp_file.write(line)
+            kept_tables += 1
+
+    stats = _filter_tables((read_table(src_dir, overlay_dir, location) for location in changed.values()), tmp_file)
+
+  for part in old_parts:
+    _remove_output(dest_dir, part["name"])
+
+  parts = []
+  for part in tmp_file.parts:
+    name = f"{stem}-" + part["name"][len(stem) + 1:]
+    os.replace(join(dest_dir, part["name"]), join(dest_dir, name))
+    if exists(join(dest_dir, part["name"] + BLOCK_TABLE_SUFFIX)):
+      os.replace(join(dest_dir, part["name"] + BLOCK_TABLE_SUFFIX), join(dest_dir, name + BLOCK_TABLE_SUFFIX))
+    parts.append(dict(part, name=name))
+  write_manifest(manifest_path, parts)
+
+  if cache:
+    cache.store(stem, cache_key, [part["name"] for part in parts] + [stem + MANIFEST_EXTENSION])
+
+  logging.info(f'Updated {len(changed)} tables of {stem} and kept {kept_tables} tables.')
+  incr("files")
+  flush_metrics()
+
+  return stats
+
+def _read_tables(path: str):
+  with open_compressed(path, "rb") as file:
+    for line_idx, line in enumerate(file):
+      # parse each line as json, malformed lines are quarantined
+      try:
+        with timer("decode"):
+          doc = loads(line)
+      except ValueError as e:
+        reject(line, e, path, line_idx)
+        continue
+      yield doc
+
+def _remove_output(dest_dir: str, file_name: str):
+  if exists(join(dest_dir, file_name)):
+    os.remove(join(dest_dir, file_name))
+  if exists(join(dest_dir, file_name + BLOCK_TABLE_SUFFIX)):
+    os.remove(join(dest_dir, file_name + BLOCK_TABLE_SUFFIX))
+
+def _filter_tables(docs, dest_file: RotatingFileWriter) -> tuple:
+  """Filters the given tables and writes the accepted ones to dest_file. Returns the stats (see _print_stats)."""
 
   skipped_tables = 0
   matched_tables = 0
@@ -73,185 +301,118 @@ def _filter_file(src_dir: str, dest_dir: str, file_name: str, labeled_file: str)
   hist_lens = []
   row_lens = []
 
-  # Use manually labeled columns if existant
-  labed_subject_cols = dict()
-  if labeled_file and exists(labeled_file):
-    logging.info(f"Found file with labeled subject columns at {labeled_file}")
-    with open(labeled_file, "rb") as file:
-      for line in file:
-        doc = json.loads(line)
-        labed_subject_cols[doc["tableID"]] = doc["trueSubjectColumnIndex"]
+  for doc in docs:
+
+    # tables that can not be filtered (e.g. missing fields) are quarantined
+    try:
+      row_count = len(doc["rows"])
+      filtered_doc, table_skipped_rows, table_matched_rows, table_hist_lens = _filter_table(doc, _labeled_subject_cols)
+    except Exception as e:
+      reject(doc, e)
+      skipped_tables += 1
+      continue
+
+    incr("tables")
+    incr("rows", row_count)
+    skipped_rows += table_skipped_rows
+    matched_rows += table_matched_rows
+    hist_lens += table_hist_lens
+
+    if filtered_doc is None:
+      skipped_tables += 1
+      continue
+
+    matched_tables += 1
+    row_lens.append(len(filtered_doc["rows"]))
+
+    try:
+      with timer("encode"):
+        output = dumpb(filtered_doc) + b"\n"
+      dest_file.write(output)
+      incr("accepted_tables")
+      incr("accepted_rows", len(filtered_doc["rows"]))
+    except:
+      logging.error(f'Error while writing table {doc["tableID"]} on page {doc["pageTitle"]}')
+      skipped_tables += 1
+      skipped_rows += row_count
   
-  with open(join(src_dir, file_name), "rb") as src_file:
-    
-    dest_file = None
-
-    for line in src_file:
-      
-      # parse each line as json
-      doc = json.loads(line)
-            
-      page_title = doc["pageTitle"]
-      table_id = doc["tableID"]
-      rows = doc["rows"]
-
-      if "subjectColumnIndex" not in doc or "subjectColumnProbability" not in doc:
-        skipped_tables += 1
-        skipped_rows += len(rows)
-        continue
+    logging.debug(f'Processed table {doc["tableID"]} on page {doc["pageTitle"]}')
 
-      subject_col_idx = doc["subjectColumnIndex"]
-      subject_col_score =  doc["subjectColumnProbability"]
+  return (skipped_tables, matched_tables, skipped_rows, matched_rows, hist_lens, row_lens)
 
-      # Ignore tables with a subject column score below the threshold.
-      if subject_col_score <= _THRESHOLD and table_id not in labed_subject_cols:
-        skipped_tables += 1
-        skipped_rows += len(rows)
-        continue
+def _filter_table(doc: dict, labeled_subject_cols: dict) -> tuple:
+  """
+    Applies the filter rules to a single table (Stage-4 document) and extracts the links of its rows.
+    Returns the filtered table (None if the table is skipped), the number of skipped and matched rows and the history length of each matched row.
+  """
 
-      if table_id in labed_subject_cols:
-        doc["subjectColumnIndex"] = subject_col_idx = labed_subject_cols[table_id]
+  skipped_rows = 0
+  matched_rows = 0
+  hist_lens = []
 
-      # tables with just one or two rows are mostly used for layout and therefore uninteresting
-      if len(rows) < 3:
-        skipped_tables += 1
-        skipped_rows += len(rows)
-        continue
+  table_id = doc["tableID"]
+  rows = doc["rows"]
 
-      # all rows that satisfy the filtering
-      filtered_rows = []
-      # all revision ids that are contained in filtered_rows
-      contained_revision = set()
-
-      for row in rows:
-
-        revisions = row["revisions"]
-
-        # some rows are just used for foodnotes.
-        revisions = [rev for rev in revisions if re.match("{{nodelist.*}}", get_tr(rev)) is None]
-
-        # Check if this rows schema matches the one used for subject column detection
-        if len(revisions) == 0 or doc["schemas"][str(doc["lastRevisionID"])] != doc["schemas"][str(revisions[-1]["revisionID"])]:
-          skipped_rows += 1
-          continue
-
-        # filter rows that existed only for a month or less
-        revisions = sorted(revisions, key=lambda r: parse_wiki_date(r["revisionDate"]))
-        first_revision_date = parse_wiki_date(revisions[0]["revisionDate"])
-        last_revision_date = parse_wiki_date(revisions[-1]["revisionDate"])
-        if abs(last_revision_date - first_revision_date) < datetime.timedelta(days=30):
-          skipped_rows += 1
-          continue
-
-        # filter all revisions that contributed no meaningful value in comparinson to the revision before (e.g. whitespace added or css changed).
-        # In rare cases, someone added a new link, 
-        filtered_revisions = [revisions[0]]
-        last_link = extract_wikilink(get_tr(revisions[0]), page_title, subject_col_idx)
-        last_link = last_link[0] if last_link else last_link
-        last_text = get_text(get_tr(revisions[0]), page_title)
-
-        for r in revisions[1:]:
-          new_link = extract_wikilink(get_tr(r), page_title, subject_col_idx)
-          new_link = new_link[0] if new_link else new_link
-          new_text = get_text(get_tr(r), page_title)
-
-          # Pure text changed
-          if re.sub("\W", "", last_text) != re.sub("\W", "", new_text):
-            filtered_revisions.append(r)
-          
-          # Rare: text did not change but new link was added.
-          # -> replace the old revision (they have the same meaning but just different links)
-          elif last_link != new_link:
-            filtered_revisions[-1] = r
-          
-          last_link = new_link
-          last_text = new_text
-        
-        row["revisions"] = filtered_revisions
-
-        # mark the 'new' last revision as deleted, if the old one was deleted
-        if revisions[-1] != filtered_revisions[-1] and "deleted" in revisions[-1] and "deleted" not in filtered_revisions[-1]:
-          filtered_revisions[-1]["deleted"] = revisions[-1]["deleted"]
-          filtered_revisions[-1]["deleteDate"] = revisions[-1]["deleteDate"]
-
-        # consider only rows with more than two revision remaining
-        if len(filtered_revisions) < 3:
-          skipped_rows += 1
-          continue
-
-        last_revision = filtered_revisions[-1]
-
-        link_results = extract_wikilink(get_tr(last_revision), page_title, subject_col_idx)
-
-        # no or too many links found
-        if not link_results or len(link_results) != 1:
-          skipped_rows += 1
-          continue
-
-        link_result = link_results[0]
-        if not link_result.pagename or link_result.pagename == "":
-          skipped_rows += 1
-          continue
-        
-        # Often <table>s are used as layout tables to structure <ul>s. Thus they contain many entities.
-        # But somestimes <ul>s are just used to style bullet points in front of an element.
-        # So we filter all rows that have a <ul> with at least 3 <li>
-        if contains_list(get_tr(last_revision), 3):
-          skipped_rows += 1
-          continue
-
-        filtered_rows.append(row)
-        matched_rows += 1
-
-        contained_revision.update([str(r["revisionID"]) for r in filtered_revisions])
-
-        row["link"] = {
-          "namespace": link_result.namespace,
-          "pageName": link_result.pagename,
-          "anchor": link_result.anchor,
-          "text": link_result.display_text,
-          "match": link_result.match
-        }
-
-        # remove unneeded props
-        for revision in revisions:
-          revision.pop("similarityFirst", None)
-          revision.pop("similarityLast", None)
-          revision.pop("contentType", None)
-
-        hist_lens.append(len(filtered_revisions))
-      
-      if len(filtered_rows) == 0:
-        skipped_tables += 1
-        logging.info(f'Skipping table {doc["tableID"]} on page {doc["pageTitle"]}')
-        continue
+  if not _table_rules.accepts(TableContext(doc, labeled_subject_cols)):
+    return None, len(rows), 0, []
 
-      doc["rows"] = filtered_rows
-      doc.pop("lastRevisionID", None)
-      doc.pop("lastTable", None)
-      # Exclude table header of revisions that were removed completly
-      doc["schemas"] = {k: v for k, v in doc["schemas"].items() if k in contained_revision}
+  if table_id in labeled_subject_cols:
+    doc["subjectColumnIndex"] = labeled_subject_cols[table_id]
+  subject_col_idx = doc["subjectColumnIndex"]
 
-      matched_tables += 1
-      row_lens.append(len(filtered_rows))
+  # all rows that satisfy the filtering
+  filtered_rows = []
+  # all revision ids that are contained in filtered_rows
+  contained_revision = set()
 
-      # Open the file if not yet done
-      if not dest_file:
-        dest_file = open(join(dest_dir, file_name), "w", encoding="utf-8")
+  for row in rows:
 
-      try:
-        output = json.dumps(doc, ensure_ascii=False) + "\n"
-        dest_file.write(output)
-      except:
-        logging.error(f'Error while writing table {doc["tableID"]} on page {doc["pageTitle"]}')
-        skipped_tables += 1
-        skipped_rows += len(rows)
-    
-      logging.info(f'Processed table {doc["tableID"]} on page {doc["pageTitle"]}')
-
-    if dest_file:
-      dest_file.close()
-  
-  logging.info(f'Processed {file_name}.')
+    context = RowContext(row, doc, subject_col_idx)
+    if not _row_rules.accepts(context):
+      skipped_rows += 1
+      continue
+
+    revisions = context.sorted_revisions
+    filtered_revisions = context.filtered_revisions
+    row["revisions"] = filtered_revisions
+
+    # mark the 'new' last revision as deleted, if the old one was deleted
+    if revisions[-1] != filtered_revisions[-1] and "deleted" in revisions[-1] and "deleted" not in filtered_revisions[-1]:
+      filtered_revisions[-1]["deleted"] = revisions[-1]["deleted"]
+      filtered_revisions[-1]["deleteDate"] = revisions[-1]["deleteDate"]
+
+    link_result = context.last_filtered_links[0]
+    context.add_fingerprints()
+
+    filtered_rows.append(row)
+    matched_rows += 1
+
+    contained_revision.update([str(r["revisionID"]) for r in filtered_revisions])
+
+    row["link"] = {
+      "namespace": link_result.namespace,
+      "pageName": link_result.pagename,
+      "anchor": link_result.anchor,
+      "text": link_result.display_text,
+      "match": link_result.match
+    }
+
+    # remove unneeded props
+    for revision in revisions:
+      revision.pop("similarityFirst", None)
+      revision.pop("similarityLast", None)
+      revision.pop("contentType", None)
+
+    hist_lens.append(len(filtered_revisions))
   
-  return (skipped_tables, matched_tables, skipped_rows, matched_rows, hist_lens, row_lens)
\ No newline at end of file
+  if len(filtered_rows) == 0:
+    logging.debug(f'Skipping table {doc["tableID"]} on page {doc["pageTitle"]}')
+    return None, skipped_rows, matched_rows, hist_lens
+
+  doc["rows"] = filtered_rows
+  doc.pop("lastRevisionID", None)
+  doc.pop("lastTable", None)
+  # Exclude table header of revisions that were removed completly
+  doc["schemas"] = {k: v for k, v in doc["schemas"].items() if k in contained_revision}
+
+  return doc, skipped_rows, matched_rows, hist_lens
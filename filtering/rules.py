@@ -0,0 +1,272 @@
+import datetime
+import re
+import time
+
+from util.wiki.wiki_table_util import get_tr
+from util.wiki.wikilink_util import extract_wikilink, parse_wiki_date
+from util.html.html_util import get_text, contains_list
+from util.metrics.stage_metrics import incr, add_time
+from util.rev.fingerprint import content_hash, text_hash
+
+# Number of evaluations after which an engine orders its rules by their measured cost per rejection
+_REORDER_INTERVAL = 1000
+
+class Rule:
+  """
+    A filter rule. accepts(context) returns False if the row (or table) of the context is rejected.
+    cost is an estimate of the work of a check (roughly the number of parsed HTML snippets per row) and requires lists the names
+    of rules that must be checked before this one (e.g. because accepts relies on their result).
+  """
+
+  def __init__(self, name: str, cost: float, accepts, requires: list = []):
+    self.name = name
+    self.cost = cost
+    self.accepts = accepts
+    self.requires = list(requires)
+
+class RuleEngine:
+  """
+    Checks a set of rules that must all accept, cheapest first. As all rules must accept, the order does not change the outcome,
+    only the work done to reject. Starts with the order of the estimated costs and then orders by the measured time spent per rejection,
+    so that rules that reject often and cheaply are checked first.
+
+    The rejections and the time of each rule are reported as the metrics rejected_<name> and rule_<name>.
+  """
+
+  def __init__(self, rules: list, reorder_interval: int = _REORDER_INTERVAL):
+    self.rules = list(rules)
+    self.reorder_interval = reorder_interval
+    self._stats = {rule.name: [0, 0, 0.] for rule in rules} # checks, rejections, seconds
+    self._evaluations = 0
+    self._order = self._ordered(lambda rule: rule.cost)
+
+  def accepts(self, context) -> bool:
+    """Returns True if all rules accept the context. Stops at the first rejection."""
+
+    self._evaluations += 1
+    if self._evaluations % self.reorder_interval == 0:
+      self._order = self._ordered(self._expected_cost)
+
+    for rule in self._order:
+      start = time.perf_counter()
+      accepted = rule.accepts(context)
+      seconds = time.perf_counter() - start
+
+      stats = self._stats[rule.name]
+      stats[0] += 1
+      stats[2] += seconds
+      add_time(f"rule_{rule.name}", seconds)
+
+      if not accepted:
+        stats[1] += 1
+        incr(f"rejected_{rule.name}")
+        return False
+
+    return True
+
+  def order(self) -> list:
+    """The names of the rules in the order they are checked."""
+
+    return [rule.name for rule in self._order]
+
+  def _expected_cost(self, rule: Rule) -> float:
+    """Seconds per rejection (estimated costs until the rule was checked)."""
+
+    checks, rejections, seconds = self._stats[rule.name]
+    if checks == 0:
+      return rule.cost
+    # rules that never rejected are checked last (Laplace smoothing keeps them ordered by cost)
+    return (seconds / checks) / ((rejections + 1) / (checks + 2))
+
+  def _ordered(self, key) -> list:
+    """Orders the rules by key, but each rule after the rules it requires."""
+
+    remaining = sorted(self.rules, key=key)
+    ordered = []
+    while remaining:
+      names = set([rule.name for rule in ordered])
+      rule = next((r for r in remaining if all([name in names for name in r.requires])), remaining[0])
+      remaining.remove(rule)
+      ordered.append(rule)
+    return ordered
+
+class RowContext:
+  """
+    A row of a table while it is filtered. The derived values (revisions without footnotes, revisions by date, fingerprints and links)
+    are computed on first use and cached, so that rules share them and a row rejected by a cheap rule never pays for parsing its full history.
+
+    Adjacent revisions are compared by the hash of their raw content first and only parsed if it differs.
+  """
+
+  def __init__(self, row: dict, doc: dict, subject_col_idx: int):
+    self.row = row
+    self.doc = doc
+    self.page_title = doc["pageTitle"]
+    self.subject_col_idx = subject_col_idx
+    self._revisions = None
+    self._sorted = None
+    self._trs = dict()
+    self._content_hashes = dict()
+    self._text_hashes = dict()
+    self._links = dict()
+    self._last_filtered = None
+    self._filtered = None
+
+  @property
+  def revisions(self) -> list:
+    """The revisions of the row that are not just used for footnotes, in their original order."""
+
+    if self._revisions is None:
+      self._revisions = [rev for rev in self.row["revisions"] if re.match("{{nodelist.*}}", self.tr(rev)) is None]
+    return self._revisions
+
+  @property
+  def sorted_revisions(self) -> list:
+    if self._sorted is None:
+      self._sorted = sorted(self.revisions, key=lambda r: parse_wiki_date(r["revisionDate"]))
+    return self._sorted
+
+  def tr(self, revision: dict) -> str:
+    key = id(revision)
+    if key not in self._trs:
+      self._trs[key] = get_tr(revision)
+    return self._trs[key]
+
+  def content_hash(self, idx: int) -> str:
+    """The hash of the raw content of the idx-th revision by date."""
+
+    if idx not in self._content_hashes:
+      self._content_hashes[idx] = content_hash(self.sorted_revisions[idx])
+    return self._content_hashes[idx]
+
+  def text_hash(self, idx: int) -> str:
+    """The hash of the text of the idx-th revision by date without non-word characters."""
+
+    if idx not in self._text_hashes:
+      self._text_hashes[idx] = text_hash(get_text(self.tr(self.sorted_revisions[idx]), self.page_title))
+    return self._text_hashes[idx]
+
+  def changed(self, idx: int) -> bool:
+    """True if the text of the idx-th revision by date differs from the one before (ignoring whitespace, css, ...)."""
+
+    return self.content_hash(idx) != self.content_hash(idx - 1) and self.text_hash(idx) != self.text_hash(idx - 1)
+
+  def relinked(self, idx: int) -> bool:
+    """True if the link of the idx-th revision by date differs from the one before."""
+
+    return self.content_hash(idx) != self.content_hash(idx - 1) and self.link(idx) != self.link(idx - 1)
+
+  def links(self, idx: int) -> list:
+    """The links in the subject column of the idx-th revision by date."""
+
+    if idx not in self._links:
+      self._links[idx] = extract_wikilink(self.tr(self.sorted_revisions[idx]), self.page_title, self.subject_col_idx)
+    return self._links[idx]
+
+  def link(self, idx: int):
+    links = self.links(idx)
+    return links[0] if links else links
+
+  @property
+  def last_filtered_revision(self) -> dict:
+    """
+      The last revision that remains after removing revisions without meaningful changes (see filtered_revisions).
+      It is the first of the trailing revisions with the same text and link, so it is found by a backward scan that usually parses just a few revisions.
+    """
+
+    if self._last_filtered is None:
+      idx = len(self.sorted_revisions) - 1
+      while idx > 0 and not self.changed(idx) and not self.relinked(idx):
+        idx -= 1
+      self._last_filtered = idx
+    return self.sorted_revisions[self._last_filtered]
+
+  @property
+  def last_filtered_links(self) -> list:
+    self.last_filtered_revision
+    return self.links(self._last_filtered)
+
+  @property
+  def filtered_revisions(self) -> list:
+    """
+      The revisions by date without the ones that contributed no meaningful value in comparison to the revision before (e.g. whitespace added or css changed).
+      In rare cases, someone added a new link without changing the text. The new revision replaces the old one then (they have the same meaning but just different links).
+    """
+
+    if self._filtered is None:
+      revisions = self.sorted_revisions
+      filtered = [revisions[0]]
+
+      for idx in range(1, len(revisions)):
+        # Pure text changed
+        if self.changed(idx):
+          filtered.append(revisions[idx])
+        # Rare: text did not change but new link was added.
+        elif self.relinked(idx):
+          filtered[-1] = revisions[idx]
+
+      self._filtered = filtered
+    return self._filtered
+
+  def add_fingerprints(self):
+    """Stores the contentHash and textHash of each filtered revision in the revision, so that later stages can skip identical revisions without parsing them."""
+
+    indices = {id(revision): idx for idx, revision in enumerate(self.sorted_revisions)}
+    for revision in self.filtered_revisions:
+      idx = indices[id(revision)]
+      revision["contentHash"] = self.content_hash(idx)
+      revision["textHash"] = self.text_hash(idx)
+
+class TableContext:
+  """A table (Stage-4 document) while it is filtered, with the manually labeled subject columns (tableID -> index)."""
+
+  def __init__(self, doc: dict, labeled_subject_cols: dict):
+    self.doc = doc
+    self.labeled_subject_cols = labeled_subject_cols
+
+def table_rules(threshold: float) -> list:
+  """The rules a table must satisfy to be used. threshold is the min. subject column score of tables without labeled subject column."""
+
+  return [
+    Rule("subject_column", 0, lambda c: "subjectColumnIndex" in c.doc and "subjectColumnProbability" in c.doc),
+    # Ignore tables with a subject column score below the threshold.
+    Rule("subject_score", 0, lambda c: c.doc["subjectColumnProbability"] > threshold or c.doc["tableID"] in c.labeled_subject_cols, requires=["subject_column"]),
+    # tables with just one or two rows are mostly used for layout and therefore uninteresting
+    Rule("table_rows", 0, lambda c: len(c.doc["rows"]) >= 3)
+  ]
+
+def _has_current_schema(context: RowContext) -> bool:
+  # Check if this rows schema matches the one used for subject column detection
+  doc = context.doc
+  return len(context.revisions) > 0 and doc["schemas"][str(doc["lastRevisionID"])] == doc["schemas"][str(context.revisions[-1]["revisionID"])]
+
+def _lived_long_enough(context: RowContext) -> bool:
+  # filter rows that existed only for a month or less
+  revisions = context.sorted_revisions
+  return abs(parse_wiki_date(revisions[-1]["revisionDate"]) - parse_wiki_date(revisions[0]["revisionDate"])) >= datetime.timedelta(days=30)
+
+def _has_single_link(context: RowContext) -> bool:
+  # no or too many links found in the last revision
+  links = context.last_filtered_links
+  return bool(links) and len(links) == 1 and bool(links[0].pagename)
+
+def _has_no_list(context: RowContext) -> bool:
+  # Often <table>s are used as layout tables to structure <ul>s. Thus they contain many entities.
+  # But somestimes <ul>s are just used to style bullet points in front of an element.
+  # So we filter all rows that have a <ul> with at least 3 <li>
+  return not contains_list(context.tr(context.last_filtered_revision), 3)
+
+def _has_history(context: RowContext) -> bool:
+  # consider only rows with more than two revision remaining
+  return len(context.filtered_revisions) >= 3
+
+def row_rules() -> list:
+  """The rules a row must satisfy to be used. The costs are estimated in parsed HTML snippets."""
+
+  return [
+    Rule("schema", 0.1, _has_current_schema),
+    Rule("lifetime", 0.2, _lived_long_enough, requires=["schema"]),
+    Rule("single_link", 1.5, _has_single_link, requires=["schema"]),
+    Rule("list", 1, _has_no_list, requires=["schema"]),
+    Rule("history", 20, _has_history, requires=["schema"])
+  ]
@@ -3,14 +3,15 @@ from genericpath import isfile
 import locale
 import click
 from click import echo
-import json
 import numpy as np
-from os import listdir
 from os.path import join
 from util.sampling.line_sampler import LineSampler
 from util.html.html_util import get_cols
 from util.wiki.wiki_table_util import get_tr
 from util.wiki.wikilink_util import build_wikipedia_url
+from util.io.json_codec import loads, dumps
+from util.io.compressed_io import list_json_files
+from util.io.prefetcher import Prefetcher
 
 _LABELED_FILE_NAME = "col-history-labels.json"
 
@@ -27,8 +28,10 @@ def col_matching(src, dest, size):
     
   files = [src]
   if not isfile(src):
-    files = [join(src, f) for f in listdir(src)]
+    files = [join(src, f) for f in list_json_files(src)]
   sampler = LineSampler(files)
+  prefetcher = Prefetcher()
+  docs = prefetcher.lookahead(iter(sampler.choice, None))
 
   try:
 
@@ -39,11 +42,8 @@ def col_matching(src, dest, size):
       
       doc = None
 
-      # Choose a random doc
-      file_path, offset = sampler.choice()
-      with open(file_path, "rb") as file:
-        file.seek(offset)
-        doc = json.loads(file.readline())
+      # Choose a random doc (the next ones are already read in the background)
+      _, doc = next(docs)
       
       page_name = doc["pageTitle"]
       rows = doc["rows"]
@@ -131,7 +131,7 @@ def col_matching(src, dest, size):
           }
 
           with open(label_file, "a", encoding="utf-8") as file:
-            file.write(json.dumps(output, ensure_ascii=False) + "\n")
+            file.write(dumps(output) + "\n")
 
         except:
           echo("Unknown number format. Try again...")
@@ -141,6 +141,7 @@ def col_matching(src, dest, size):
   except KeyboardInterrupt:
     pass
   
+  prefetcher.close()
   _stats(label_file)
 
 def _stats(label_file: str):
@@ -185,7 +186,7 @@ def _stats(label_file: str):
 
   with open(label_file, "rb") as file:
 
-    docs = [json.loads(line) for line in file]
+    docs = [loads(line) for line in file]
 
     echo(f"\n========== Stats ==========")
     echo("===== Overall =====")
@@ -1,10 +1,17 @@
 import click
 from click import echo
-import json
+from contextlib import closing
+from itertools import islice
+from os.path import join, dirname
 from util.html.html_util import get_cols
 from util.wiki.wiki_table_util import get_tr
+from util.rev.revision_util import resolve_schemas
+from sampling.row_store import is_compact, row_store_of, load_rows, resolve_rows
 from util.wiki.wikilink_result import WikilinkResult
 from util.wiki.wikilink_util import build_wikipedia_url
+from util.io.json_codec import loads, dumps
+from util.io.compressed_io import open_compressed
+from util.rotating_file_writer import read_manifest, MANIFEST_EXTENSION
 
 
 @click.command()
@@ -12,18 +19,37 @@ from util.wiki.wikilink_util import build_wikipedia_url
 @click.argument('prediction_src', type=str)
 @click.argument('dest', type=str)
 def errors(label_src, prediction_src, dest):
-  """Command-line utility for error analysis."""
+  """Command-line utility for error analysis.
+     label_src is the sample of the predictions, i.e. the .manifest of one of its sizes (its parts are read in order and
+     the rows of its pairs are read from its row store) or a single file.
+  """
 
-  with open(label_src, "rb") as label_file:
+  files = [label_src]
+  rows = None
+  if label_src.endswith(MANIFEST_EXTENSION):
+    files = [join(dirname(label_src), part["name"]) for part in read_manifest(label_src)["parts"]]
+    store = row_store_of(label_src)
+    rows = load_rows(store) if store else None
+
+  with closing(_lines(files)) as label_lines:
     # Skip training / validation data
-    [label_file.readline() for _ in range(160000)]
+    label_lines = islice(label_lines, 160000, None)
 
-    with open(prediction_src, "rb") as prediction_file:
+    with open_compressed(prediction_src, "rb") as prediction_file:
 
       for prediction_line in prediction_file:
         
-        label_doc = json.loads(label_file.readline())
-        prediction_doc = json.loads(prediction_line)
+        label_line = next(label_lines, None)
+        if label_line is None:
+          raise click.BadParameter(f"{label_src} has fewer pairs than the test split of the predictions", param_hint="label_src")
+        label_doc = loads(label_line)
+        if is_compact(label_doc):
+          if rows is None:
+            raise click.BadParameter(f"the pairs of {label_src} refer to the rows of a row store, pass the .manifest of the sample", param_hint="label_src")
+          resolve_rows(label_doc, rows)
+        resolve_schemas(label_doc["row1"])
+        resolve_schemas(label_doc["row2"])
+        prediction_doc = loads(prediction_line)
 
         label = label_doc["match"]
         prediction = True if prediction_doc["match"] == 1 else False
@@ -67,10 +93,17 @@ def errors(label_src, prediction_src, dest):
               }
 
               with open(dest, "a", encoding="utf-8") as file:
-                file.write(json.dumps(output, ensure_ascii=False) + "\n")
+                file.write(dumps(output) + "\n")
 
             except:
               echo("Unknown number format. Try again...")
           
           except KeyboardInterrupt:
             return
+
+def _lines(files: list):
+  """Yields the lines of the files (e.g. the parts of a sample) in order."""
+
+  for path in files:
+    with open_compressed(path, "rb") as file:
+      yield from file
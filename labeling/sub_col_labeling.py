@@ -1,4 +1,3 @@
-import json
 from os.path import join, exists
 
 from click import echo
@@ -12,6 +11,8 @@ from util.wiki.wiki_constants import WIKIPEDIA_HOSTNANE
 from urllib.parse import urljoin
 
 from util.sampling.line_sampler import LineSampler
+from util.io.json_codec import loads, dumps, load_fields
+from util.io.prefetcher import Prefetcher
 
 import click
 
@@ -36,10 +37,13 @@ def sub_col(src, dest):
   seen_samples = set()
   
   sampler = LineSampler(src)
+  # raw lines, they are only decoded if they were not labeled yet
+  prefetcher = Prefetcher(decode=None)
+  lines = prefetcher.lookahead(iter(sampler.choice, None))
 
   if exists(dest_file):
     with open(dest_file, "rb") as file:
-      seen_samples = set([json.loads(line)["tableID"] for line in file])
+      seen_samples = set([load_fields(line, ["tableID"])["tableID"] for line in file])
   
   try:
 
@@ -53,13 +57,12 @@ def sub_col(src, dest):
 
       while table_id is None or table_id in seen_samples:
 
-        file_path, offset = sampler.choice()
+        _, line = next(lines)
 
-        with open(file_path, "rb") as file:
-          file.seek(offset)
-          
-          doc = json.loads(file.readline())
-          table_id = doc["tableID"]
+        # only decode the whole table if it was not labeled yet
+        table_id = load_fields(line, ["tableID"])["tableID"]
+        if table_id not in seen_samples:
+          doc = loads(line)
       
       # remember which rows have been checked
       seen_samples.add(table_id)
@@ -102,7 +105,7 @@ def sub_col(src, dest):
               "content": content,
               "subjectColumnIndex": subject_col_idx
             }
-            file.write(json.dumps(output, ensure_ascii=False) + "\n")
+            file.write(dumps(output) + "\n")
         
         prompt = prompt.replace("s", "")
         try:
@@ -111,12 +114,13 @@ def sub_col(src, dest):
 
           with open(dest_file, "a", encoding="utf-8") as file:
             doc["trueSubjectColumnIndex"] = prompt
-            file.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            file.write(dumps(doc) + "\n")
 
         except:
           echo("Unknown number format. Try again...")
 
   except KeyboardInterrupt:
+    prefetcher.close()
     stats(dest, True)
 
 def stats(path: str, plot: bool=False):
@@ -128,7 +132,7 @@ def stats(path: str, plot: bool=False):
     
     for line in file:
       
-      doc = json.loads(line)
+      doc = loads(line)
 
       if doc["trueSubjectColumnIndex"] == doc["subjectColumnIndex"]:
         right.append(doc["subjectColumnProbability"])
@@ -0,0 +1,62 @@
+import math
+import os
+import sys
+
+from util.sim.jaccard import jaccard_similarity
+
+# Tokens added by the formatters that do not describe an entity
+_STRUCTURE_TOKENS = {"COL", "VAL", "TIME", "SEP"}
+
+class StubModel:
+  """
+    Deterministic stand-in for Ditto that needs neither a GPU nor a trained checkpoint (e.g. to test the prediction pipeline).
+    A pair is a match if the Jaccard similarity of its two entries (without the COL, VAL, TIME and SEP tokens) reaches the threshold.
+    The confidence is the similarity for matches and 1 - similarity for non-matches.
+  """
+
+  def __init__(self, threshold: float = 0.5):
+    self.threshold = threshold
+    self.name = f"stub-{threshold}"
+
+  def predict(self, pairs: list) -> list:
+    """Returns (match, confidence) for each (left, right) pair."""
+
+    results = []
+    for left, right in pairs:
+      similarity = jaccard_similarity(_tokens(left), _tokens(right))
+      match = similarity >= self.threshold
+      results.append((int(match), similarity if match else 1 - similarity))
+    return results
+
+class DittoModel:
+  """
+    Classifies pairs with a trained Ditto checkpoint (see --save_model of ditto/train_ditto.py).
+    Requires Ditto's environment (ditto_env.yaml) and the ditto submodule. Runs on the GPU if available, otherwise on the CPU.
+  """
+
+  def __init__(self, checkpoint: str, task: str, lm: str = "roberta", max_len: int = 256, threshold: float = None):
+    sys.path.insert(0, os.path.abspath("ditto"))
+    import torch
+    from matcher import load_model, classify
+
+    self._classify = classify
+    self._config, self._model = load_model(task, checkpoint, lm, torch.cuda.is_available(), False)
+    self.lm = lm
+    self.max_len = max_len
+    self.threshold = threshold
+    self.name = f"ditto-{os.path.abspath(checkpoint)}-{task}-{lm}-{max_len}-{threshold}"
+
+  def predict(self, pairs: list) -> list:
+    """Returns (match, confidence) for each (left, right) pair."""
+
+    predictions, logits = self._classify(pairs, self._model, lm=self.lm, max_len=self.max_len, threshold=self.threshold)
+
+    results = []
+    for prediction, logit in zip(predictions, logits):
+      # softmax over the two classes
+      shifted = [math.exp(l - max(logit)) for l in logit]
+      results.append((int(prediction), shifted[int(prediction)] / sum(shifted)))
+    return results
+
+def _tokens(text: str) -> set:
+  return set([t for t in text.split() if t not in _STRUCTURE_TOKENS])
@@ -0,0 +1,145 @@
+import logging
+from collections import deque
+from os.path import dirname, join
+import click
+
+from predict.models import StubModel, DittoModel
+from predict.server import InferenceServer
+from sampling.ditto_prompt import FORMATTERS, build_formatter, format_pair
+from sampling.row_store import is_compact, pair_keys, row_store_of, load_rows, resolve_rows
+from util.io.json_codec import loads, dumps, dumpb
+from util.io.compressed_io import open_compressed
+from util.rotating_file_writer import read_manifest, MANIFEST_EXTENSION
+from util.metrics.stage_metrics import MetricsReporter, incr, timer
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
+
+MODELS = ["stub", "ditto"]
+
+# Max. number of submitted prompts (in batches) whose predictions are not written yet
+_WINDOW_BATCHES = 4
+
+@click.command()
+@click.argument('src', type=str)
+@click.argument('dest', type=str)
+@click.option('-m', '--model', type=click.Choice(MODELS), default="stub", help='Classify with a trained Ditto checkpoint or the deterministic stub model (Jaccard similarity).')
+@click.option('-cp', '--checkpoint', type=str, default=None, help='Path of the Ditto checkpoint (ditto only).')
+@click.option('-t', '--task', type=str, default=None, help='Ditto task the checkpoint was trained on, e.g. xl_roUnq (ditto only).')
+@click.option('-lm', '--lm', type=str, default="roberta", help='Language model of the checkpoint (ditto only).')
+@click.option('-ml', '--max-len', type=int, default=256, help='Max. number of tokens of a prompt (ditto only).')
+@click.option('-th', '--threshold', type=float, default=None, help='Min. confidence of a match (0.5 if not given).')
+@click.option('-bs', '--batch-size', type=int, default=64, help='Max. number of prompts that are classified at once.')
+@click.option('-mw', '--max-wait', type=float, default=.05, help='Max. seconds a prompt waits for its batch to fill.')
+@click.option('-c', '--cache-file', type=str, default=None, help='If given, predictions are cached by prompt in this file and reused by later runs with the same model.')
+@click.option('-fmt', '--formatter', type=click.Choice(FORMATTERS), default=None, help='Format the pairs of a sample (src) with this formatter instead of reading prompts.')
+@click.option('-fs', '--formatter-settings', type=(str, bool), default=dict(), multiple=True, help='Keyword args. passed to the formatter.')
+@click.option('-z', '--zipped', type=bool, default=False, is_flag=True, help='Zip revisions (with -fmt).')
+@click.option('-za', '--zip-align', type=bool, default=False, is_flag=True, help='Align when zipping revisions (with -fmt).')
+@click.option('-mt', '--max-tokens', type=int, default=None, help='Token budget of a prompt (with -fmt).')
+@click.option('-mi', '--metrics-interval', type=float, default=30, help='Seconds between two progress reports.')
+@click.option('-mf', '--metrics-file', type=str, default=None, help='If given, progress reports are appended to this file as JSON lines.')
+def predict(src, dest, model, checkpoint, task, lm, max_len, threshold, batch_size, max_wait, cache_file, formatter, formatter_settings, zipped, zip_align, max_tokens, metrics_interval, metrics_file):
+  """
+    Classifies prompts without writing them to files for Ditto first. src is a prompt file of gen-prompts (e.g. test.txt.xl) or,
+    with -fmt, a sample file (or its .manifest) whose pairs are formatted on the fly. The predictions are written to dest in
+    the format of Ditto's matcher (one per prompt), so that they can be evaluated and aggregated the same way.
+    With -fmt and -z, the entity pairs are written to dest.index (see aggr run). With -fmt, each prediction also lists
+    the [tableID, rowIdx] of its two rows (if the sample has them), so that the predictions can be clustered (see cluster).
+
+    Prompts are classified in batches and identical prompts only once.
+  """
+
+  if model == "ditto":
+    if not checkpoint or not task:
+      raise click.BadParameter("the ditto model requires --checkpoint and --task", param_hint="model")
+    classifier = DittoModel(checkpoint, task, lm, max_len, threshold)
+  else:
+    classifier = StubModel(threshold if threshold is not None else .5)
+
+  prompts = _read_prompts(src)
+  index_file = None
+  if formatter:
+    fmt = build_formatter(formatter, formatter_settings, max_tokens)
+    if zipped:
+      index_file = open(dest + ".index", "wb")
+    prompts = _format_sample(src, fmt, zipped, zip_align, index_file)
+
+  reporter = MetricsReporter("predict", metrics_interval, metrics_file)
+
+  with reporter, InferenceServer(classifier, batch_size, max_wait, cache_file) as server, open(dest, "w", encoding="utf-8") as dest_file:
+
+    pending = deque()
+    for left, right, rows in prompts:
+      pending.append((left, right, rows, server.submit(left, right)))
+      incr("prompts")
+
+      # write the predictions in order, while the next batches are classified
+      while len(pending) > batch_size * _WINDOW_BATCHES or (pending and pending[0][3].done()):
+        _write_prediction(dest_file, *pending.popleft())
+
+    while pending:
+      _write_prediction(dest_file, *pending.popleft())
+
+  if index_file:
+    index_file.close()
+
+def _write_prediction(dest_file, left: str, right: str, rows: list, future):
+  match, confidence = future.result()
+  prediction = {"left": left, "right": right, "match": match, "match_confidence": confidence}
+  if rows:
+    prediction["rows"] = rows
+  dest_file.write(dumps(prediction) + "\n")
+
+def _read_prompts(path: str):
+  """Yields the (left, right) entries of the prompts in the file (their rows are unknown)."""
+
+  with open_compressed(path, "r", encoding="utf-8") as file:
+    for line in file:
+      if line.strip():
+        left, right = line.split("\t")[:2]
+        yield left.strip(), right.strip(), None
+
+def _format_sample(path: str, fmt, zipped: bool, zip_align: bool, index_file):
+  """
+    Yields the (left, right) entries and the rows ([tableID, rowIdx] of each) of the pairs in the sample file or the parts of its manifest.
+    Writes the entity pairs to index_file.
+  """
+
+  files = [path]
+  stored_rows = None
+  if path.endswith(MANIFEST_EXTENSION):
+    files = [join(dirname(path), part["name"]) for part in read_manifest(path)["parts"]]
+    store = row_store_of(path)
+    if store:
+      with timer("load_rows"):
+        stored_rows = load_rows(store, _sample_keys(files))
+
+  for file_path in files:
+    with open_compressed(file_path, "rb") as file:
+      for line in file:
+        with timer("decode"):
+          doc = loads(line)
+
+        if is_compact(doc):
+          if stored_rows is None:
+            raise click.BadParameter(f"the pairs of {path} refer to the rows of a row store, pass the .manifest of the sample", param_hint="src")
+          resolve_rows(doc, stored_rows)
+
+        entity_pair, entries = format_pair(doc, fmt, zipped, zip_align)
+        incr("pairs")
+
+        if index_file:
+          index_file.write(dumpb(entity_pair) + b"\n")
+        rows = [[doc[row]["tableID"], doc[row]["rowIdx"]] for row in ["row1", "row2"]] if "rowIdx" in doc["row1"] else None
+        for left, right in entries:
+          yield left, right, rows
+
+def _sample_keys(files: list) -> set:
+  """The keys of the rows of the compact pairs in the files."""
+
+  keys = set()
+  for file_path in files:
+    with open_compressed(file_path, "rb") as file:
+      for line in file:
+        keys.update(pair_keys(loads(line)))
+  return keys
@@ -0,0 +1,146 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+from util.io.json_codec import loads, dumps
+from util.metrics.stage_metrics import incr, timer
+
+class InferenceServer:
+  """
+    Classifies (left, right) pairs with a model in a background thread. Pairs are submitted one at a time and collected from a queue
+    into batches of up to batch_size pairs; a batch is classified as soon as it is full or max_wait seconds passed since its first pair.
+
+    Results are cached by the hash of the model and the prompt, so that identical pairs (e.g. the same revision pair of zipped prompts)
+    are classified only once, even if they are submitted while the first one is still waiting. With cache_file, the cache is
+    read on start and each new result is appended, so that later runs with the same model reuse it.
+
+    The model needs a name and predict(pairs) that returns (match, confidence) for each pair (see predict/models.py).
+  """
+
+  def __init__(self, model, batch_size: int = 64, max_wait: float = 0.05, cache_file: str = None):
+    self.model = model
+    self.batch_size = batch_size
+    self.max_wait = max_wait
+    self.cache_file = cache_file
+
+    self._queue = Queue()
+    self._cache = dict()
+    self._pending = dict()
+    self._lock = threading.Lock()
+    self._thread = None
+    self._cache_writer = None
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def start(self):
+    if self.cache_file:
+      self._load_cache()
+      self._cache_writer = open(self.cache_file, "a", encoding="utf-8")
+
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def close(self):
+    """Classifies the remaining pairs and stops the background thread."""
+
+    self._queue.put(None)
+    self._thread.join()
+    if self._cache_writer:
+      self._cache_writer.close()
+      self._cache_writer = None
+
+  def submit(self, left: str, right: str) -> Future:
+    """Queues the pair and returns a future of its (match, confidence)."""
+
+    key = self._key(left, right)
+
+    with self._lock:
+      if key in self._cache:
+        incr("cache_hits")
+        future = Future()
+        future.set_result(self._cache[key])
+        return future
+
+      if key in self._pending:
+        incr("cache_hits")
+        return self._pending[key]
+
+      future = self._pending[key] = Future()
+
+    self._queue.put((key, left, right))
+    return future
+
+  def classify(self, pairs) -> list:
+    """Returns (match, confidence) for each (left, right) pair."""
+
+    return [future.result() for future in [self.submit(left, right) for left, right in pairs]]
+
+  def _key(self, left: str, right: str) -> str:
+    return hashlib.sha1(f"{self.model.name}\t{left}\t{right}".encode("utf-8")).hexdigest()
+
+  def _run(self):
+    closed = False
+    while not closed:
+      request = self._queue.get()
+      if request is None:
+        break
+
+      # collect further requests until the batch is full or the first request waited long enough
+      batch = [request]
+      deadline = time.monotonic() + self.max_wait
+      while len(batch) < self.batch_size:
+        try:
+          request = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+        except Empty:
+          break
+        if request is None:
+          closed = True
+          break
+        batch.append(request)
+
+      self._classify_batch(batch)
+
+  def _classify_batch(self, batch: list):
+    try:
+      with timer("model"):
+        results = self.model.predict([(left, right) for _, left, right in batch])
+    except Exception as e:
+      with self._lock:
+        futures = [self._pending.pop(key) for key, _, _ in batch]
+      for future in futures:
+        future.set_exception(e)
+      return
+
+    incr("batches")
+    incr("classified", len(batch))
+
+    with self._lock:
+      futures = []
+      for (key, _, _), result in zip(batch, results):
+        self._cache[key] = result
+        futures.append(self._pending.pop(key))
+
+    if self._cache_writer:
+      for (key, _, _), result in zip(batch, results):
+        self._cache_writer.write(dumps({"key": key, "match": result[0], "match_confidence": result[1]}) + "\n")
+      self._cache_writer.flush()
+
+    for future, result in zip(futures, results):
+      future.set_result(result)
+
+  def _load_cache(self):
+    try:
+      with open(self.cache_file, "rb") as file:
+        for line in file:
+          if line.strip():
+            entry = loads(line)
+            self._cache[entry["key"]] = (entry["match"], entry["match_confidence"])
+    except FileNotFoundError:
+      pass
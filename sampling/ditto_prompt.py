@@ -1,9 +1,10 @@
-import json
 from math import floor
 from multiprocessing import Pool
 from os import walk
 import os
+import hashlib
 from os.path import join, exists
+from shutil import copyfileobj
 import logging
 import click
 from sampling.formatter.revision_oriented.ro_concat_hist_formatter import ROConcatHistFormatter
@@ -13,8 +14,16 @@ from sampling.formatter.attribute_oriented.concat_hist_time_formatter import Con
 
 from sampling.formatter.attribute_oriented.no_hist_formatter import NoHistPromptFormatter
 from sampling.formatter.revision_oriented.ro_concat_hist_time_formatter import ROConcatHistTimeFormatter
-from util.rev.revision_util import get_rev_at_time, nearest_time
+from util.rev.revision_util import get_rev_at_time, nearest_time, resolve_schemas
+from sampling.row_store import ROW_STORE_NAME, is_compact, is_row_store, pair_keys, row_store_of, row_store_files, index_rows, read_lines, load_rows, resolve_rows
 from util.wiki.wikilink_util import parse_wiki_date
+from util.io.json_codec import loads, dumpb
+from util.io.compressed_io import is_json_file, open_compressed
+from util.rotating_file_writer import read_manifest, MANIFEST_EXTENSION
+from util.cache.stage_cache import StageCache, CACHE_MODES
+from util.profiling.profiler import profiled
+from util.metrics.stage_metrics import MetricsReporter, init_metrics, incr, timer, flush_metrics
+from util.tasks.task_runner import TaskRunner, REJECTS_DIR, reject
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
 
@@ -27,119 +36,470 @@ _fmt_builders = {
   "ro_concat_hist_time": lambda s: ROConcatHistTimeFormatter(**s)
 }
 
+FORMATTERS = list(_fmt_builders.keys())
+
+# Positions of the rows (or of their entries) of each row store by key (see index_rows). Set by the parent and handed to each worker by _init_worker.
+_positions = dict()
+
 _splits = {
   "train": .6,
   "valid": .2,
   "test": .2,
 }
 
+# Special tokens that the tokenizer adds to a pair of entries (<s> left </s></s> right </s> for RoBERTa)
+_SPECIAL_TOKENS = 4
+
 @click.command()
 @click.argument('src', type=str) 
 @click.argument('dest', type=str)
-@click.option('-fmt', '--formatter', type=str, default='nohist', help='The formatter to use for generating the output (nohist)')
+@click.option('-fmt', '--formatter', type=click.Choice(FORMATTERS), default='nohist', help='The formatter to use for generating the output (nohist)')
 @click.option('-fs', '--formatter-settings', type=(str, bool), default=dict(), multiple=True, help='Keyword args. passed to the formatter.')
 @click.option('-z', '--zipped', type=bool, default=False, is_flag=True, help='Zip revisions')
 @click.option('-za', '--zip-align', type=bool, default=False, is_flag=True, help='Align when zipping revisions')
+@click.option('-kd', '--keep-duplicates', type=bool, default=False, is_flag=True, help='Write identical zipped prompts of a split once per pair of revisions instead of once.')
+@click.option('-mt', '--max-tokens', type=int, default=None, help='Token budget of a prompt (e.g. Ditto\'s --max_len). Formatters that concatenate histories keep the newest history that fits.')
 @click.option('-n', '--name', type=str, default=None, help='How to name the output. If not set, the formatters config name will be used.')
-def gen_prompts(src, dest, formatter, formatter_settings, zipped, zip_align, name):
+@click.option('-p', '--processes', type=int, default=None, help='The number of processes to use. If not given, the CPU\'s max. will be used.')
+@click.option('-f', '--force', type=bool, default=False, is_flag=True, help='Generate all prompts, even if they are up to date.')
+@click.option('-cm', '--cache-mode', type=click.Choice(CACHE_MODES), default="stat", help='Detect changed inputs by size and modification time (stat) or by their content (hash).')
+@click.option('-rt', '--retries', type=int, default=2, help='Retries of a failing part (with exponential backoff) before its sample is skipped.')
+@click.option('-mi', '--metrics-interval', type=float, default=30, help='Seconds between two progress reports.')
+@click.option('-mf', '--metrics-file', type=str, default=None, help='If given, progress reports are appended to this file as JSON lines.')
+def gen_prompts(src, dest, formatter, formatter_settings, zipped, zip_align, keep_duplicates, max_tokens, name, processes, force, cache_mode, retries, metrics_interval, metrics_file):
   """Transforms (serializes) the json sample into the different, proposed text formats.
      Check out /sampling/formatter for more docs.
 
      Splits the output into train- (60%), validation- (20%) and testset (20%).
+     Only the prompts of samples whose input, formatter settings or code changed are generated again.
+
+     Zipped prompts that are identical (e.g. of consecutive revisions that did not change) are written once per split,
+     the .index lists the prompt of each pair of revisions (line number in the split) instead.
+
+     With a token budget, each of the two entries of a prompt gets half of it (without the tokenizer's special tokens).
+     The number of truncated entries and dropped tokens (estimated) are reported with the metrics.
+
+     If the pairs of a sample refer to the rows of a row store (see sample), each row is formatted once and the entries are joined per pair,
+     unless the prompts are zipped or the formatter depends on the other row of a pair.
+
+     Pairs that can not be formatted are written to <dest>/<name>/.rejects/<size>-<part>.json with their error and skipped.
+     Parts that fail are retried, a sample with a part that failed after the last retry is not written and the command fails (non-zero exit code).
   """
 
   if sum(_splits.values()) != 1:
     raise AttributeError("Invalid split.")
 
   # init formatter
-  fmt = _fmt_builders[formatter](dict(formatter_settings))
+  fmt = build_formatter(formatter, formatter_settings, max_tokens)
 
   # get output name
   if not name:
-    name = f"{'zipped_' if zipped else ''}{'aligned_' if zip_align else ''}{fmt.get_config_name()}"
+    name = f"{'zipped_' if zipped else ''}{'aligned_' if zip_align else ''}{fmt.get_config_name()}{f'_max{max_tokens}' if max_tokens else ''}"
 
   dest = join(dest, name)
 
   if not exists(dest):
     os.mkdir(dest)
 
-  files = [join(dir, file) for dir, _, files in walk(src) for file in files if file.endswith(".json")]
+  samples, stores = _collect_samples(src)
+
+  # the formatter's code and the code used by all formatters
+  modules = [c.__module__ for c in type(fmt).__mro__ if c is not object]
+  modules += [__name__, "sampling.row_store", "util.html.html_util", "util.rev.revision_util", "util.wiki.wiki_table_util", "util.wiki.wikilink_util"]
+  deduplicate = zipped and not keep_duplicates
+  options = {"formatter": formatter, "settings": sorted(dict(formatter_settings).items()), "zipped": zipped, "zipAlign": zip_align, "deduplicate": deduplicate, "maxTokens": max_tokens}
+
+  cache = StageCache(dest, "gen-prompts", options, modules, cache_mode)
+  keys = {size_name: cache.key([path for path, _ in parts] + (row_store_files(stores[size_name]) if stores[size_name] else [])) for size_name, parts in samples.items()}
+  if not force:
+    samples = {size_name: parts for size_name, parts in samples.items() if not cache.is_valid(size_name, keys[size_name])}
+
+  logging.info(f"Generating prompts for {len(samples)} samples ({', '.join(samples.keys())}).")
+
+  # entries of the rows of each row store, if rows can be formatted once
+  entry_files = dict()
+  row_input = []
+  row_names = []
+  row_stores = []
+  if not zipped and fmt.is_pair_independent():
+    for store_idx, store in enumerate(sorted(set([stores[size_name] for size_name in samples if stores[size_name]]))):
+      files = row_store_files(store)
+      entry_files[store] = [join(dest, f".{ROW_STORE_NAME}{store_idx}-{i}.entries") for i in range(len(files))]
+      row_input += [(path, entries_path, fmt) for path, entries_path in zip(files, entry_files[store])]
+      row_names += [f"{ROW_STORE_NAME}{store_idx}-{i}" for i in range(len(files))]
+      row_stores += [store] * len(files)
+
+  # one task per part of each sample
+  input = []
+  names = []
+  for size_name, parts in samples.items():
+    # the number of lines of each part is known from the sample's manifest
+    total = sum([lines for _, lines in parts]) if all([lines is not None for _, lines in parts]) else None
+    start = 0
+    for part_idx, (file_path, lines) in enumerate(parts):
+      input.append((file_path, start, lines, total, size_name, part_idx, dest, fmt, zipped, zip_align, deduplicate, stores[size_name], entry_files.get(stores[size_name])))
+      names.append(f"{size_name}-{part_idx}")
+      start += lines or 0
+
+  reporter = MetricsReporter("gen-prompts", metrics_interval, metrics_file, totals={"parts": len(input)})
+  runner = TaskRunner("gen-prompts", join(dest, REJECTS_DIR), retries)
+
+  with reporter:
+
+    # the positions of the rows (or their entries) by key, so that each part reads only its rows
+    positions = dict()
+    if row_input:
+      logging.info(f"Formatting the rows of {len(entry_files)} row stores")
+      entry_files_of = {path: (store, file_idx) for store, paths in entry_files.items() for file_idx, path in enumerate(paths)}
+      with Pool(processes, initializer=init_metrics, initargs=(reporter.queue, metrics_interval)) as p:
+        for entries_path, offsets in runner.starmap(p, profiled(_format_rows), row_input, row_names):
+          store, file_idx = entry_files_of[entries_path]
+          positions.setdefault(store, dict()).update({key: (file_idx, offset) for key, offset in offsets.items()})
+
+    # samples whose row store could not be formatted are skipped
+    failed_stores = set([store for store, name in zip(row_stores, row_names) if name in runner.failures])
+    skipped = set([args[4] for args in input if args[11] in failed_stores])
+    kept = [i for i, args in enumerate(input) if args[4] not in skipped]
+    input, names = [input[i] for i in kept], [names[i] for i in kept]
+
+    for store in set([args[11] for args in input if args[11]]) - set(entry_files):
+      logging.info(f"Indexing the rows of {store}")
+      positions[store] = index_rows(store)
+
+    with Pool(processes, initializer=_init_worker, initargs=(positions, reporter.queue, metrics_interval)) as p:
+      runner.starmap(p, profiled(_format_part), input, names)
+
+  # samples with a part that failed are not written (and generated again by the next run)
+  failed = skipped | set([args[4] for args, name in zip(input, names) if name in runner.failures])
+  for size_name, parts in samples.items():
+    if size_name in failed:
+      _remove_parts(dest, size_name, len(parts))
+      continue
+    outputs = _merge_parts(dest, size_name, len(parts), deduplicate)
+    cache.store(size_name, keys[size_name], outputs)
+
+  for paths in entry_files.values():
+    for path in paths:
+      if exists(path):
+        os.remove(path)
+
+  failures = runner.summary()
+  if failures:
+    raise click.ClickException(f"{len(failures)} of {len(runner.tasks)} tasks failed, skipped samples: {', '.join(sorted(failed)) or 'none'}. See the log above.")
+
+def build_formatter(formatter: str, formatter_settings, max_tokens: int = None):
+  """Returns the formatter with the given name and settings. With a token budget, each entry gets half of it."""
 
-  with Pool(len(files)) as p:
-    input = [(file_path, dest, fmt, zipped, zip_align) for file_path in files]
-    p.starmap(_format_file, input)
+  fmt = _fmt_builders[formatter](dict(formatter_settings))
+  if max_tokens:
+    fmt.set_token_budget((max_tokens - _SPECIAL_TOKENS) // 2)
+  return fmt
+
+def _collect_samples(src: str) -> tuple:
+  """
+    Returns the parts of each sample (size) in src as list of (path, number of lines) and the manifest of the row store of each sample
+    (None if its pairs contain their rows). Parts are listed by the manifests written by the sample command. Files without manifest are
+    a sample on their own, their number of lines is None.
+  """
+
+  samples = dict()
+  stores = dict()
+
+  for dir, _, files in walk(src):
+
+    listed = set()
+    for file in sorted([f for f in files if f.endswith(MANIFEST_EXTENSION)]):
+      manifest = read_manifest(join(dir, file))
+      listed.update([part["name"] for part in manifest["parts"]])
+      if is_row_store(manifest):
+        continue
+      size_name = file[:-len(MANIFEST_EXTENSION)]
+      samples[size_name] = [(join(dir, part["name"]), part["lines"]) for part in manifest["parts"]]
+      stores[size_name] = row_store_of(join(dir, file))
+
+    for file in files:
+      if is_json_file(file) and file not in listed:
+        samples[file[:file.index(".")]] = [(join(dir, file), None)]
+        stores[file[:file.index(".")]] = None
+
+  return samples, stores
+
+def _init_worker(positions: dict, metrics_queue, metrics_interval: float):
+  """Initializes a worker process with the positions of the rows indexed by the parent and connects it to the metrics reporter."""
+
+  global _positions
+  _positions = positions
+  init_metrics(metrics_queue, metrics_interval)
+
+def _format_rows(path: str, entries_path: str, fmt) -> tuple:
+  """
+    Formats each row of a part of a row store once (for formatters that are pair independent). Writes [tableID, rowIdx, entry] of each row to entries_path.
+    Returns entries_path and the offset of the entry of each row by key.
+  """
+
+  offsets = dict()
+  with open_compressed(path, "rb") as src_file, open(entries_path, "wb") as dest_file:
+    for line_idx, line in enumerate(src_file):
+      # rows that can not be formatted are quarantined, so are the pairs that refer to them (see _format_part)
+      try:
+        with timer("decode"):
+          row = resolve_schemas(loads(line))
+        with timer("format"):
+          entry = fmt.format_entry(list(row["revisions"]), None)
+      except Exception as e:
+        reject(line, e, path, line_idx)
+        continue
+      offsets[(row["tableID"], row["rowIdx"])] = dest_file.tell()
+      dest_file.write(dumpb([row["tableID"], row["rowIdx"], entry]) + b"\n")
+      incr("rows")
+
+  flush_metrics()
+  return entries_path, offsets
+
+def _load_entries(paths: list, positions: dict, keys: set) -> dict:
+  """Reads the entries of the rows with the given keys from the files written by _format_rows, by their positions."""
+  return {key: loads(line)[2] for key, line in read_lines(paths, positions, keys).items()}
+
+def _part_keys(src_file) -> set:
+  """The keys of the rows of the compact pairs in src_file. Rewinds the file."""
+
+  keys = set()
+  for line in src_file:
+    try:
+      keys.update(pair_keys(loads(line)))
+    except Exception:
+      # the line is rejected when it is formatted
+      continue
+  src_file.seek(0)
+  return keys
+
+def _format_part(file_path: str, start: int, lines: int, total: int, size_name: str, part_idx: int, dest: str, fmt, zipped: bool, zip_align: bool, deduplicate: bool, store: str = None, entry_files: list = None):
+  """
+    Formats the lines of one part of a sample. start is the index of the part's first line within the sample and total the number of lines of the sample.
+    If lines is None, the part is the whole sample and its lines are counted.
+    The prompts of each split are written to a temporary file per part that is merged by _merge_parts.
+    If deduplicate, each distinct prompt is written once and the index refers to it by its line within the part.
+
+    store is the manifest of the row store the pairs refer to. If entry_files are given, the entries of the rows were formatted already (see _format_rows)
+    and are joined, otherwise the rows of the part are read from the row store. Both are read by their positions (see _init_worker), so that
+    each part only reads its own rows.
+  """
 
-def _format_file(file_path, dest, fmt, zipped, zip_align):
-  with open(file_path, "rb") as src_file:
+  with open_compressed(file_path, "rb") as src_file:
 
-    # count lines
-    size = len([1 for _ in src_file])
-    src_file.seek(0)
+    if lines is None:
+      # count lines
+      lines = total = len([1 for _ in src_file])
+      src_file.seek(0)
 
-    # Get the size name from the path
-    size_name = os.path.basename(os.path.normpath(file_path))
-    size_name = size_name[:size_name.index(".")]
+    # the rows (or their entries) of the pairs of this part
+    rows = None
+    if store:
+      with timer("load_rows"):
+        keys = _part_keys(src_file)
+        rows = _load_entries(entry_files, _positions[store], keys) if entry_files else load_rows(store, keys, _positions[store])
 
     # output test, train and validation split
+    split_start = 0
+    line_idx = start
     for split_name, split_size in _splits.items():
+
+      # the lines of this part that belong to the split
+      split_end = split_start + floor(total * split_size)
+      count = min(split_end, start + lines) - max(split_start, start)
+      split_start = split_end
       
       # stores which line / prompt belongs to a pair of entities.
       # This is needed to find all classifications that belong to a pair when using the aggregation method (zipping)
       revision_idx = []
+      # line of each distinct prompt of the part by its hash
+      prompt_ids = dict()
+
+      part_path = _part_path(dest, split_name, size_name, part_idx)
 
-      with open(join(dest, f"{split_name}.txt.{size_name}"), "w", encoding="utf-8") as dest_file:
-        for _ in range(floor(size * split_size)):
+      with open(part_path, "w", encoding="utf-8") as dest_file:
+        for _ in range(max(0, count)):
 
           line = src_file.readline()
-          doc = json.loads(line)
+          line_idx += 1
+
+          # pairs that can not be formatted are quarantined
+          try:
+            with timer("decode"):
+              doc = loads(line)
 
-          is_match = doc["match"]
+            if entry_files:
+              entity_pair, entries = _join_entries(doc, rows)
+            else:
+              entity_pair, entries = format_pair(resolve_rows(doc, rows) if rows is not None else doc, fmt, zipped, zip_align)
+          except Exception as e:
+            reject(line, e, file_path, line_idx - 1)
+            continue
+          incr("pairs")
 
-          revs1 = doc["row1"]["revisions"]
-          revs2 = doc["row2"]["revisions"]
+          for i, (entry1, entry2) in enumerate(entries):
+            prompt = f"{entry1} \t {entry2} \t {1 if doc['match'] else 0}\n"
 
-          formatting_pairs = [(revs1, revs2)]
+            if deduplicate:
+              key = _prompt_hash(prompt.encode("utf-8"))
+              if key in prompt_ids:
+                entity_pair["revisions"][i]["prompt"] = prompt_ids[key]
+                incr("duplicate_prompts")
+                continue
+              prompt_ids[key] = entity_pair["revisions"][i]["prompt"] = len(prompt_ids)
+
+            dest_file.write(prompt)
+            incr("prompts")
 
-          if zipped:
-            
-            if not zip_align:
-              # Implementation of zip(e,e')
-              max_revs = min(len(revs1), len(revs2))
-              formatting_pairs = [([r1], [r2]) for r1, r2 in zip(list(reversed(revs1))[:max_revs], list(reversed(revs2))[:max_revs])]
-            else:
-              # Implementation of zipNearest(e,e')
-              dates = list(map(lambda r: parse_wiki_date(r["revisionDate"]), revs1)) + list(map(lambda r: parse_wiki_date(r["revisionDate"]), revs2))
-              # Prune duplicate pairs by using a set
-              formatting_pairs = {(nearest_time(revs1, t), nearest_time(revs2, t)) for t in dates}
-              formatting_pairs = [([get_rev_at_time(revs1, t1)], [get_rev_at_time(revs2, t2)]) for t1, t2 in sorted(formatting_pairs, key=lambda t: min(*t))]
-
-          entity_pair = dict(match=is_match)
-
-          # format each (potentially zipped) pair of revisions
-          for revs1, revs2 in formatting_pairs:
-            entry1 = fmt.format_entry(revs1, revs2)
-            entry2 = fmt.format_entry(revs2, revs1)
-          
-            # Entries might be empty if there was no real schema detected.
-            if not entry1 or not entry2:
-              continue
-
-            prompt = f"{entry1} \t {entry2} \t {1 if is_match else 0}"
-
-            dest_file.write(prompt + "\n")
-
-            if zipped:
-              revs = entity_pair.setdefault("revisions", [])
-              revs.append({
-                "leftP": entry1,
-                "rightP": entry2,
-                "left": { "revisionDate": revs1[0]["revisionDate"] },
-                "right": { "revisionDate": revs2[0]["revisionDate"] }
-              })
-          
           if zipped:
             revision_idx.append(entity_pair)
       
       if len(revision_idx) > 0:
-        with open(join(dest, f"{split_name}.txt.{size_name}.index"), "w", encoding="utf-8") as file:
-          file.write(json.dumps(revision_idx, ensure_ascii=False))
+        with open(part_path + ".index", "wb") as file:
+          file.write(b"".join([dumpb(entity_pair) + b"\n" for entity_pair in revision_idx]))
+
+  incr("parts")
+  flush_metrics()
+
+def format_pair(doc: dict, fmt, zipped: bool, zip_align: bool) -> tuple:
+  """
+    Formats a pair of the sample with fmt. Returns the entity pair as listed by the .index file and the (left, right) entries
+    of each (potentially zipped) pair of revisions. Pairs of revisions with an empty entry (no real schema detected) are skipped.
+  """
+
+  if is_compact(doc):
+    raise ValueError("The pair refers to the rows of a row store, resolve them first (see sampling/row_store.py).")
+
+  is_match = doc["match"]
+
+  # copies, as rows may be shared by pairs (see resolve_rows) and formatters may reorder the revisions
+  revs1 = list(resolve_schemas(doc["row1"])["revisions"])
+  revs2 = list(resolve_schemas(doc["row2"])["revisions"])
+
+  formatting_pairs = [(revs1, revs2)]
+
+  if zipped:
+    
+    if not zip_align:
+      # Implementation of zip(e,e')
+      max_revs = min(len(revs1), len(revs2))
+      formatting_pairs = [([r1], [r2]) for r1, r2 in zip(list(reversed(revs1))[:max_revs], list(reversed(revs2))[:max_revs])]
+    else:
+      # Implementation of zipNearest(e,e')
+      dates = list(map(lambda r: parse_wiki_date(r["revisionDate"]), revs1)) + list(map(lambda r: parse_wiki_date(r["revisionDate"]), revs2))
+      # Prune duplicate pairs by using a set
+      formatting_pairs = {(nearest_time(revs1, t), nearest_time(revs2, t)) for t in dates}
+      formatting_pairs = [([get_rev_at_time(revs1, t1)], [get_rev_at_time(revs2, t2)]) for t1, t2 in sorted(formatting_pairs, key=lambda t: min(*t))]
+
+  entity_pair = dict(match=is_match)
+  entries = []
+
+  # format each (potentially zipped) pair of revisions
+  for revs1, revs2 in formatting_pairs:
+    with timer("format"):
+      entry1 = fmt.format_entry(revs1, revs2)
+      entry2 = fmt.format_entry(revs2, revs1)
+  
+    # Entries might be empty if there was no real schema detected.
+    if not entry1 or not entry2:
+      continue
+
+    entries.append((entry1, entry2))
+
+    if zipped:
+      revs = entity_pair.setdefault("revisions", [])
+      revs.append({
+        "leftP": entry1,
+        "rightP": entry2,
+        "left": { "revisionDate": revs1[0]["revisionDate"] },
+        "right": { "revisionDate": revs2[0]["revisionDate"] }
+      })
+
+  return entity_pair, entries
+
+def _join_entries(doc: dict, entries: dict) -> tuple:
+  """Like format_pair (not zipped), but with the entries of the pair's rows formatted already (see _format_rows)."""
+
+  entry1, entry2 = [entries[key] for key in pair_keys(doc)]
+  return dict(match=doc["match"]), [(entry1, entry2)] if entry1 and entry2 else []
+
+def _merge_parts(dest: str, size_name: str, parts: int, deduplicate: bool = False) -> list:
+  """
+    Concatenates the temporary outputs of the parts of a sample (see _format_part) per split. Returns the names of the outputs.
+    If deduplicate, prompts that were already written by a previous part are skipped and the prompts of the indices are renumbered.
+  """
+
+  outputs = []
+
+  for split_name in _splits.keys():
+
+    outputs.append(f"{split_name}.txt.{size_name}")
+
+    index_path = join(dest, f"{split_name}.txt.{size_name}.index")
+    if exists(index_path):
+      os.remove(index_path)
+
+    # line of each distinct prompt of the split by its hash
+    prompt_ids = dict()
+
+    with open(join(dest, f"{split_name}.txt.{size_name}"), "wb") as dest_file:
+      for part_idx in range(parts):
+
+        part_path = _part_path(dest, split_name, size_name, part_idx)
+        with open(part_path, "rb") as file:
+          if deduplicate:
+            ids = _copy_distinct(file, dest_file, prompt_ids)
+          else:
+            copyfileobj(file, dest_file)
+        os.remove(part_path)
+
+        # the index has one entity pair per line, so the parts' indices are concatenated as well
+        if exists(part_path + ".index"):
+          with open(part_path + ".index", "rb") as file, open(index_path, "ab") as index_file:
+            if deduplicate:
+              _renumber_prompts(file, index_file, ids)
+            else:
+              copyfileobj(file, index_file)
+          os.remove(part_path + ".index")
+
+    if exists(index_path):
+      outputs.append(f"{split_name}.txt.{size_name}.index")
+
+  return outputs
+
+def _remove_parts(dest: str, size_name: str, parts: int):
+  """Removes the temporary outputs of the parts of a sample (see _format_part) without merging them."""
+
+  for split_name in _splits.keys():
+    for part_idx in range(parts):
+      part_path = _part_path(dest, split_name, size_name, part_idx)
+      for path in [part_path, part_path + ".index"]:
+        if exists(path):
+          os.remove(path)
+
+def _copy_distinct(src_file, dest_file, prompt_ids: dict) -> list:
+  """Appends the prompts of src_file that are not in prompt_ids yet to dest_file. Returns the line in dest_file of each line of src_file."""
+
+  ids = []
+  for prompt in src_file:
+    key = _prompt_hash(prompt)
+    if key not in prompt_ids:
+      prompt_ids[key] = len(prompt_ids)
+      dest_file.write(prompt)
+    ids.append(prompt_ids[key])
+  return ids
+
+def _renumber_prompts(src_file, dest_file, ids: list):
+  """Appends the entity pairs of the index src_file to dest_file, with their prompts mapped by ids."""
+
+  for line in src_file:
+    entity_pair = loads(line)
+    for revision in entity_pair.get("revisions", []):
+      revision["prompt"] = ids[revision["prompt"]]
+    dest_file.write(dumpb(entity_pair) + b"\n")
+
+def _prompt_hash(prompt: bytes) -> bytes:
+  return hashlib.blake2b(prompt, digest_size=16).digest()
+
+def _part_path(dest: str, split_name: str, size_name: str, part_idx: int) -> str:
+  return join(dest, f".{split_name}.txt.{size_name}.part{part_idx}")
@@ -1,6 +1,4 @@
-from sampling.formatter.base_prompt_formatter import BasePromptFormatter
-from util.html.html_util import get_cols
-from util.wiki.wiki_table_util import get_tr
+from sampling.formatter.base_prompt_formatter import BasePromptFormatter, estimate_tokens
 
 class ConcatHistDistinctFormater(BasePromptFormatter):
   """
@@ -21,8 +19,8 @@ class ConcatHistDistinctFormater(BasePromptFormatter):
 
     for revision in reversed(revs1):
 
-      cols = get_cols(revision["schema"])
-      vals = get_cols(get_tr(revision))
+      cols = self.get_schema(revision)
+      vals = self.get_values(revision)
       col_ids = [cell["columnId"] for cell in revision["cells"]]
 
       for col, (val, col_id) in zip(cols, zip(vals, col_ids)):
@@ -38,6 +36,12 @@ class ConcatHistDistinctFormater(BasePromptFormatter):
           value_set.append(val.strip())
         if col not in schema_set:
           schema_set.append(col.strip())
+
+    if self.max_tokens is not None:
+      # values are ordered newest first
+      col_ids = list(values.keys())
+      overhead = sum([estimate_tokens(f"{self.COL} {self.separator.join(schemas[col_id])} {self.VAL}") for col_id in col_ids])
+      values = dict(zip(col_ids, self.fit_budget([values[col_id] for col_id in col_ids], overhead)))
     
     return self.dict_to_entry({self.separator.join(schemas[col_id]): self.separator.join(vals) for col_id, vals in values.items()})
   
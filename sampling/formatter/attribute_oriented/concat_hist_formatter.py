@@ -1,6 +1,4 @@
-from sampling.formatter.base_prompt_formatter import BasePromptFormatter
-from util.html.html_util import get_cols
-from util.wiki.wiki_table_util import get_tr
+from sampling.formatter.base_prompt_formatter import BasePromptFormatter, estimate_tokens
 
 class ConcatHistFormater(BasePromptFormatter):
   """
@@ -22,8 +20,8 @@ class ConcatHistFormater(BasePromptFormatter):
 
     for revision in revs1:
 
-      cols = get_cols(revision["schema"])
-      vals = get_cols(get_tr(revision))
+      cols = self.get_schema(revision)
+      vals = self.get_values(revision)
       col_ids = [cell["columnId"] for cell in revision["cells"]]
 
       for col, (val, col_id) in zip(cols, zip(vals, col_ids)):
@@ -37,6 +35,13 @@ class ConcatHistFormater(BasePromptFormatter):
         l.append(val.strip())
         if col_id not in schemas:
           schemas[col_id] = col
+
+    if self.max_tokens is not None:
+      # keep the newest values of each column
+      col_ids = list(values.keys())
+      overhead = sum([estimate_tokens(f"{self.COL} {schemas[col_id]} {self.VAL}") for col_id in col_ids])
+      kept = self.fit_budget([values[col_id] if self.desc else values[col_id][::-1] for col_id in col_ids], overhead)
+      values = {col_id: vals if self.desc else vals[::-1] for col_id, vals in zip(col_ids, kept)}
     
     return self.dict_to_entry({schemas[col_id]: " ".join(vals) for col_id, vals in values.items()})
   
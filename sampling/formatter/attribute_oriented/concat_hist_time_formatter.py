@@ -1,8 +1,6 @@
 import re
-from sampling.formatter.base_prompt_formatter import BasePromptFormatter
-from util.html.html_util import get_cols
+from sampling.formatter.base_prompt_formatter import BasePromptFormatter, estimate_tokens
 from util.rev.revision_util import get_rev_at_time
-from util.wiki.wiki_table_util import get_tr
 from util.wiki.wikilink_util import parse_wiki_date
 
 class ConcatHistTimeFormatter(BasePromptFormatter):
@@ -52,8 +50,8 @@ class ConcatHistTimeFormatter(BasePromptFormatter):
         vals = [self.NONE for _ in col_ids]
 
       else:
-        cols = get_cols(revision["schema"])
-        vals = get_cols(get_tr(revision))
+        cols = self.get_schema(revision)
+        vals = self.get_values(revision)
         col_ids = [cell["columnId"] for cell in revision["cells"]]
 
       for col, (val, col_id) in zip(cols, zip(vals, col_ids)):
@@ -74,9 +72,20 @@ class ConcatHistTimeFormatter(BasePromptFormatter):
         if col not in schema_set or self.time_union:
           schema_set.append(col.strip())
           schema_date_set.append(date)
+
+    if self.max_tokens is not None:
+      # dates are ordered newest first, so are the values of each column
+      col_ids = list(values.keys())
+      overhead = sum([estimate_tokens(f"{self.TIME} {t.strftime(self.fmt)} {self.COL} {c}") for col_id in col_ids for t, c in zip(schema_dates[col_id], schemas[col_id])])
+      kept = self.fit_budget([[f"{self.TIME} {t.strftime(self.fmt)} {self.VAL} {v}" for t, v in zip(value_dates[col_id], values[col_id])] for col_id in col_ids], overhead)
+      for col_id, entries in zip(col_ids, kept):
+        values[col_id] = values[col_id][:len(entries)]
     
     return " ".join([f'{" ".join([f"{self.TIME} {t.strftime(self.fmt)} {self.COL} {c}" for t, c in zip(schema_dates[col_id], schemas[col_id])])} {" ".join([f"{self.TIME} {t.strftime(self.fmt)} {self.VAL} {v}" for t, v in zip(value_dates[col_id], vals)])}' for col_id, vals in values.items()])
   
+  def is_pair_independent(self) -> bool:
+    return not self.time_union
+
   def get_config_name(self):
     fmt = re.sub('[^0-9a-zA-Z]+', '', self.fmt.lower())
     name = ""
@@ -1,8 +1,6 @@
 from datetime import timedelta
 from sampling.formatter.base_prompt_formatter import BasePromptFormatter
-from util.html.html_util import get_cols
 from util.rev.revision_util import nearest_rev
-from util.wiki.wiki_table_util import get_tr
 from util.wiki.wikilink_util import parse_wiki_date
 
 class NoHistPromptFormatter(BasePromptFormatter):
@@ -31,15 +29,18 @@ class NoHistPromptFormatter(BasePromptFormatter):
       rev = nearest_rev(revs1, min(date1, date2))
    
     else:
-       revs1[self.idx]
+      rev = revs1[self.idx]
 
-    cols = get_cols(rev["schema"])
-    vals = get_cols(get_tr(rev))
+    cols = self.get_schema(rev)
+    vals = self.get_values(rev)
     
     d = dict(zip(cols, vals))
 
     return self.dict_to_entry(d)
   
+  def is_pair_independent(self) -> bool:
+    return not self.align
+
   def get_config_name(self):
     if self.newest and not self.align:
       return "nhNewest"
@@ -1,3 +1,18 @@
+import re
+from util.html.html_util import get_cols
+from util.wiki.wiki_table_util import get_tr
+from util.metrics.stage_metrics import incr
+
+# Words and punctuation. Each one is about one token of a subword tokenizer (e.g. RoBERTa's), long words are split into multiple tokens.
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Max. number of parsed revisions (and schemas) a formatter keeps
+_CACHE_SIZE = 4096
+
+def estimate_tokens(text: str) -> int:
+  """Cheaply estimates the number of tokens of text without a tokenizer."""
+
+  return sum([1 + (len(t) - 1) // 8 for t in _TOKEN_PATTERN.findall(text)])
+
 class BasePromptFormatter:
     
   def __init__(self):
@@ -7,6 +22,9 @@ class BasePromptFormatter:
     self.TIME = "TIME"
     self.NONE = "NONE"
     self.PERIOD = "PERIOD"
+    self.max_tokens = None
+    self._values = dict()
+    self._schemas = dict()
 
   def format_entry(self, revs1: list, revs2: list) -> str:
     """
@@ -20,5 +38,79 @@ class BasePromptFormatter:
     """
     raise NotImplementedError()
   
+  def is_pair_independent(self) -> bool:
+    """
+      Returns True if the entry of a row does not depend on the other row of the pair (revs2 of format_entry).
+      The rows of a sample can be formatted once then, instead of once per pair.
+    """
+    return True
+
   def dict_to_entry(self, d: dict) -> str:
-    return ' '.join([ f"{self.COL} {k} {self.VAL} {v}" for k, v in d.items()])
\ No newline at end of file
+    return ' '.join([ f"{self.COL} {k} {self.VAL} {v}" for k, v in d.items()])
+
+  def get_values(self, revision: dict) -> list:
+    """
+      The values of the cells of the revision. Revisions with a contentHash (added by filter) are parsed once per formatter, as the
+      same revisions are formatted for each pair of their row. The returned list is shared and must not be changed.
+    """
+
+    key = revision.get("contentHash")
+    if key is None:
+      return get_cols(get_tr(revision))
+    return self._cached(self._values, key, lambda: get_cols(get_tr(revision)))
+
+  def get_schema(self, revision: dict) -> list:
+    """The column names of the revision's schema, parsed once per schema. The returned list is shared and must not be changed."""
+
+    schema = revision["schema"]
+    return self._cached(self._schemas, schema, lambda: get_cols(schema))
+
+  def _cached(self, cache: dict, key, compute):
+    value = cache.get(key)
+    if value is None:
+      if len(cache) >= _CACHE_SIZE:
+        cache.clear()
+      value = cache[key] = compute()
+    return value
+
+  def set_token_budget(self, max_tokens: int):
+    """
+      Limits each entry to about max_tokens tokens (None for no limit). Formatters that concatenate histories keep the most informative
+      (newest) part of the history within the budget instead of producing text that the tokenizer cuts off.
+    """
+    self.max_tokens = max_tokens
+
+  def fit_budget(self, groups: list, overhead: int = 0) -> list:
+    """
+      Selects the items of groups (e.g. the values of each column, newest first) that fit into the token budget. overhead is the number of tokens
+      needed besides the items (e.g. for column names). Items are selected round-robin: first the first item of each group, then the second one, ...
+      The first item of each group is always selected. Returns the selected items of each group in their original order.
+      The number of entries, truncated entries and dropped tokens are counted as metrics.
+    """
+
+    if self.max_tokens is None:
+      return groups
+
+    costs = [[estimate_tokens(item) for item in group] for group in groups]
+    budget = self.max_tokens - overhead - sum([c[0] for c in costs if c])
+    selected = [min(1, len(group)) for group in groups]
+    full = [False for _ in groups]
+
+    for rank in range(1, max([len(group) for group in groups], default=0)):
+      for i, group_costs in enumerate(costs):
+        if full[i] or rank >= len(group_costs):
+          continue
+        if group_costs[rank] > budget:
+          # keep the selection of each group a prefix, so that no older item is selected without the newer ones
+          full[i] = True
+          continue
+        budget -= group_costs[rank]
+        selected[i] += 1
+
+    dropped = sum([sum(c[n:]) for c, n in zip(costs, selected)])
+    incr("entries")
+    if dropped > 0:
+      incr("truncated_entries")
+      incr("dropped_tokens", dropped)
+
+    return [group[:n] for group, n in zip(groups, selected)]
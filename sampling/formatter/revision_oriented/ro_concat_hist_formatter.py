@@ -1,6 +1,4 @@
 from sampling.formatter.base_prompt_formatter import BasePromptFormatter
-from util.html.html_util import get_cols
-from util.wiki.wiki_table_util import get_tr
 
 class ROConcatHistFormatter(BasePromptFormatter):
   """
@@ -18,12 +16,20 @@ class ROConcatHistFormatter(BasePromptFormatter):
   def format_entry(self, revs1: list, revs2: list) -> str:
 
     seen_pairs = set()
+    seen_revisions = set()
     fmtd_revisions = []
 
     for revision in reversed(revs1):
 
-      cols = get_cols(revision["schema"])
-      vals = get_cols(get_tr(revision))
+      # all cells of a revision identical to one seen before are seen already
+      key = (revision["schema"], revision.get("contentHash"))
+      if self.distinct and key[1] is not None and key in seen_revisions:
+        fmtd_revisions.append(self.dict_to_entry({}))
+        continue
+      seen_revisions.add(key)
+
+      cols = self.get_schema(revision)
+      vals = self.get_values(revision)
 
       row = {k: v for k, v in zip(cols, vals) if (k, v) not in seen_pairs}
       fmtd_revisions.append(self.dict_to_entry(row))
@@ -31,6 +37,9 @@ class ROConcatHistFormatter(BasePromptFormatter):
       if self.distinct:
         seen_pairs.update(zip(cols, vals))
 
+    # revisions are ordered newest first
+    fmtd_revisions = self.fit_budget([fmtd_revisions])[0]
+
     return self.separator.join(fmtd_revisions)
   
   def get_config_name(self):
@@ -1,8 +1,6 @@
 import re
 from sampling.formatter.base_prompt_formatter import BasePromptFormatter
-from util.html.html_util import get_cols
 from util.rev.revision_util import nearest_rev
-from util.wiki.wiki_table_util import get_tr
 from util.wiki.wikilink_util import parse_wiki_date
 
 class ROConcatHistTimeFormatter(BasePromptFormatter):
@@ -39,15 +37,21 @@ class ROConcatHistTimeFormatter(BasePromptFormatter):
 
       revision = nearest_rev(revs1, date)
 
-      cols = get_cols(revision["schema"])
-      vals = get_cols(get_tr(revision))
+      cols = self.get_schema(revision)
+      vals = self.get_values(revision)
 
       row = {k: v for k, v in zip(cols, vals)}
       fmtd_revision = f"{self.TIME} {date.strftime(self.fmt)} {self.dict_to_entry(row)}"
       fmtd_revisions.append(fmtd_revision)
 
+    # revisions are ordered newest first
+    fmtd_revisions = self.fit_budget([fmtd_revisions])[0]
+
     return " ".join(fmtd_revisions)
   
+  def is_pair_independent(self) -> bool:
+    return not self.time_union
+
   def get_config_name(self):
     fmt = re.sub('[^0-9a-zA-Z]+', '', self.fmt.lower())
     name = ""
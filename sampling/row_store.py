@@ -0,0 +1,146 @@
+import os
+from os.path import dirname, join, normpath
+
+from util.io.json_codec import loads, dumpb, load_fields
+from util.io.compressed_io import open_compressed
+from util.rotating_file_writer import RotatingFileWriter, read_manifest, write_manifest, MANIFEST_EXTENSION
+
+ROW_STORE_NAME = "rows"
+
+class RowStoreWriter:
+  """
+    Writes each row of a sample once to size-bounded parts dir/rows-<n>.json, listed in dir/rows.manifest.
+    The pairs of the sample refer to their rows by key ([tableID, rowIdx]), so that rows that are part of many pairs are stored,
+    decoded and formatted once.
+
+    Several processes can write one store, each under its own name (dir/<name>-<n>.json, dir/<name>.manifest), see merge_row_stores.
+  """
+
+  def __init__(self, dir: str, extension: str = ".json", max_MB: float = 200, name: str = ROW_STORE_NAME):
+    self.manifest = join(dir, name + MANIFEST_EXTENSION)
+    self._writer = RotatingFileWriter(dir, "wb", base_name=name + "-", extension=extension, max_MB=max_MB, manifest=self.manifest, manifest_fields={"store": ROW_STORE_NAME})
+    self._keys = set()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self._writer.__exit__(type, value, traceback)
+
+  def __contains__(self, key: tuple) -> bool:
+    return key in self._keys
+
+  @property
+  def parts(self) -> list:
+    return self._writer.parts
+
+  def clear(self):
+    """Removes the row store of a previous run."""
+    self._writer.clear()
+
+  def skip(self, keys: list):
+    """Treats the rows with the given keys as written, e.g. because another process writes them to the store."""
+    self._keys.update(keys)
+
+  def add(self, row: dict):
+    """Writes the row, unless it was written before."""
+
+    key = row_key(row)
+    if key in self._keys:
+      return
+    self._keys.add(key)
+    # the key comes first, so that it can be read without decoding the row (see load_rows)
+    self._writer.write(dumpb({"tableID": row["tableID"], "rowIdx": row["rowIdx"], **row}) + b"\n")
+
+def merge_row_stores(dir: str, names: list) -> str:
+  """Lists the parts of the stores names (written to dir by RowStoreWriters with these names) in the single store dir/rows.manifest. Returns its path."""
+
+  manifests = [join(dir, name + MANIFEST_EXTENSION) for name in names]
+  path = join(dir, ROW_STORE_NAME + MANIFEST_EXTENSION)
+  write_manifest(path, [part for manifest in manifests for part in read_manifest(manifest)["parts"]], {"store": ROW_STORE_NAME})
+  for manifest in manifests:
+    os.remove(manifest)
+  return path
+
+def row_key(row: dict) -> tuple:
+  return (row["tableID"], row["rowIdx"])
+
+def is_compact(pair: dict) -> bool:
+  """Returns True if the pair lists the keys of its rows instead of the rows (see resolve_rows)."""
+  return isinstance(pair["row1"], list)
+
+def pair_keys(pair: dict) -> list:
+  """The keys of the two rows of a compact pair."""
+  return [tuple(pair["row1"]), tuple(pair["row2"])]
+
+def is_row_store(manifest: dict) -> bool:
+  return manifest.get("store") == ROW_STORE_NAME
+
+def row_store_of(manifest_path: str) -> str:
+  """Returns the manifest of the row store of a sample, given the manifest of one of its sizes. None if the pairs of the sample contain their rows."""
+
+  rows = read_manifest(manifest_path).get("rows")
+  return normpath(join(dirname(manifest_path), rows)) if rows else None
+
+def row_store_files(manifest_path: str) -> list:
+  """The paths of the parts of a row store."""
+  return [join(dirname(manifest_path), part["name"]) for part in read_manifest(manifest_path)["parts"]]
+
+def index_rows(manifest_path: str) -> dict:
+  """The position (index of the part, offset) of each row of a row store by key, so that rows can be read without scanning the store (see load_rows)."""
+
+  positions = dict()
+  for part_idx, path in enumerate(row_store_files(manifest_path)):
+    with open_compressed(path, "rb") as file:
+      offset = file.tell()
+      for line in file:
+        fields = load_fields(line, ["tableID", "rowIdx"])
+        positions[(fields["tableID"], fields["rowIdx"])] = (part_idx, offset)
+        offset = file.tell()
+  return positions
+
+def read_lines(paths: list, positions: dict, keys: set) -> dict:
+  """Reads the lines with the given keys by their position (index of the file in paths, offset) in positions. Keys without position are missing in the result."""
+
+  by_file = dict()
+  for key in keys:
+    if key in positions:
+      file_idx, offset = positions[key]
+      by_file.setdefault(file_idx, []).append((offset, key))
+
+  lines = dict()
+  for file_idx, file_keys in by_file.items():
+    with open_compressed(paths[file_idx], "rb") as file:
+      # in file order, so that each block of a compressed file is decompressed once
+      for offset, key in sorted(file_keys):
+        file.seek(offset)
+        lines[key] = file.readline()
+  return lines
+
+def load_rows(manifest_path: str, keys: set = None, positions: dict = None) -> dict:
+  """
+    Reads the rows of a row store by key. If keys is given, only these rows are decoded.
+    With the positions of the rows (see index_rows), only the rows with the given keys are read.
+  """
+
+  if positions is not None:
+    return {key: loads(line) for key, line in read_lines(row_store_files(manifest_path), positions, keys).items()}
+
+  rows = dict()
+  for path in row_store_files(manifest_path):
+    with open_compressed(path, "rb") as file:
+      for line in file:
+        if keys is not None:
+          fields = load_fields(line, ["tableID", "rowIdx"])
+          if (fields["tableID"], fields["rowIdx"]) not in keys:
+            continue
+        row = loads(line)
+        rows[row_key(row)] = row
+  return rows
+
+def resolve_rows(pair: dict, rows: dict) -> dict:
+  """Replaces the keys of a compact pair by its rows (rows by key, see load_rows). Rows are shared by all pairs that refer to them. Returns the pair."""
+
+  if is_compact(pair):
+    pair["row1"], pair["row2"] = [rows[key] for key in pair_keys(pair)]
+  return pair
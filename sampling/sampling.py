@@ -1,5 +1,5 @@
 from collections import Counter
-import json
+from contextlib import nullcontext
 from math import floor
 from os import listdir
 import os
@@ -12,10 +12,32 @@ from util.sim.jaccard import jaccard_similarity
 from util.html.html_util import get_text
 from shutil import rmtree
 from util.wiki.wiki_table_util import get_tr
+from util.rev.revision_util import intern_schemas
+from sampling.row_store import RowStoreWriter, ROW_STORE_NAME
 
 from util.wiki.wikilink_result import WikilinkResult
+from util.io.json_codec import loads, dumpb
+from util.io.compressed_io import COMPRESSIONS, BLOCK_TABLE_SUFFIX, codec_of, has_block_table, list_json_files, extension_of, open_compressed, strip_json_extension
+from util.io.prefetcher import Prefetcher
+from util.rotating_file_writer import RotatingFileWriter, MANIFEST_EXTENSION
+from util.cache.stage_cache import StageCache, CACHE_MODES
+from util.profiling.profiler import profiled
+from util.metrics.stage_metrics import MetricsReporter, init_metrics, incr, timer, flush_metrics
+from util.dist.claims import WorkClaims, run_claimed
+from util.tasks.task_runner import TaskRunner, REJECTS_DIR, reject
+from util.sampling.pair_set import PairSet, pair_key
 
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s [%(process)d] - %(message)s")
+
+# Directory of the lease files of the distributed mode and the shard of the step that only one node runs (see WorkClaims)
+_CLAIMS_DIR = join(".claims", "sample")
+_SAMPLE_SHARD = "sample"
+
+# Bits of the Bloom filter in front of the set of sampled pairs per pair (~2% false positives with 3 hashes), if enabled
+_BLOOM_BITS_PER_PAIR = 10
+
+# Number of pairs whose rows are read at once. The rows of a batch are read while the next batch is sampled.
+_PAIR_BATCH_SIZE = 256
 
 @click.command()
 @click.argument('src', type=str)
@@ -23,15 +45,50 @@ logging.basicConfig(level=logging.DEBUG, format="%(asctime)s: %(levelname)s [%(p
 @click.option('-s', '--size', type=int, default=200, help='The number of pairs to build')
 @click.option('-idx', '--index', type=str, default="matches.index", help='The name of the index file in src. If not found, the index will be computed.')
 @click.option('-p', '--processes', type=int, default=None, help='The number of processes to use. If not given, the CPU\'s max. will be used.')
-def sample(src, dest, size, index, processes):
+@click.option('-c', '--compression', type=click.Choice(COMPRESSIONS), default="none", help='Compression of the output files (none).')
+@click.option('-mb', '--max-mb', type=float, default=200, help='Max. (uncompressed) size of an output part in MB.')
+@click.option('-f', '--force', type=bool, default=False, is_flag=True, help='Sample, even if the output at dest is up to date.')
+@click.option('-cm', '--cache-mode', type=click.Choice(CACHE_MODES), default="stat", help='Detect changed inputs by size and modification time (stat) or by their content (hash).')
+@click.option('-dist', '--distributed', type=bool, default=False, is_flag=True, help='Share the index build with the other nodes that run the same command on a shared filesystem. Files are claimed through lease files in dest/.claims.')
+@click.option('-lt', '--lease-ttl', type=float, default=60, help='Seconds after which the files of a node without heartbeat are claimed by other nodes (with -dist).')
+@click.option('-rt', '--retries', type=int, default=2, help='Retries of a file that fails to be indexed (with exponential backoff) before it is skipped.')
+@click.option('-bl', '--bloom', type=bool, default=False, is_flag=True, help='Check a Bloom filter before the set of sampled pairs, so that most new pairs are found without probing it.')
+@click.option('-mi', '--metrics-interval', type=float, default=30, help='Seconds between two progress reports.')
+@click.option('-mf', '--metrics-file', type=str, default=None, help='If given, progress reports are appended to this file as JSON lines.')
+def sample(src, dest, size, index, processes, compression, max_mb, force, cache_mode, distributed, lease_ttl, retries, bloom, metrics_interval, metrics_file):
   """
     Implementation of the sampling stage of the data creation pipeline.
     Chooses random positive and negative row-pairs. For negative row-pairs, it chooses the most (jaccard) similar row that has a different link.
     Subsamples the given size into 5% (s), 10% (m), 50% (l) and 100% (xl) outputs.
+    Each output is written to size-bounded parts <size>/<size>-<n>.json, listed in <size>/<size>.manifest.
+    The pairs refer to their rows by [tableID, rowIdx]. Each sampled row is written once to the row store rows/rows-<n>.json (see sampling/row_store.py).
 
     The index is a dictionary. Each key is a link and each value a list of identifiers that refer to the rows containing that key as link.
+    It is recomputed if the files in src changed since it was built. Tables that can not be indexed are written to dest/.rejects/<file>.json
+    with their error, files that fail are retried and left out of the index after the last retry (the command fails then, after sampling).
+
+    With -dist, the index of each file is built by one of the nodes (machines or processes) that run the same command with the same dest
+    on a shared filesystem (see util/dist/claims.py). One node then merges the indices and samples, the others exit once it finished.
+
+    Nothing is done if the output at dest was sampled from the same files with the same options and code.
   """
 
+  files = sorted(list_json_files(src))
+  sequential = [f for f in files if codec_of(f) != "none" and not has_block_table(join(src, f))]
+  if sequential:
+    # the rows of the pairs are read with random access
+    raise click.ClickException(f"{', '.join(sequential)} in {src} have no block table ({BLOCK_TABLE_SUFFIX}), e.g. because they were compressed by an external tool. Decompress them or write them with filter -c.")
+  modules = [__name__, "util.html.html_util", "util.sim.jaccard", "util.wiki.wiki_table_util", "util.wiki.wikilink_result", "util.rev.revision_util", "util.rev.fingerprint", "util.sampling.pair_set", "sampling.row_store"]
+
+  cache = StageCache(dest, "sample", {"size": size, "compression": compression, "maxMB": max_mb}, modules, cache_mode)
+  cache_key = cache.key([join(src, f) for f in files])
+  if not force and cache.is_valid("sample", cache_key):
+    logging.info("The output is up to date.")
+    return
+
+  index_cache = StageCache(src, "sample-index", {"index": index}, modules, cache_mode)
+  index_key = index_cache.key([join(src, f) for f in files])
+
   sizes = {
     "s": floor(.05 * size),
     "m": floor(.1 * size),
@@ -42,107 +99,159 @@ def sample(src, dest, size, index, processes):
   # 50% matches 50% non-matches
   size = floor(size / 2)
 
-  tmp_dir = join(dest, "tmp")
-  if os.path.exists(tmp_dir):
-    rmtree(tmp_dir)
-  os.makedirs(tmp_dir)
+  reporter = MetricsReporter("sample", metrics_interval, metrics_file, totals={"matches": size, "non_matches": size})
+  claims = WorkClaims(join(dest, _CLAIMS_DIR), lease_ttl) if distributed else None
+  runner = TaskRunner("sample-index", join(dest, REJECTS_DIR), retries)
 
   try:
 
-    # ===== Build index =====
-    idx_path = join(src, index)
-    idx = None
-    
-    # check if the index already exists
-    if isfile(idx_path):
-      
-      logging.info(f"Found exisitng index at {idx_path}")
-
-      with open(join(src, index), "rb") as idx_file:
-        idx = json.loads(idx_file.readline())
-    
-    # compute the index otherwise
-    else:
-
-      # get the files
-      files = [f for f in listdir(src) if isfile(join(src, f)) and f.endswith(".json")]
-      logging.info(f'Found {len(files)} files to sample from.')
-
-      logging.info("Computing index")
+    with reporter, claims or nullcontext():
 
-      input = [(src, file) for file in files]
+      # ===== Build index =====
+      idx_path = join(src, index)
+      idx = None
       indices = None
-      with Pool(processes) as p:
-        indices =  np.array(p.starmap(_build_matching_index, input))
-
-      # find out which buckets contain more than one line -> more than one row referring to the same page.
-      match_count = 0
-      no_match_count = 0
-      idx = dict()
-      links = set([l for i in indices for l in i.keys()])
-
-      for link in links:
-        rows = []
-        for i in indices:
-          if link in i:
-            rows.extend(i[link])
-        
-        row_count = len(rows)
-        if row_count > 1:
-          idx[link] = rows
-          match_count += row_count
-        else:
-          no_match_count += row_count
-      
-      # output the index for the next time
-      with open(idx_path, "w", encoding="utf-8") as file:
+      # check if the index already exists and was built from the current files (indices of unknown origin are used as they are)
+      index_found = isfile(idx_path) and (index_cache.is_valid("index", index_key) or not index_cache.stored("index"))
 
-        logging.info(f"Writing index to {idx_path}")
-        file.write(json.dumps(idx, ensure_ascii=False))
-    
-      # print stats
-      total_count = no_match_count + match_count
-      logging.info(f"{match_count} ({round(match_count / total_count * 100, 2)}%) rows have a match")
-      logging.info(f"{total_count - match_count} ({round((total_count - match_count) / total_count * 100, 2)}%) rows have no match")
+      # compute the index otherwise
+      if not index_found:
 
-    # ===== Build matching pairs =====
-    logging.info(f"========= Building matches ({size}) ========")
-    pos_sims = _build_matches(src, tmp_dir, idx, size)
+        logging.info(f'Found {len(files)} files to sample from.')
 
-    # ===== Build non-matching pairs =====
-    logging.info(f"========= Building non-matches ({size}) ========")
-    #_build_non_matches(src, tmp_dir, idx, pos_sims)
-    _build_no_matches(src, tmp_dir, idx, pos_sims)
+        logging.info("Computing index")
 
-    # ===== Output =====
-    lines = []
-    files = [f for f in listdir(tmp_dir) if isfile(join(src, f)) and f.endswith(".json")]
-    for f in listdir(tmp_dir):
-      with open(join(tmp_dir, f), "rb") as file:
-        lines += [l for l in file]
+        input = [(src, file) for file in files]
+        with Pool(processes, initializer=init_metrics, initargs=(reporter.queue, metrics_interval)) as p:
+          if claims:
+            tasks = {file: (runner.wrap(profiled(_build_matching_index), strip_json_extension(file)), args) for file, args in zip(files, input)}
+            own = run_claimed(p, tasks, claims, processes or os.cpu_count(), {file: index_key for file in files})
+            logging.info(f"Indexed {len(own)} of {len(files)} files")
+          else:
+            indices = runner.starmap(p, profiled(_build_matching_index), input, [strip_json_extension(file) for file in files])
 
-    np.random.shuffle(lines)
+      # the index is merged and the pairs are sampled by one node only
+      if claims and not claims.claim_or_wait(_SAMPLE_SHARD, cache_key):
+        logging.info("The output was sampled by another node.")
+        return
 
-    # split into different sizes
-    for size_name, size in sizes.items():
+      if index_found:
 
-      size_dest = join(dest, size_name)
-      if not os.path.exists(size_dest):
-        os.makedirs(size_dest)
+        logging.info(f"Found exisitng index at {idx_path}")
 
-      with open(join(size_dest, size_name + ".json"), "wb") as file:
-        
-        for line in lines[0:size]:
-          file.write(line)
+        with open(join(src, index), "rb") as idx_file:
+          idx = loads(idx_file.readline())
 
-    logging.info("Processed all files.")
+      else:
 
-    rmtree(tmp_dir)
+        if claims:
+          records = claims.results(files)
+          indices = runner.collect([strip_json_extension(file) for file in records], [record["result"] for record in records.values()])
+        runner.summary()
+        idx = _merge_indices(indices)
+      
+        # output the index for the next time, unless files are missing (the next run builds it again then)
+        if not runner.failures:
+          with open(idx_path, "wb") as file:
+
+            logging.info(f"Writing index to {idx_path}")
+            file.write(dumpb(idx))
+          index_cache.store("index", index_key, [index])
+
+      tmp_dir = join(dest, "tmp")
+      if os.path.exists(tmp_dir):
+        rmtree(tmp_dir)
+      os.makedirs(tmp_dir)
+
+      rows_dir = join(dest, ROW_STORE_NAME)
+      if not os.path.exists(rows_dir):
+        os.makedirs(rows_dir)
+      row_store = RowStoreWriter(rows_dir, ".json" + extension_of(compression), max_mb)
+      row_store.clear()
+
+      with row_store:
+
+        # ===== Build matching pairs =====
+        logging.info(f"========= Building matches ({size}) ========")
+        pos_sims = _build_matches(src, tmp_dir, idx, size, row_store, bloom)
+
+        # ===== Build non-matching pairs =====
+        logging.info(f"========= Building non-matches ({size}) ========")
+        #_build_non_matches(src, tmp_dir, idx, pos_sims)
+        _build_no_matches(src, tmp_dir, idx, pos_sims, row_store, reporter.queue, metrics_interval, bloom)
+
+      # ===== Output =====
+      lines = []
+      files = [f for f in listdir(tmp_dir) if isfile(join(src, f)) and f.endswith(".json")]
+      for f in listdir(tmp_dir):
+        with open(join(tmp_dir, f), "rb") as file:
+          lines += [l for l in file]
+
+      np.random.shuffle(lines)
+
+      # split into different sizes
+      outputs = [join(ROW_STORE_NAME, part["name"]) for part in row_store.parts] + [join(ROW_STORE_NAME, ROW_STORE_NAME + MANIFEST_EXTENSION)]
+      for size_name, size in sizes.items():
+
+        size_dest = join(dest, size_name)
+        if not os.path.exists(size_dest):
+          os.makedirs(size_dest)
+
+        # remove the output of a previous run
+        for f in list_json_files(size_dest):
+          os.remove(join(size_dest, f))
+          if os.path.exists(join(size_dest, f + BLOCK_TABLE_SUFFIX)):
+            os.remove(join(size_dest, f + BLOCK_TABLE_SUFFIX))
+
+        with RotatingFileWriter(size_dest, "wb", base_name=f"{size_name}-", extension=".json" + extension_of(compression), max_MB=max_mb, manifest=join(size_dest, size_name + MANIFEST_EXTENSION), manifest_fields={"rows": join("..", ROW_STORE_NAME, ROW_STORE_NAME + MANIFEST_EXTENSION)}) as file:
+          
+          for line in lines[0:size]:
+            file.write(line)
+
+        outputs += [join(size_name, part["name"]) for part in file.parts] + [join(size_name, size_name + MANIFEST_EXTENSION)]
+
+      if not runner.failures:
+        cache.store("sample", cache_key, outputs)
+      if claims:
+        claims.complete(_SAMPLE_SHARD, None, cache_key)
+      rmtree(tmp_dir)
+
+      if runner.failures:
+        raise click.ClickException(f"Sampled without the {len(runner.failures)} of {len(runner.tasks)} files that failed, see the log above.")
+      logging.info("Processed all files.")
 
   except KeyboardInterrupt:
-    p.terminate()
     logging.info("Aborting")
 
+def _merge_indices(indices: list) -> dict:
+  """Merges the indices of the files (see _build_matching_index) into one that only contains the buckets with more than one row."""
+
+  # find out which buckets contain more than one line -> more than one row referring to the same page.
+  match_count = 0
+  no_match_count = 0
+  idx = dict()
+  links = set([l for i in indices for l in i.keys()])
+
+  for link in links:
+    rows = []
+    for i in indices:
+      if link in i:
+        rows.extend(i[link])
+  
+    row_count = len(rows)
+    if row_count > 1:
+      idx[link] = rows
+      match_count += row_count
+    else:
+      no_match_count += row_count
+
+  # print stats
+  total_count = no_match_count + match_count
+  logging.info(f"{match_count} ({round(match_count / total_count * 100, 2)}%) rows have a match")
+  logging.info(f"{total_count - match_count} ({round((total_count - match_count) / total_count * 100, 2)}%) rows have no match")
+
+  return idx
+
 def _build_matching_index(src_dir: str, file_name: str):
   """
     Group all rows in the given file by their respective wikilink.
@@ -153,59 +262,83 @@ def _build_matching_index(src_dir: str, file_name: str):
 
   index = dict()
 
-  with open(join(src_dir, file_name), "rb") as src_file:
+  with open_compressed(join(src_dir, file_name), "rb") as src_file:
 
     offset = 0
 
-    for line in src_file:
-      
-      doc = json.loads(line)
-      page_title = doc["pageTitle"]
-
-      for row_idx, row in enumerate(doc["rows"]):
-        
-        link = WikilinkResult.from_dict(row["link"])
-
-        descriptors = index.setdefault(link.identifier, [])
-        descriptors.append((file_name, offset, row_idx, doc["tableID"], get_text(get_tr(row["revisions"][-1]), page_title, " ").lower()))
+    for line_idx, line in enumerate(src_file):
+
+      # tables that can not be indexed are quarantined, the index is only updated once all rows of a table are read
+      try:
+        doc = loads(line)
+        page_title = doc["pageTitle"]
+        descriptors = []
+
+        for row_idx, row in enumerate(doc["rows"]):
+          
+          link = WikilinkResult.from_dict(row["link"])
+          descriptors.append((link.identifier, (file_name, offset, row_idx, doc["tableID"], get_text(get_tr(row["revisions"][-1]), page_title, " ").lower())))
+      except Exception as e:
+        reject(line, e, file_name, line_idx)
+        offset = src_file.tell()
+        continue
+
+      for identifier, descriptor in descriptors:
+        index.setdefault(identifier, []).append(descriptor)
       
       offset = src_file.tell()
+      incr("tables")
+      incr("rows", len(doc["rows"]))
+
+  incr("files")
+  flush_metrics()
 
   return index
 
-def _build_matches(src_dir: str, dest_dir, index: dict, size: int):
+def _build_matches(src_dir: str, dest_dir, index: dict, size: int, row_store: RowStoreWriter, bloom: bool = False):
   """
-    Builds combinations of the rows in bucket and writes it to dest_dir
+    Builds combinations of the rows in bucket and writes it to dest_dir (their rows to row_store)
   """
 
   sims = []
   idx = 0
-  seen_combs = set()
 
   values = [(identifier, pointer) for identifier, pointers in index.items() for pointer in pointers]
-  np.random.shuffle(values)
+  row_ids = _intern_rows(values)
+  seen_combs = PairSet(size, _BLOOM_BITS_PER_PAIR * size if bloom else 0)
+
+  # the values of a bucket are consecutive, starting at the bucket's start
+  starts = dict()
+  start = 0
+  for identifier, pointers in index.items():
+    starts[identifier] = start
+    start += len(pointers)
+
+  order = np.random.permutation(len(values))
+  pair_writer = PairWriter(src_dir, join(dest_dir, "matches.json"), row_store)
 
   while len(sims) < size:
     
-    choice = values[idx]
-    identifier = choice[0]
-    row_pointer1 = choice[1]
+    value_idx1 = order[idx]
+    identifier, row_pointer1 = values[value_idx1]
 
     idx += 1
+    incr("match_candidates")
 
     # choose a partner within the same bucket that is from a different table
     bucket = index[identifier]
-    row_pointer2 = None
+    value_idx2 = value_idx1
 
-    while not row_pointer2 or row_pointer2 == row_pointer1:
-      row_pointer2 = bucket[np.random.randint(0,len(bucket))]
+    while value_idx2 == value_idx1:
+      value_idx2 = starts[identifier] + np.random.randint(0,len(bucket))
+    row_pointer2 = values[value_idx2][1]
     
-    key1 = f"{row_pointer1[3]}-{str(row_pointer1[2])}"
-    key2 = f"{row_pointer2[3]}-{str(row_pointer2[2])}"
-    comb = "--".join(sorted([key1, key2]))
+    id1 = row_ids.item(value_idx1)
+    id2 = row_ids.item(value_idx2)
+    comb = pair_key(id1, id2)
 
     # Same row
-    if key1 == key2:
+    if id1 == id2:
       continue
 
     # Seen combination
@@ -213,17 +346,17 @@ def _build_matches(src_dir: str, dest_dir, index: dict, size: int):
       continue
     
     sim = jaccard_similarity(row_pointer1[4], row_pointer2[4])
-    pair = _format_pair(row_pointer1, row_pointer2, matching=True, dir=src_dir)
-
-    with open(join(dest_dir, "matches.json"), "a", encoding="utf-8") as file:
-      file.write(json.dumps(pair, ensure_ascii=False) + "\n")
+    pair_writer.add(row_pointer1, row_pointer2, matching=True)
     
     sims.append(sim)
     seen_combs.add(comb)
+    incr("matches")
   
+  pair_writer.close()
+
   return sims
 
-def _build_no_matches(src_dir: str, dest_dir: str, index: dict, pos_sims: list):
+def _build_no_matches(src_dir: str, dest_dir: str, index: dict, pos_sims: list, row_store: RowStoreWriter, metrics_queue=None, metrics_interval: float=30, bloom: bool = False):
   """Samples negatives pairs by starting a set of workers that try to find pairs that randomly fit into the similarity distribution of the positive pairs."""
   
   NUM_TASKS = min(80, os.cpu_count())
@@ -233,26 +366,26 @@ def _build_no_matches(src_dir: str, dest_dir: str, index: dict, pos_sims: list):
   sims_digitized = np.digitize(pos_sims, intervals) - 1
   sim_dist = Counter({k: floor(v * 1.001) for k, v in Counter(sims_digitized).items()}) # allow overfilling of 1% per bucket
   values = [(identifier, pointer) for identifier, pointers in index.items() for pointer in pointers]
-  seen_combs = set()
+  row_ids = _intern_rows(values)
+  seen_combs = PairSet(len(pos_sims), _BLOOM_BITS_PER_PAIR * len(pos_sims) if bloom else 0)
   neg_sim_dist = Counter()
   
   subq = Queue(NUM_TASKS * 10)
   recqs = [JoinableQueue() for _ in range(NUM_TASKS)]
-  workers = [Process(target=_build_no_matches_worker, args=(values, intervals, sim_dist, subq, recqs[i])) for i in range(NUM_TASKS)]
+  workers = [Process(target=profiled(_build_no_matches_worker), args=(values, intervals, sim_dist, subq, recqs[i], metrics_queue, metrics_interval)) for i in range(NUM_TASKS)]
 
   # start workers
   for worker in workers:
     worker.start()
 
+  pair_writer = PairWriter(src_dir, join(dest_dir, "non_matches.json"), row_store)
+
   # as long as we have less neg. pairs as pos. pairs
   while len(pos_sims) > sum(neg_sim_dist.values()):
     
-    # consume a pairs generated by a worker
-    bucket_idx, pointer1, pointer2 = subq.get()
-
-    key1 = f"{pointer1[3]}-{str(pointer1[2])}"
-    key2 = f"{pointer2[3]}-{str(pointer2[2])}"
-    comb = "--".join(sorted([key1, key2]))
+    # consume a pairs generated by a worker (the indices of its rows in values)
+    bucket_idx, idx1, idx2 = subq.get()
+    comb = pair_key(row_ids.item(idx1), row_ids.item(idx2))
 
     # check if the pair is already part of the sample
     if comb in seen_combs:
@@ -267,16 +400,16 @@ def _build_no_matches(src_dir: str, dest_dir: str, index: dict, pos_sims: list):
     seen_combs.add(comb)
 
     # write to disc
-    pair = _format_pair(pointer1, pointer2, matching=False, dir=src_dir)
-    with open(join(dest_dir, "non_matches.json"), "a", encoding="utf-8") as file:
-      file.write(json.dumps(pair, ensure_ascii=False) + "\n")
+    pair_writer.add(values[idx1][1], values[idx2][1], matching=False)
 
     # inform (other) workers that this pair is not required anymore
     for q in recqs:
       q.put(bucket_idx)
 
-    logging.info(f"{sum(neg_sim_dist.values())} / {len(pos_sims)}")
+    incr("non_matches")
   
+  pair_writer.close()
+
   # clear queue if needed
   while not subq.empty():
     subq.get()
@@ -287,9 +420,11 @@ def _build_no_matches(src_dir: str, dest_dir: str, index: dict, pos_sims: list):
     worker.join()
 
   
-def _build_no_matches_worker(values: list, intervals: np.ndarray, pos_dist: Counter, subq: Queue, recq: JoinableQueue):
+def _build_no_matches_worker(values: list, intervals: np.ndarray, pos_dist: Counter, subq: Queue, recq: JoinableQueue, metrics_queue=None, metrics_interval: float=30):
   """A worker that randomly tries to find a sample that is required."""
 
+  init_metrics(metrics_queue, metrics_interval)
+
   rnd = np.random.default_rng()
   neg_dist = Counter()
 
@@ -315,6 +450,7 @@ def _build_no_matches_worker(values: list, intervals: np.ndarray, pos_dist: Coun
 
     # compute similarity
     sim = jaccard_similarity(pointer1[4], pointer2[4])
+    incr("non_match_candidates")
     bucket_idx = np.digitize(sim, intervals) - 1
     
     # no more values needed for this similarity bucket
@@ -322,34 +458,114 @@ def _build_no_matches_worker(values: list, intervals: np.ndarray, pos_dist: Coun
       continue
     
     # publish the pair
-    subq.put((bucket_idx, pointer1, pointer2))
+    subq.put((bucket_idx, int(idx1), int(idx2)))
   
+  flush_metrics()
   return
 
-def _format_pair(pointer1: tuple, pointer2: tuple, matching: bool, dir) -> dict:
+def _intern_rows(values: list) -> np.ndarray:
+  """The id of the row of each value (identifier, pointer), rows are interned by their (tableID, rowIdx). Used to key pairs by pair_key."""
 
-  rows = []
-  for file_name, byte_offset, row_idx, _, _ in [pointer1, pointer2]:
-    with open(join(dir, file_name), "rb") as file:
-      file.seek(byte_offset)
-      doc = json.loads(file.readline())
-      
-      row = doc["rows"][row_idx]
-      # copy important props
-      row["pageTitle"] = doc["pageTitle"]
-      row["subjectColumnIndex"] = doc["subjectColumnIndex"]
-      row["subjectColumnProbability"] = doc["subjectColumnProbability"]
-      row["tableID"] = doc["tableID"]
-      row["pageID"] = doc["pageID"]
-      row["pageTitle"] = doc["pageTitle"]
-      row["pageTitle"] = doc["pageTitle"]
-      row.pop("clusterId")
-      for rev in row["revisions"]:
-        rev["schema"] = doc["schemas"][str(rev["revisionID"])]
-      rows.append(row)
+  ids = dict()
+  return np.array([ids.setdefault(_pointer_key(pointer), len(ids)) for _, pointer in values], dtype=np.int64)
+
+class PairWriter:
+  """
+    Appends pairs to dest_path. The rows of the pairs are read in batches by a Prefetcher, so that reading the rows of a batch overlaps with
+    sampling the next one.
+
+    If row_store is given, the pairs refer to their rows by [tableID, rowIdx] and only rows that are not in the row store yet are read and added to it.
+  """
+
+  def __init__(self, src_dir: str, dest_path: str, row_store: RowStoreWriter = None, batch_size: int = _PAIR_BATCH_SIZE):
+    self.dest_path = dest_path
+    self.row_store = row_store
+    self.batch_size = batch_size
+    self._prefetcher = Prefetcher(src_dir)
+    self._batch = []
+    self._pending = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def add(self, pointer1: tuple, pointer2: tuple, matching: bool):
+    self._batch.append((pointer1, pointer2, matching))
+    if len(self._batch) >= self.batch_size:
+      self._submit()
+
+  def close(self):
+    self._submit()
+    self._write_pending()
+    self._prefetcher.close()
+
+  def _submit(self):
+    """Starts to read the rows of the current batch and writes the previous batch."""
+
+    if len(self._batch) == 0:
+      return
+
+    pointers = [pointer for pair in self._batch for pointer in pair[:2]]
+    if self.row_store is not None:
+      pointers = [pointer for pointer in pointers if _pointer_key(pointer) not in self.row_store]
+
+    pending = (self._batch, pointers, self._prefetcher.submit(pointers))
+    self._batch = []
+    self._write_pending()
+    self._pending = pending
+
+  def _write_pending(self):
+    if self._pending is None:
+      return
+
+    pairs, pointers, pending_docs = self._pending
+    self._pending = None
+
+    with timer("format_pair"):
+      docs = pending_docs.result()
+      with open(self.dest_path, "ab") as file:
+
+        if self.row_store is None:
+          for i, (pointer1, pointer2, matching) in enumerate(pairs):
+            pair = _format_pair([pointer1, pointer2], docs[2 * i:2 * i + 2], matching)
+            file.write(dumpb(pair) + b"\n")
+          return
+
+        rows = {_pointer_key(pointer): _format_row(pointer, doc) for pointer, doc in zip(pointers, docs)}
+        for pointer1, pointer2, matching in pairs:
+          for pointer in [pointer1, pointer2]:
+            if _pointer_key(pointer) not in self.row_store:
+              self.row_store.add(rows[_pointer_key(pointer)])
+              incr("rows")
+          file.write(dumpb({"match": matching, "row1": list(_pointer_key(pointer1)), "row2": list(_pointer_key(pointer2))}) + b"\n")
+
+def _pointer_key(pointer: tuple) -> tuple:
+  """The (tableID, rowIdx) of the row a pointer refers to."""
+  return (pointer[3], pointer[2])
+
+def _format_pair(pointers: list, docs: list, matching: bool) -> dict:
 
   return {
     "match": matching,
-    "row1": rows[0],
-    "row2": rows[1]
-  }
\ No newline at end of file
+    "row1": _format_row(pointers[0], docs[0]),
+    "row2": _format_row(pointers[1], docs[1])
+  }
+
+def _format_row(pointer: tuple, doc: dict) -> dict:
+
+  row_idx = pointer[2]
+  row = doc["rows"][row_idx]
+  # copy important props
+  row["pageTitle"] = doc["pageTitle"]
+  row["subjectColumnIndex"] = doc["subjectColumnIndex"]
+  row["subjectColumnProbability"] = doc["subjectColumnProbability"]
+  row["tableID"] = doc["tableID"]
+  row["pageID"] = doc["pageID"]
+  row["pageTitle"] = doc["pageTitle"]
+  row["rowIdx"] = row_idx
+  row.pop("clusterId", None)
+  # each schema is stored once per row, the revisions refer to it (see resolve_schemas)
+  intern_schemas(row, doc["schemas"])
+  return row
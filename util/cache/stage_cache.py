@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import sys
+from os.path import join, exists
+
+from util.io.json_codec import loads, dumpb
+
+CACHE_MODES = ["stat", "hash"]
+
+_CACHE_DIR = ".cache"
+_ENTRY_EXTENSION = ".entry"
+
+class StageCache:
+  """
+    Remembers which shards of a stage's output are up to date. Each shard (e.g. an input file of filter or a sample size of gen-prompts) is stored
+    with a key derived from the fingerprints of its inputs, the stage's options and the source code of the modules that compute it, together with
+    the list of its outputs. A shard has to be recomputed if its key changed or an output is missing.
+
+    Entries are stored as single files in dir/.cache/<stage>, so that workers can store the shards they finished independently.
+    Inputs are fingerprinted by size and modification time (mode stat) or by their content (mode hash).
+  """
+
+  def __init__(self, dir: str, stage: str, options: dict, modules: list, mode: str = "stat"):
+    if mode not in CACHE_MODES:
+      raise ValueError(f"Unknown cache mode {mode}")
+
+    self.dir = dir
+    self.stage = stage
+    self.mode = mode
+    self._base = _hash([stage, sorted([(k, str(v)) for k, v in options.items()]), code_version(modules)])
+
+  def key(self, inputs: list) -> str:
+    """Returns the key of a shard computed from the given input files."""
+
+    return _hash([self._base, [file_fingerprint(path, self.mode) for path in inputs]])
+
+  def is_valid(self, shard: str, key: str) -> bool:
+    """True if the shard was stored with the given key and all of its outputs still exist."""
+
+    entry = self._read(shard)
+    return entry is not None and entry["key"] == key and all([exists(join(self.dir, output)) for output in entry["outputs"]])
+
+  def store(self, shard: str, key: str, outputs: list):
+    """Marks the shard as up to date. outputs are paths relative to dir."""
+
+    os.makedirs(self._entry_dir(), exist_ok=True)
+    path = self._entry_path(shard)
+
+    # write atomically, a stage might be aborted at any time
+    with open(path + ".tmp", "wb") as file:
+      file.write(dumpb({"key": key, "outputs": outputs}))
+    os.replace(path + ".tmp", path)
+
+  def stored(self, shard: str) -> bool:
+    """True if the shard was stored at all, regardless of its key."""
+
+    return exists(self._entry_path(shard))
+
+  def invalidate(self, shard: str):
+    if exists(self._entry_path(shard)):
+      os.remove(self._entry_path(shard))
+
+  def _read(self, shard: str) -> dict:
+    path = self._entry_path(shard)
+    if not exists(path):
+      return None
+    try:
+      with open(path, "rb") as file:
+        return loads(file.read())
+    except ValueError:
+      logging.warning(f"Ignoring corrupt cache entry {path}")
+      return None
+
+  def _entry_dir(self) -> str:
+    return join(self.dir, _CACHE_DIR, self.stage)
+
+  def _entry_path(self, shard: str) -> str:
+    return join(self._entry_dir(), shard + _ENTRY_EXTENSION)
+
+def file_fingerprint(path: str, mode: str = "stat") -> str:
+  """Returns the size and modification time (mode stat) or a hash of the content (mode hash) of the file at path. Missing files have no fingerprint."""
+
+  if path is None or not exists(path):
+    return None
+
+  if mode == "stat":
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+  digest = hashlib.sha256()
+  with open(path, "rb") as file:
+    for chunk in iter(lambda: file.read(1 << 20), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+def code_version(modules: list) -> str:
+  """Returns a hash of the source files of the given (imported) modules."""
+
+  digest = hashlib.sha256()
+  for name in sorted(set(modules)):
+    module = sys.modules.get(name)
+    path = getattr(module, "__file__", None)
+    digest.update(name.encode("utf-8"))
+    if path and exists(path):
+      with open(path, "rb") as file:
+        digest.update(file.read())
+  return digest.hexdigest()
+
+def _hash(value) -> str:
+  return hashlib.sha256(dumpb(value)).hexdigest()
@@ -0,0 +1,224 @@
+import logging
+import os
+import socket
+import threading
+import time
+from os.path import join, exists
+
+from util.io.json_codec import loads, dumpb
+from util.metrics.stage_metrics import incr
+
+# Seconds between two checks for finished tasks and claimable shards
+_POLL_INTERVAL = 1
+
+class WorkClaims:
+  """
+    Distributes shards (e.g. input files) among nodes that run the same command on a shared filesystem (e.g. NFS), without a coordinator.
+
+    A node claims a shard by atomically creating the lease file dir/<shard>.<generation>.lease (O_EXCL). While the node works on it,
+    a heartbeat thread touches its leases every lease_ttl / 4 seconds. A lease that was not touched for lease_ttl seconds (e.g. its node crashed)
+    is stale and the shard can be claimed again with the next generation; if several nodes try, only one creates that lease.
+    Leases are never removed, so that the generations of a shard are unambiguous. Ages are measured by the clock of the filesystem.
+
+    A finished shard is marked by dir/<shard>.done, which holds the node, the token of the shard (e.g. the cache key of the input, so that
+    markers of other inputs are ignored) and the shard's result. Any node can read the results to merge them.
+  """
+
+  def __init__(self, dir: str, lease_ttl: float = 60, node: str = None):
+    self.dir = dir
+    self.lease_ttl = lease_ttl
+    self.node = node or f"{socket.gethostname()}-{os.getpid()}"
+    self._held = dict() # shard -> generation
+    self._done = set()
+    self._lock = threading.Lock()
+    self._stop = threading.Event()
+    self._thread = None
+    self._clock_offset = 0
+
+    os.makedirs(dir, exist_ok=True)
+
+  def __enter__(self):
+    self._sync_clock()
+    self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+    self._thread.start()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def close(self):
+    """Stops the heartbeat and releases the shards that are still held (e.g. after an error), so that other nodes can claim them right away."""
+
+    self._stop.set()
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+
+    with self._lock:
+      for shard, generation in self._held.items():
+        # a lease is released by making it stale
+        os.utime(self._lease_path(shard, generation), (0, 0))
+      self._held = dict()
+
+    if exists(self._clock_path()):
+      os.remove(self._clock_path())
+
+  def claim(self, shard: str, token: str = None) -> bool:
+    """Returns True if this node claimed the shard. False if it is done or held by another node."""
+
+    if self.is_done(shard, token):
+      return False
+
+    generation = 0
+    while exists(self._lease_path(shard, generation)):
+      generation += 1
+
+    if generation > 0:
+      try:
+        age = self._now() - os.stat(self._lease_path(shard, generation - 1)).st_mtime
+      except FileNotFoundError:
+        age = 0
+      if age < self.lease_ttl:
+        return False
+
+    try:
+      fd = os.open(self._lease_path(shard, generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      return False
+    with os.fdopen(fd, "wb") as file:
+      file.write(dumpb({"node": self.node, "token": token}))
+
+    # another node might have finished the shard in the meantime
+    if self.is_done(shard, token):
+      os.utime(self._lease_path(shard, generation), (0, 0))
+      return False
+
+    with self._lock:
+      self._held[shard] = generation
+
+    incr("claimed")
+    if generation > 0:
+      logging.info(f"Claimed {shard} again (generation {generation}), its lease expired.")
+      incr("reclaimed")
+    return True
+
+  def claim_or_wait(self, shard: str, token: str = None) -> bool:
+    """Blocks until this node claimed the shard (True) or another node finished it (False). Used for steps that only one node must run (e.g. a merge)."""
+
+    while not self.claim(shard, token):
+      if self.is_done(shard, token):
+        return False
+      time.sleep(_POLL_INTERVAL)
+    return True
+
+  def complete(self, shard: str, result=None, token: str = None) -> bool:
+    """
+      Marks a shard claimed by this node as done and stores its result (must be JSON serializable).
+      Returns False if the lease was lost in the meantime (another node claimed the shard again), the result is discarded then.
+    """
+
+    with self._lock:
+      generation = self._held.pop(shard)
+
+    if exists(self._lease_path(shard, generation + 1)):
+      logging.warning(f"Lost the lease of {shard} to another node, its result is discarded.")
+      incr("lost_leases")
+      return False
+
+    # written to a temporary file first, so that other nodes never read a partial marker
+    tmp_path = join(self.dir, f".{shard}.done.{self.node}")
+    with open(tmp_path, "wb") as file:
+      file.write(dumpb({"node": self.node, "token": token, "result": result}))
+    os.replace(tmp_path, self._done_path(shard))
+
+    self._done.add(shard)
+    return True
+
+  def is_done(self, shard: str, token: str = None) -> bool:
+    if shard in self._done:
+      return True
+
+    record = self._read_done(shard)
+    if record is None or record["token"] != token:
+      return False
+    self._done.add(shard)
+    return True
+
+  def results(self, shards: list) -> dict:
+    """Returns the done marker (node, token and result) of each finished shard."""
+
+    records = {shard: self._read_done(shard) for shard in shards}
+    return {shard: record for shard, record in records.items() if record is not None}
+
+  def _read_done(self, shard: str) -> dict:
+    try:
+      with open(self._done_path(shard), "rb") as file:
+        return loads(file.read())
+    except FileNotFoundError:
+      return None
+
+  def _lease_path(self, shard: str, generation: int) -> str:
+    return join(self.dir, f"{shard}.{generation}.lease")
+
+  def _done_path(self, shard: str) -> str:
+    return join(self.dir, f"{shard}.done")
+
+  def _now(self) -> float:
+    """The current time of the filesystem's clock (estimated by the offset to the local clock)."""
+    return time.time() + self._clock_offset
+
+  def _clock_path(self) -> str:
+    return join(self.dir, f".clock.{self.node}")
+
+  def _sync_clock(self):
+    path = self._clock_path()
+    with open(path, "wb"):
+      pass
+    os.utime(path)
+    self._clock_offset = os.stat(path).st_mtime - time.time()
+
+  def _heartbeat(self):
+    while not self._stop.wait(self.lease_ttl / 4):
+      with self._lock:
+        for shard, generation in self._held.items():
+          os.utime(self._lease_path(shard, generation))
+      self._sync_clock()
+
+def run_claimed(pool, tasks: dict, claims: WorkClaims, in_flight: int, tokens: dict = None) -> dict:
+  """
+    Runs the tasks (shard -> (fn, args)) on the pool, each one after this node claimed it, and marks them as done with their result.
+    At most in_flight tasks (e.g. the pool's number of processes) run at once, so that the remaining shards stay claimable by other nodes.
+    tokens are the tokens of the shards (see WorkClaims).
+
+    Returns the results of the tasks run by this node by shard, once all tasks are done (by any node).
+    Shards held by other nodes are claimed again as soon as their lease expires.
+  """
+
+  tokens = tokens or dict()
+  results = dict()
+  running = dict()
+
+  while True:
+
+    for shard, (fn, args) in tasks.items():
+      if len(running) >= in_flight:
+        break
+      if shard in running or claims.is_done(shard, tokens.get(shard)):
+        continue
+      if claims.claim(shard, tokens.get(shard)):
+        running[shard] = pool.apply_async(fn, args)
+
+    for shard, result in list(running.items()):
+      if result.ready():
+        del running[shard]
+        if claims.complete(shard, result.get(), tokens.get(shard)):
+          results[shard] = result.get()
+
+    if not running and all([claims.is_done(shard, tokens.get(shard)) for shard in tasks]):
+      return results
+
+    if running:
+      next(iter(running.values())).wait(_POLL_INTERVAL)
+    else:
+      # the remaining shards are held by other nodes
+      time.sleep(_POLL_INTERVAL)
@@ -3,6 +3,7 @@ from bs4 import BeautifulSoup
 
 from util.wiki.wikitemplate_util import replace_pagename
 from util.wiki.wikilink_util import replace_wikilinks
+from util.metrics.stage_metrics import incr
 
 
 def get_text(html: str, page_name: str, separator: str="||") -> str:
@@ -40,6 +41,7 @@ def contains_list(html:str, min_li=0) -> bool:
   """
 
   soup = BeautifulSoup(html, "html.parser")
+  incr("bs4_parses")
   for list in soup.find_all("ul"):
     
     if len(list.find_all("li")) >= min_li:
@@ -85,6 +87,7 @@ def _get_soup(html: str, page_name: str) -> str:
     html = replace_pagename(content=html, page_name=page_name)
 
   soup = BeautifulSoup(html, "html.parser")
+  incr("bs4_parses")
 
   # Add the title attribute to each link, if it adds additional information.
   for a in soup.find_all("a"):
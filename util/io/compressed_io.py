@@ -0,0 +1,339 @@
+import bisect
+import gzip
+import io
+import lzma
+import os
+from functools import lru_cache
+from os import listdir
+from os.path import isfile, join, basename
+
+from util.io.json_codec import loads, dumpb
+
+# zstandard is optional and only needed for .zst files
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# Compressed files are written as a sequence of independently compressed blocks (gzip members, xz streams or zstd frames).
+# The concatenation is still a valid .gz/.xz/.zst file for external tools.
+# The block table stores the uncompressed and compressed offset of each block, so that a reader can seek to an (uncompressed) offset
+# by decompressing a single block. It is written next to the file with this suffix.
+BLOCK_TABLE_SUFFIX = ".blocks"
+
+COMPRESSIONS = ["none", "gz", "xz", "zst"]
+
+JSON_EXTENSIONS = [".json", ".json.gz", ".json.xz", ".json.zst"]
+
+# Uncompressed size of a block. Smaller blocks make random access cheaper, larger blocks compress better.
+_BLOCK_SIZE = 1000000
+
+def compress_block(data: bytes, codec: str) -> bytes:
+  if codec == "gz":
+    return gzip.compress(data, compresslevel=6, mtime=0)
+  if codec == "xz":
+    return lzma.compress(data)
+  if codec == "zst":
+    return _zstandard().ZstdCompressor(level=3).compress(data)
+  raise ValueError(f"Unknown compression {codec}")
+
+def decompress_block(data: bytes, codec: str) -> bytes:
+  if codec == "gz":
+    return gzip.decompress(data)
+  if codec == "xz":
+    return lzma.decompress(data)
+  if codec == "zst":
+    return _zstandard().ZstdDecompressor().decompress(data)
+  raise ValueError(f"Unknown compression {codec}")
+
+def codec_of(path: str) -> str:
+  """Returns the compression of the file at path derived from its extension (gz, xz, zst or none)."""
+
+  extension = os.path.splitext(path)[1][1:]
+  return extension if extension in COMPRESSIONS else "none"
+
+def extension_of(compression: str) -> str:
+  """Returns the file extension (e.g. '.gz') to append for the given compression."""
+
+  return "" if compression == "none" else "." + compression
+
+def is_json_file(name: str) -> bool:
+  """True if name is a (compressed) json file."""
+
+  return any(name.endswith(extension) for extension in JSON_EXTENSIONS)
+
+def is_block_table(name: str) -> bool:
+  """True if name is the block table of a compressed file."""
+
+  return basename(name).endswith(BLOCK_TABLE_SUFFIX)
+
+def has_block_table(path: str) -> bool:
+  """True if the compressed file at path has an up-to-date block table, i.e. it can be read with random access."""
+
+  stat = os.stat(path)
+  return _read_block_table(path, stat.st_mtime_ns, stat.st_size) is not None
+
+def strip_json_extension(name: str) -> str:
+  """Removes the (compressed) json extension from name, e.g. part-1.json.gz -> part-1."""
+
+  for extension in sorted(JSON_EXTENSIONS, key=len, reverse=True):
+    if name.endswith(extension):
+      return name[:-len(extension)]
+  return name
+
+def list_json_files(dir: str) -> list:
+  """Returns the names of all (compressed) json files in dir."""
+
+  return [f for f in listdir(dir) if isfile(join(dir, f)) and is_json_file(f)]
+
+def open_compressed(path: str, mode: str = "rb", encoding: str = None):
+  """
+    Opens a plain or compressed file depending on its extension (.gz, .xz or .zst). Supported modes are r, w, rb and wb.
+    Compressed files written by this function can be read with random access: seek and tell work with the offsets of the
+    uncompressed content, so that offsets of lines stay valid when the files are compressed.
+    Compressed files without block table (e.g. compressed by external tools) are read sequentially, see StreamReader.
+    Text modes use utf-8 if no encoding is given.
+  """
+
+  codec = codec_of(path)
+  binary = "b" in mode
+
+  if codec == "none":
+    return open(path, mode, encoding=None if binary else encoding or "utf-8")
+
+  if mode.startswith("r"):
+    file = BlockReader(path, codec) if has_block_table(path) else StreamReader(path, codec)
+  elif mode.startswith("w"):
+    file = BlockWriter(path, codec)
+  else:
+    raise ValueError(f"Mode {mode} is not supported for compressed files")
+
+  return file if binary else io.TextIOWrapper(file, encoding=encoding or "utf-8")
+
+class BlockWriter(io.BufferedIOBase):
+  """Writes independently compressed blocks that end at line breaks and their block table."""
+
+  def __init__(self, path: str, codec: str, block_size: int = _BLOCK_SIZE):
+    self.path = path
+    self.codec = codec
+    self.block_size = block_size
+    self._file = open(path, "wb")
+    self._buffer = bytearray()
+    self._blocks = []
+    self._size = 0
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, b) -> int:
+    self._buffer += b
+    if len(self._buffer) >= self.block_size:
+      # cut at the last line break so that lines are not split across blocks
+      end = self._buffer.rfind(b"\n") + 1
+      if end > 0:
+        self._write_block(end)
+    return len(b)
+
+  def close(self):
+    if self.closed:
+      return
+    if self._buffer:
+      self._write_block(len(self._buffer))
+    self._file.close()
+
+    with open(self.path + BLOCK_TABLE_SUFFIX, "wb") as file:
+      file.write(dumpb({"codec": self.codec, "size": self._size, "blocks": self._blocks}))
+
+    super().close()
+
+  def _write_block(self, end: int):
+    self._blocks.append((self._size, self._file.tell()))
+    self._file.write(compress_block(bytes(self._buffer[:end]), self.codec))
+    self._size += end
+    del self._buffer[:end]
+
+class BlockReader(io.BufferedIOBase):
+  """
+    Reads a file written by BlockWriter. Supports seek and tell on the uncompressed content by decompressing only the block that contains an offset.
+  """
+
+  def __init__(self, path: str, codec: str):
+    self.path = path
+    self.codec = codec
+    self._file = open(path, "rb")
+
+    stat = os.stat(path)
+    self._offsets, self._positions, self._size = _read_block_table(path, stat.st_mtime_ns, stat.st_size)
+    self._pos = 0
+    self._block_idx = None
+    self._block = b""
+
+  def readable(self) -> bool:
+    return True
+
+  def seekable(self) -> bool:
+    return True
+
+  def tell(self) -> int:
+    return self._pos
+
+  def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+    if whence == io.SEEK_CUR:
+      offset += self._pos
+    elif whence == io.SEEK_END:
+      offset += self._size
+    self._pos = max(0, offset)
+    return self._pos
+
+  def read(self, size: int = -1) -> bytes:
+    chunks = []
+    while size is None or size < 0 or size > 0:
+      block, start = self._current_block()
+      chunk = block[start:] if size is None or size < 0 else block[start:start + size]
+      if not chunk:
+        break
+      chunks.append(chunk)
+      self._pos += len(chunk)
+      if size is not None and size > 0:
+        size -= len(chunk)
+    return b"".join(chunks)
+
+  def read1(self, size: int = -1) -> bytes:
+    block, start = self._current_block()
+    chunk = block[start:] if size is None or size < 0 else block[start:start + size]
+    self._pos += len(chunk)
+    return chunk
+
+  def readinto(self, b) -> int:
+    chunk = self.read(len(b))
+    b[:len(chunk)] = chunk
+    return len(chunk)
+
+  def readline(self, size: int = -1) -> bytes:
+    chunks = []
+    while True:
+      block, start = self._current_block()
+      end = block.find(b"\n", start) + 1
+      chunk = block[start:end] if end > 0 else block[start:]
+      self._pos += len(chunk)
+      chunks.append(chunk)
+      # found the line break or reached the end of the file
+      if end > 0 or not chunk:
+        break
+    return b"".join(chunks)
+
+  def close(self):
+    if not self.closed:
+      self._file.close()
+    super().close()
+
+  def _current_block(self) -> tuple:
+    """Returns the decompressed block that contains the current position and the position within that block."""
+
+    idx = bisect.bisect_right(self._offsets, self._pos) - 1
+    if idx < 0:
+      return b"", 0
+
+    if idx != self._block_idx:
+      self._file.seek(self._positions[idx])
+      end = self._positions[idx + 1] if idx + 1 < len(self._positions) else None
+      data = self._file.read(end - self._positions[idx] if end is not None else -1)
+      self._block = decompress_block(data, self.codec) if data else b""
+      self._block_idx = idx
+
+    return self._block, self._pos - self._offsets[idx]
+
+class StreamReader(io.BufferedIOBase):
+  """
+    Reads a compressed file without block table (e.g. compressed by external tools) as a stream, without keeping it in memory.
+    tell returns the offset in the uncompressed content. seek can only move forward (by skipping the content in between) or rewind
+    to the start, other offsets would require to decompress the file again. Read the offsets in ascending order or write the file
+    with open_compressed to read it with random access.
+  """
+
+  def __init__(self, path: str, codec: str):
+    self.path = path
+    self.codec = codec
+    self._stream = _open_stream(path, codec)
+    self._pos = 0
+
+  def readable(self) -> bool:
+    return True
+
+  def seekable(self) -> bool:
+    return False
+
+  def tell(self) -> int:
+    return self._pos
+
+  def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+    if whence == io.SEEK_CUR:
+      offset += self._pos
+    elif whence != io.SEEK_SET:
+      raise io.UnsupportedOperation(f"Cannot seek relative to the end of {self.path}: it has no block table ({BLOCK_TABLE_SUFFIX}) and can only be read sequentially")
+
+    if offset < self._pos and offset <= 0:
+      self._stream.close()
+      self._stream = _open_stream(self.path, self.codec)
+      self._pos = 0
+    elif offset < self._pos:
+      raise io.UnsupportedOperation(f"Cannot seek back to offset {offset} of {self.path}: it has no block table ({BLOCK_TABLE_SUFFIX}) and can only be read sequentially")
+
+    while self._pos < offset and self.read(min(offset - self._pos, _BLOCK_SIZE)):
+      pass
+    return self._pos
+
+  def read(self, size: int = -1) -> bytes:
+    data = self._stream.read(size)
+    self._pos += len(data)
+    return data
+
+  def read1(self, size: int = -1) -> bytes:
+    data = self._stream.read1(size)
+    self._pos += len(data)
+    return data
+
+  def readinto(self, b) -> int:
+    n = self._stream.readinto(b)
+    self._pos += n
+    return n
+
+  def readline(self, size: int = -1) -> bytes:
+    line = self._stream.readline(size)
+    self._pos += len(line)
+    return line
+
+  def close(self):
+    if not self.closed:
+      self._stream.close()
+    super().close()
+
+@lru_cache(maxsize=1024)
+def _read_block_table(path: str, mtime_ns: int, size: int) -> tuple:
+  """Returns the uncompressed offsets, the compressed positions and the uncompressed size of the blocks or None if the file has no block table. Cached per file version."""
+
+  table_path = path + BLOCK_TABLE_SUFFIX
+  if not isfile(table_path) or os.stat(table_path).st_mtime_ns < mtime_ns:
+    return None
+
+  with open(table_path, "rb") as file:
+    table = loads(file.read())
+
+  blocks = table["blocks"] or [(0, 0)]
+  return [b[0] for b in blocks], [b[1] for b in blocks], table["size"]
+
+def _open_stream(path: str, codec: str):
+  """Opens a buffered stream of the decompressed content of all members / streams / frames of the file at path."""
+
+  if codec == "gz":
+    return gzip.open(path, "rb")
+  if codec == "xz":
+    return lzma.open(path, "rb")
+  if codec == "zst":
+    return io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True))
+  raise ValueError(f"Unknown compression {codec}")
+
+def _zstandard():
+  if zstandard is None:
+    raise ImportError("Reading or writing .zst files requires the zstandard package (pip3 install zstandard)")
+  return zstandard
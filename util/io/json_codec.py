@@ -0,0 +1,121 @@
+import json
+from json.decoder import scanstring
+
+# orjson decodes and encodes documents with long revision histories several times faster than the json module.
+# It is optional, the json module is used if it is not installed.
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+# Size of the first chunk scanned by load_fields. Grows by _CHUNK_GROWTH until all fields are found.
+_CHUNK_SIZE = 4096
+_CHUNK_GROWTH = 4
+
+def backend() -> str:
+  """Returns the name of the library used to decode and encode json."""
+
+  return "orjson" if orjson else "json"
+
+def loads(line):
+  """Decodes a json document given as str or bytes (e.g. a line read from a file opened in binary mode)."""
+
+  if orjson:
+    return orjson.loads(line)
+  return json.loads(line)
+
+def dumps(obj) -> str:
+  """
+    Encodes obj as compact json string. Non-ASCII characters are kept as they are.
+    The output is the same with and without orjson.
+  """
+
+  return dumpb(obj).decode("utf-8")
+
+def dumpb(obj) -> bytes:
+  """Like dumps, but returns utf-8 encoded bytes that can be written to a file opened in binary mode."""
+
+  if orjson:
+    try:
+      return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    except TypeError:
+      # e.g. integers above 64 bit or unsupported types, let the json module handle (or report) them
+      pass
+  return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def load_fields(line, fields: list) -> dict:
+  """
+    Decodes only the given top-level fields of a json object given as str or bytes.
+    Scanning stops as soon as all fields were found. This avoids decoding the revision histories of a table
+    if only fields in front of them (e.g. tableID or pageTitle) are needed.
+    Fields that do not exist are missing in the result.
+  """
+
+  fields = set(fields)
+  size = _CHUNK_SIZE
+
+  while True:
+
+    chunk = line[:size]
+    complete = size >= len(line)
+    if isinstance(chunk, bytes):
+      # a multi-byte character might be cut at the end of the chunk
+      chunk = chunk.decode("utf-8", errors="strict" if complete else "ignore")
+
+    try:
+      return _scan_fields(chunk, fields)
+    except (ValueError, IndexError):
+      # the chunk ends within a value, try again with a larger one
+      if not complete:
+        size *= _CHUNK_GROWTH
+        continue
+
+    # not a plain json object, decode everything
+    doc = loads(line)
+    return {k: doc[k] for k in fields if k in doc}
+
+def _scan_fields(s: str, fields: set) -> dict:
+  """Scans the key-value pairs of the json object in s until all fields are found. Raises ValueError or IndexError if s ends before."""
+
+  result = dict()
+
+  idx = _skip_whitespace(s, 0)
+  if s[idx] != "{":
+    raise ValueError("Not a json object")
+  idx = _skip_whitespace(s, idx + 1)
+  if s[idx] == "}":
+    return result
+
+  while True:
+
+    if s[idx] != '"':
+      raise ValueError(f"Expected a key at {idx}")
+    key, idx = scanstring(s, idx + 1)
+
+    idx = _skip_whitespace(s, idx)
+    if s[idx] != ":":
+      raise ValueError(f"Expected ':' at {idx}")
+
+    value, idx = _decoder.raw_decode(s, _skip_whitespace(s, idx + 1))
+
+    # a number might be cut at the end of the chunk, so a value only counts if it is followed by ',' or '}'
+    idx = _skip_whitespace(s, idx)
+    if s[idx] not in ",}":
+      raise ValueError(f"Expected ',' or '}}' at {idx}")
+
+    if key in fields:
+      result[key] = value
+      if len(result) == len(fields):
+        return result
+
+    if s[idx] == "}":
+      return result
+    idx = _skip_whitespace(s, idx + 1)
+
+def _skip_whitespace(s: str, idx: int) -> int:
+  while s[idx] in _WHITESPACE:
+    idx += 1
+  return idx
@@ -0,0 +1,133 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+from util.io.compressed_io import open_compressed
+from util.io.json_codec import loads
+
+# Line offsets of the same file that are at most this many bytes apart are read with a single request.
+_GAP = 1 << 16
+# Max. number of bytes read by a single request.
+_MAX_SPAN = 1 << 24
+
+class Prefetcher:
+  """
+    Reads the lines at (file, offset) pointers with a pool of threads, so that the latency of a (network) filesystem overlaps with other work.
+    Offsets in the same file that are close to each other are coalesced into a single sequential read. Each thread keeps the files it read open.
+    Lines are returned in the order of the pointers and decoded with decode (json by default, None returns the raw bytes).
+
+    Pointers are tuples whose first two values are the file (relative to dir, if given) and the byte offset of a line. Further values are ignored.
+  """
+
+  def __init__(self, dir: str = None, threads: int = 8, decode=loads, gap: int = _GAP):
+    self.dir = dir
+    self.decode = decode
+    self.gap = gap
+    self._pool = ThreadPoolExecutor(threads)
+    self._local = threading.local()
+    self._files = []
+    self._lock = threading.Lock()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def fetch(self, pointers: list) -> list:
+    """Reads the lines of the pointers."""
+
+    return self.submit(pointers).result()
+
+  def submit(self, pointers: list) -> "PendingLines":
+    """Starts to read the lines of the pointers and returns immediately. The lines are returned by result() of the returned object."""
+
+    offsets = dict()
+    for pointer in pointers:
+      offsets.setdefault(pointer[0], set()).add(pointer[1])
+
+    futures = []
+    for file_name, file_offsets in offsets.items():
+      for span in self._coalesce(sorted(file_offsets)):
+        futures.append(self._pool.submit(self._read_span, file_name, span))
+
+    return PendingLines(pointers, futures, self.decode)
+
+  def lookahead(self, pointers, size: int = 8):
+    """Yields (pointer, line) for each of the (possibly endless) pointers, while the lines of the next size pointers are already read."""
+
+    pending = deque()
+    for pointer in pointers:
+      pending.append((pointer, self.submit([pointer])))
+      if len(pending) > size:
+        pointer, lines = pending.popleft()
+        yield pointer, lines.result()[0]
+
+    while pending:
+      pointer, lines = pending.popleft()
+      yield pointer, lines.result()[0]
+
+  def close(self):
+    self._pool.shutdown()
+    with self._lock:
+      for file in self._files:
+        file.close()
+      self._files = []
+
+  def _coalesce(self, offsets: list) -> list:
+    """Groups the sorted offsets into spans that are read at once."""
+
+    spans = [[offsets[0]]]
+    for offset in offsets[1:]:
+      span = spans[-1]
+      if offset - span[-1] <= self.gap and offset - span[0] <= _MAX_SPAN:
+        span.append(offset)
+      else:
+        spans.append([offset])
+    return spans
+
+  def _read_span(self, file_name: str, offsets: list) -> dict:
+    """Reads the lines starting at the sorted offsets with a single seek and returns them by (file_name, offset)."""
+
+    file = self._open(file_name)
+    start = offsets[0]
+    file.seek(start)
+    data = file.read(offsets[-1] - start) + file.readline()
+
+    lines = dict()
+    for offset in offsets:
+      begin = offset - start
+      end = data.find(b"\n", begin)
+      lines[(file_name, offset)] = data[begin:] if end < 0 else data[begin:end + 1]
+    return lines
+
+  def _open(self, file_name: str):
+    files = getattr(self._local, "files", None)
+    if files is None:
+      files = self._local.files = dict()
+
+    if file_name not in files:
+      files[file_name] = open_compressed(join(self.dir, file_name) if self.dir else file_name, "rb")
+      with self._lock:
+        self._files.append(files[file_name])
+
+    return files[file_name]
+
+class PendingLines:
+  """The lines of a batch of pointers that are read by a Prefetcher."""
+
+  def __init__(self, pointers: list, futures: list, decode):
+    self._pointers = pointers
+    self._futures = futures
+    self._decode = decode
+
+  def result(self) -> list:
+    """Waits until all lines are read and returns them in the order of the pointers. Each line is decoded separately, even if pointers repeat."""
+
+    lines = dict()
+    for future in self._futures:
+      lines.update(future.result())
+
+    lines = [lines[(pointer[0], pointer[1])] for pointer in self._pointers]
+    return lines if self._decode is None else [self._decode(line) for line in lines]
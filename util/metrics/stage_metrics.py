@@ -0,0 +1,220 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from multiprocessing import Queue
+from queue import Empty
+
+class StageMetrics:
+  """
+    Counters and timers of a single process.
+    The collected deltas are pushed to the queue of a MetricsReporter at most once per interval
+    so that hot loops only pay for a dict update.
+  """
+
+  def __init__(self, queue: Queue = None, interval: float = 30):
+    self._queue = queue
+    self._interval = interval
+    self._counters = Counter()
+    self._timers = Counter()
+    self._last_push = time.monotonic()
+    self._lock = threading.Lock()
+
+  def incr(self, name: str, n: int = 1):
+    """Increments the counter name by n."""
+
+    with self._lock:
+      self._counters[name] += n
+    self._push_if_needed()
+
+  def add_time(self, name: str, seconds: float):
+    """Adds the given seconds to the timer name."""
+
+    with self._lock:
+      self._timers[name] += seconds
+    self._push_if_needed()
+
+  @contextmanager
+  def timer(self, name: str):
+    """Measures the time spent in the with-block and adds it to the timer name."""
+
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add_time(name, time.perf_counter() - start)
+
+  def take(self) -> tuple:
+    """Returns the counters and timers collected since the last call and resets them."""
+
+    with self._lock:
+      counters, timers = dict(self._counters), dict(self._timers)
+      self._counters.clear()
+      self._timers.clear()
+    return counters, timers
+
+  def flush(self):
+    """Pushes the deltas collected so far to the reporter (if any)."""
+
+    self._last_push = time.monotonic()
+
+    if self._queue is None or (not self._counters and not self._timers):
+      return
+
+    self._queue.put(self.take())
+
+  def _push_if_needed(self):
+    if self._queue is not None and time.monotonic() - self._last_push >= self._interval:
+      self.flush()
+
+# The metrics of the current process. Replaced by init_metrics in instrumented processes.
+_metrics = StageMetrics()
+
+def init_metrics(queue: Queue, interval: float = 30):
+  """Connects the current process to a MetricsReporter. Can be used as initializer of a Pool."""
+
+  global _metrics
+  _metrics = StageMetrics(queue, interval)
+
+def incr(name: str, n: int = 1):
+  """Increments the counter name of the current process by n."""
+
+  _metrics.incr(name, n)
+
+def add_time(name: str, seconds: float):
+  """Adds the given seconds to the timer name of the current process."""
+
+  _metrics.add_time(name, seconds)
+
+def timer(name: str):
+  """Context manager that measures the time spent in the with-block."""
+
+  return _metrics.timer(name)
+
+def flush_metrics():
+  """Pushes the metrics of the current process to the reporter. Call it at the end of each task."""
+
+  _metrics.flush()
+
+class MetricsReporter:
+  """
+    Aggregates the metrics of all processes of a stage (the parent and its workers) and emits them every interval seconds,
+    as human-readable log line and, if metrics_file is given, as JSON line.
+
+    totals maps counter names to their expected final value and is used to estimate the remaining time.
+  """
+
+  def __init__(self, stage: str, interval: float = 30, metrics_file: str = None, totals: dict = None):
+    self.stage = stage
+    self.interval = interval
+    self.metrics_file = metrics_file
+    self.totals = dict(totals) if totals else dict()
+    self.queue = None
+
+    self._counters = Counter()
+    self._timers = Counter()
+    self._last_counters = Counter()
+    self._start = None
+    self._last_emit = None
+    self._thread = None
+
+  def set_total(self, name: str, total: int):
+    """Sets (or updates) the expected final value of the counter name."""
+
+    self.totals[name] = total
+
+  def __enter__(self):
+    self.queue = Queue()
+    self._start = self._last_emit = time.monotonic()
+
+    # the metrics of the parent are collected directly by the reporter thread
+    init_metrics(None)
+
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.queue.put(None)
+    self._thread.join()
+    init_metrics(None)
+
+  def _run(self):
+    while True:
+      try:
+        delta = self.queue.get(timeout=min(self.interval, 1))
+        if delta is None:
+          break
+        counters, timers = delta
+        self._counters.update(counters)
+        self._timers.update(timers)
+      except Empty:
+        pass
+
+      if time.monotonic() - self._last_emit >= self.interval:
+        self._emit()
+
+    # consume the deltas that arrived after the sentinel
+    while True:
+      try:
+        delta = self.queue.get(timeout=.1)
+      except Empty:
+        break
+      if delta is not None:
+        self._counters.update(delta[0])
+        self._timers.update(delta[1])
+
+    self._emit(final=True)
+
+  def _emit(self, final: bool = False):
+    counters, timers = _metrics.take()
+    self._counters.update(counters)
+    self._timers.update(timers)
+
+    now = time.monotonic()
+    elapsed = now - self._start
+    window = max(now - self._last_emit, 1e-9)
+
+    rates = {name: round(count / max(elapsed, 1e-9), 2) for name, count in self._counters.items()}
+    current_rates = {name: round((count - self._last_counters[name]) / window, 2) for name, count in self._counters.items()}
+
+    etas = dict()
+    for name, total in self.totals.items():
+      count = self._counters[name]
+      if 0 < count < total and current_rates.get(name):
+        etas[name] = round((total - count) / current_rates[name], 1)
+
+    counters = " | ".join([f"{name}={count} ({current_rates[name]}/s)" for name, count in sorted(self._counters.items())])
+    timers = ", ".join([f"{name}={round(secs, 1)}s" for name, secs in sorted(self._timers.items())])
+    eta = ", ".join([f"{name} {_format_duration(secs)}" for name, secs in etas.items()])
+
+    logging.info(f"[{self.stage}] {'done after' if final else 'elapsed'} {_format_duration(elapsed)} | {counters or 'no progress'}{f' | time: {timers}' if timers else ''}{f' | ETA: {eta}' if eta else ''}")
+
+    if self.metrics_file:
+      with open(self.metrics_file, "a", encoding="utf-8") as file:
+        file.write(json.dumps({
+          "stage": self.stage,
+          "time": time.time(),
+          "elapsed": round(elapsed, 3),
+          "final": final,
+          "counters": dict(self._counters),
+          "rates": rates,
+          "currentRates": current_rates,
+          "timers": {name: round(secs, 3) for name, secs in self._timers.items()},
+          "eta": etas
+        }, ensure_ascii=False) + "\n")
+
+    self._last_counters = Counter(self._counters)
+    self._last_emit = now
+
+def _format_duration(seconds: float) -> str:
+  seconds = int(seconds)
+  hours, seconds = divmod(seconds, 3600)
+  minutes, seconds = divmod(seconds, 60)
+  if hours:
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+  if minutes:
+    return f"{minutes}m{seconds:02d}s"
+  return f"{seconds}s"
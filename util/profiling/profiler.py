@@ -0,0 +1,253 @@
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from glob import glob
+from os.path import join, abspath
+
+# Set by start_profiling and inherited by all child processes: "<mode>:<interval>:<dir>"
+_PROFILE_ENV = "PIPELINE_PROFILE"
+
+PROFILE_MODES = ["cprofile", "sampling"]
+
+# The profile that is currently running and the pid of its process. Used to avoid nested profilers within one process.
+_active_pid = None
+_active_profile = None
+
+def start_profiling(mode: str, out_dir: str, interval: float = 0.005):
+  """
+    Profiles the current process and every task wrapped by profiled (also inside multiprocessing workers).
+    Returns a function that stops profiling and merges the profiles of all processes into out_dir:
+      - profile.txt: per-function stats
+      - profile.collapsed: collapsed stacks that can be rendered by flamegraph.pl or speedscope
+      - profile.pstats: the merged cProfile stats (cprofile mode only)
+  """
+
+  if mode not in PROFILE_MODES:
+    raise ValueError(f"Unknown profiling mode {mode}")
+
+  out_dir = abspath(out_dir)
+  parts_dir = join(out_dir, "parts")
+  os.makedirs(parts_dir, exist_ok=True)
+  for part in glob(join(parts_dir, "*")):
+    os.remove(part)
+
+  os.environ[_PROFILE_ENV] = f"{mode}:{interval}:{out_dir}"
+
+  profile = _Profile(mode, interval, parts_dir)
+  profile.start()
+
+  def stop():
+    profile.stop()
+    os.environ.pop(_PROFILE_ENV, None)
+    _merge(mode, out_dir)
+
+  return stop
+
+class profiled:
+  """
+    Wraps a (module-level) function so that every call is profiled if profiling was started by cli.py --profile.
+    Instances can be pickled and thus be passed to Pool.starmap or used as Process target.
+  """
+
+  def __init__(self, fn):
+    self.fn = fn
+
+  def __call__(self, *args, **kwargs):
+    config = os.environ.get(_PROFILE_ENV)
+
+    # not profiling or already profiling this process
+    if not config or _active_pid == os.getpid():
+      return self.fn(*args, **kwargs)
+
+    mode, interval, out_dir = config.split(":", 2)
+    profile = _Profile(mode, float(interval), join(out_dir, "parts"))
+    profile.start()
+    try:
+      return self.fn(*args, **kwargs)
+    finally:
+      profile.stop()
+
+class StackSampler:
+  """Samples the call stack of a thread every interval seconds and counts the collapsed stacks."""
+
+  def __init__(self, interval: float = 0.005, thread_id: int = None):
+    self.interval = interval
+    self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+    self.stacks = Counter()
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def stop(self) -> Counter:
+    self._stopped.set()
+    self._thread.join()
+    return self.stacks
+
+  def _run(self):
+    while not self._stopped.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      if frame is None:
+        continue
+
+      stack = []
+      while frame is not None:
+        stack.append(_label(frame.f_code.co_name, frame.f_code.co_filename, frame.f_code.co_firstlineno))
+        frame = frame.f_back
+
+      self.stacks[";".join(reversed(stack))] += 1
+
+class _Profile:
+  """Profiles the calling thread and dumps the result to a new file in parts_dir."""
+
+  def __init__(self, mode: str, interval: float, parts_dir: str):
+    self.mode = mode
+    self.interval = interval
+    self.parts_dir = parts_dir
+    self._profiler = None
+    self._sampler = None
+
+  def start(self):
+    global _active_pid, _active_profile
+    _active_pid = os.getpid()
+    _active_profile = self
+
+    if self.mode == "cprofile":
+      self._profiler = cProfile.Profile()
+      self._profiler.enable()
+    else:
+      self._sampler = StackSampler(self.interval)
+      self._sampler.start()
+
+  def stop(self):
+    global _active_pid, _active_profile
+    _active_pid = None
+    _active_profile = None
+
+    name = f"{os.getpid()}-{time.time_ns()}"
+
+    if self._profiler:
+      self._profiler.disable()
+      self._profiler.dump_stats(join(self.parts_dir, name + ".prof"))
+    else:
+      stacks = self._sampler.stop()
+      with open(join(self.parts_dir, name + ".collapsed"), "w", encoding="utf-8") as file:
+        for stack, count in stacks.items():
+          file.write(f"{stack} {count}\n")
+
+def _merge(mode: str, out_dir: str):
+  """Merges the profiles of all processes in out_dir/parts."""
+
+  parts_dir = join(out_dir, "parts")
+  stacks = Counter()
+
+  if mode == "cprofile":
+    parts = glob(join(parts_dir, "*.prof"))
+    stats = pstats.Stats(*parts)
+    stats.dump_stats(join(out_dir, "profile.pstats"))
+
+    with open(join(out_dir, "profile.txt"), "w", encoding="utf-8") as file:
+      stats.stream = file
+      stats.sort_stats("cumulative").print_stats(200)
+      stats.sort_stats("tottime").print_stats(200)
+
+    stacks = _stacks_from_stats(stats)
+
+  else:
+    parts = glob(join(parts_dir, "*.collapsed"))
+    for part in parts:
+      with open(part, "r", encoding="utf-8") as file:
+        for line in file:
+          stack, count = line.rstrip("\n").rsplit(" ", 1)
+          stacks[stack] += int(count)
+
+    _write_sample_stats(stacks, join(out_dir, "profile.txt"))
+
+  with open(join(out_dir, "profile.collapsed"), "w", encoding="utf-8") as file:
+    for stack, count in sorted(stacks.items()):
+      file.write(f"{stack} {count}\n")
+
+  logging.info(f"Merged {len(parts)} profiles into {out_dir}")
+
+def _stacks_from_stats(stats: pstats.Stats, min_share: float = 1e-4) -> Counter:
+  """
+    Derives collapsed stacks from cProfile's caller graph (in microseconds).
+    The own time of each function is distributed over its call paths proportional to the cumulative time spent per caller.
+  """
+
+  callees = dict()
+  for func, (_, _, _, _, callers) in stats.stats.items():
+    for caller, edge in callers.items():
+      callees.setdefault(caller, []).append((func, edge[3]))
+
+  total = sum([tt for _, _, tt, _, _ in stats.stats.values()])
+  min_time = total * min_share
+  stacks = Counter()
+
+  def visit(path: list, func, share: float):
+    _, _, tt, ct, _ = stats.stats[func]
+    stack = path + [_label(func[2], func[0], func[1])]
+
+    own = int(tt * share * 1e6)
+    if own > 0:
+      stacks[";".join(stack)] += own
+
+    if len(stack) > 200:
+      return
+
+    for callee, edge_ct in callees.get(func, []):
+      callee_ct = stats.stats[callee][3]
+      if callee in visiting or callee_ct <= 0:
+        continue
+      callee_share = share * edge_ct / callee_ct
+      if callee_share * callee_ct < min_time:
+        continue
+      visiting.add(callee)
+      visit(stack, callee, callee_share)
+      visiting.remove(callee)
+
+  for func, (_, _, _, _, callers) in stats.stats.items():
+    if not callers:
+      visiting = {func}
+      visit([], func, 1)
+
+  return stacks
+
+def _write_sample_stats(stacks: Counter, path: str):
+  """Writes the number of samples in which each function was running (own) or on the stack (total)."""
+
+  own = Counter()
+  total = Counter()
+  for stack, count in stacks.items():
+    frames = stack.split(";")
+    own[frames[-1]] += count
+    for frame in set(frames):
+      total[frame] += count
+
+  samples = sum(stacks.values())
+
+  with open(path, "w", encoding="utf-8") as file:
+    file.write(f"{samples} samples\n\n")
+    file.write(f"{'own':>10} {'own%':>7} {'total':>10} {'total%':>7}  function\n")
+    for frame, count in own.most_common():
+      file.write(f"{count:>10} {count / samples * 100:>6.2f}% {total[frame]:>10} {total[frame] / samples * 100:>6.2f}%  {frame}\n")
+
+def _label(name: str, file_name: str, line: int) -> str:
+  return f"{name} ({os.path.basename(file_name)}:{line})".replace(";", ":")
+
+def _disable_inherited_profiler():
+  # A forked child inherits the profiler of the parent's thread. Its work is profiled by profiled instead.
+  global _active_pid, _active_profile
+  if _active_profile is not None and _active_profile._profiler is not None:
+    _active_profile._profiler.disable()
+  _active_pid = None
+  _active_profile = None
+
+os.register_at_fork(after_in_child=_disable_inherited_profiler)
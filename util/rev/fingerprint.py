@@ -0,0 +1,22 @@
+import hashlib
+import re
+
+from util.wiki.wiki_table_util import get_tr
+
+def content_hash(revision: dict) -> str:
+  """Hash of the raw HTML of the revision's cells. Revisions with the same hash have the same content (text, links, ...)."""
+
+  return _hash(get_tr(revision))
+
+def text_hash(text: str) -> str:
+  """Hash of the text without non-word characters, i.e. the meaningful content of a revision (see filter)."""
+
+  return _hash(re.sub("\W", "", text))
+
+def schema_hash(schema: str) -> str:
+  """Hash of the raw HTML of a schema (header row), used as its id in the pairs of sample."""
+
+  return _hash(schema)
+
+def _hash(s: str) -> str:
+  return hashlib.blake2b(s.encode("utf-8"), digest_size=8).hexdigest()
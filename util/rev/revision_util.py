@@ -2,6 +2,7 @@ import numpy as np
 from datetime import datetime
 
 from util.wiki.wikilink_util import parse_wiki_date
+from util.rev.fingerprint import schema_hash
 
 def nearest_rev(revisions: list, t: datetime):
   """Find the revision with the lowest time distance to the given date."""
@@ -28,4 +29,25 @@ def get_rev_at_time(revisions: list, t: datetime):
   for time, rev in sorted(rev_times, reverse=True, key=lambda rt: rt[0]):
     if time <= t:
       return rev
-  return None
\ No newline at end of file
+  return None
+
+def intern_schemas(row: dict, schemas: dict):
+  """
+    Stores each distinct schema of the row's revisions once in row["schemas"] (by its hash) and refers to it by the schemaId of each revision.
+    schemas holds the schema of each revisionID (as in the filter output).
+  """
+
+  interned = row.setdefault("schemas", dict())
+  for rev in row["revisions"]:
+    schema = schemas[str(rev["revisionID"])]
+    rev["schemaId"] = schema_hash(schema)
+    interned[rev["schemaId"]] = schema
+
+def resolve_schemas(row: dict) -> dict:
+  """Sets the schema of each revision of a row with interned schemas (see intern_schemas). Returns the row."""
+
+  schemas = row.get("schemas")
+  if schemas is not None:
+    for rev in row["revisions"]:
+      rev["schema"] = schemas[rev["schemaId"]]
+  return row
@@ -1,10 +1,24 @@
-import os
-from os.path import join
+import re
+from os import listdir, remove
+from os.path import join, exists
 from typing import AnyStr
 
+from util.io.compressed_io import open_compressed, codec_of, BLOCK_TABLE_SUFFIX
+from util.io.json_codec import loads, dumpb
+
+MANIFEST_EXTENSION = ".manifest"
+
 class RotatingFileWriter:
-    
-  def __init__(self, dir: str, mode: str, encoding: str=None, base_name: str="", extension: str="", max_MB:int=200):
+  """
+    Writes to numbered part files (dir/<base_name><n><extension>) and starts a new part before a part would exceed max_MB.
+    Parts are opened lazily, so no empty parts are created. Compressed parts are written if the extension ends with .gz, .xz or .zst
+    (the limit refers to the uncompressed size then).
+
+    If manifest is given, the name, size in bytes and number of lines of each part are written to that path on exit,
+    together with manifest_fields. Downstream stages can use it to split their work by parts without scanning them.
+  """
+
+  def __init__(self, dir: str, mode: str, encoding: str=None, base_name: str="", extension: str="", max_MB: float=200, manifest: str=None, manifest_fields: dict=None, buffer_size: int=1 << 20):
 
     self.dir = dir
     self.mode = mode
@@ -12,38 +26,85 @@ class RotatingFileWriter:
     self.base_name = base_name
     self.extension = extension
     self.max_MB = max_MB
+    self.manifest = manifest
+    self.manifest_fields = manifest_fields
+    self.buffer_size = buffer_size
+    self.parts = []
+    self._binary = "b" in mode
+    self._newline = b"\n" if self._binary else "\n"
     self._file = None
-    self._counter = 1
+    self._counter = 0
+    self._bytes = 0
+    self._lines = 0
 
   def write(self, s: AnyStr):
-    self._rotate_if_needed()
+    size = len(s) if self._binary else len(s.encode(self.encoding or "utf-8"))
+    self._rotate_if_needed(size)
     self._file.write(s)
-    
+    self._bytes += size
+    self._lines += s.count(self._newline)
+
   def __enter__(self):
-    self._open_file()
     return self
 
   def __exit__(self, type, value, traceback):
-    if self._file:
-      self._file.close()
+    self._close_file()
 
-  def _rotate_if_needed(self):
-    # Remember the old position of the cursor
-    old_cursor_pos = self._file.tell()
+    if self.manifest and type is None:
+      write_manifest(self.manifest, self.parts, self.manifest_fields)
 
-    # get the file size
-    self._file.seek(0, os.SEEK_END)
-    size = self._file.tell()
+  def clear(self):
+    """Removes the parts (and the manifest) written by a previous writer with the same base_name and extension."""
 
-    # reset the cursor
-    self._file.seek(old_cursor_pos)
+    pattern = re.compile(re.escape(self.base_name) + r"\d+" + re.escape(self.extension) + "(" + re.escape(BLOCK_TABLE_SUFFIX) + ")?$")
+    for f in listdir(self.dir):
+      if pattern.match(f):
+        remove(join(self.dir, f))
 
-    # rotate if file is too large
-    if size > self.max_MB * 1000000:
-      self._file.close()
-      self._counter += 1
+    if self.manifest and exists(self.manifest):
+      remove(self.manifest)
+
+  def _rotate_if_needed(self, size: int):
+    # rotate if the part would become too large (a part contains at least one write)
+    if self._file and self._bytes > 0 and self._bytes + size > self.max_MB * 1000000:
+      self._close_file()
+
+    if not self._file:
       self._open_file()
 
   def _open_file(self):
-    self._file = open(join(self.dir, self.base_name + str(self._counter) + self.extension), self.mode, encoding=self.encoding)
+    self._counter += 1
+    self._bytes = 0
+    self._lines = 0
+    path = join(self.dir, self._part_name())
+
+    if codec_of(path) == "none":
+      self._file = open(path, self.mode, buffering=self.buffer_size, encoding=self.encoding)
+    else:
+      self._file = open_compressed(path, self.mode, encoding=self.encoding)
+
+  def _close_file(self):
+    if self._file:
+      self._file.close()
+      self._file = None
+      self.parts.append({"name": self._part_name(), "bytes": self._bytes, "lines": self._lines})
+
+  def _part_name(self) -> str:
+    return self.base_name + str(self._counter) + self.extension
+
+def write_manifest(path: str, parts: list, fields: dict = None):
+  """Writes a manifest for the given parts (name, bytes and lines of each part) and further fields."""
+
+  with open(path, "wb") as file:
+    file.write(dumpb({
+      **(fields or dict()),
+      "parts": parts,
+      "bytes": sum([p["bytes"] for p in parts]),
+      "lines": sum([p["lines"] for p in parts])
+    }))
+
+def read_manifest(path: str) -> dict:
+  """Reads a manifest written by RotatingFileWriter."""
 
+  with open(path, "rb") as file:
+    return loads(file.read())
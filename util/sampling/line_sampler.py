@@ -3,10 +3,13 @@ from os.path import isfile, join
 from click import echo
 import numpy as np
 
+from util.io.compressed_io import is_json_file, open_compressed
+
 
 class LineSampler:
   """
     Allows to randomly sample lines in files. Therefore it returns the file-path and byte-offset of the sampled line.
+    Compressed files are supported, offsets refer to their uncompressed content.
   """
     
   def __init__(self, paths):
@@ -16,14 +19,14 @@ class LineSampler:
     self._paths = paths
     self._sample_idx = 0
 
-    files = [path for path in paths if isfile(path)] + [join(path, f) for path in [directory for directory in paths if not isfile(directory)] for f in listdir(path) if isfile(join(path, f))]
+    files = [path for path in paths if isfile(path)] + [join(path, f) for path in [directory for directory in paths if not isfile(directory)] for f in listdir(path) if isfile(join(path, f)) and is_json_file(f)]
 
     echo(F"Sampling from {len(files)} files. This might take a while...")
     
     self._values = []
     for file_name in files:
       # find the line beginnings
-      with open(file_name, "rb") as file:
+      with open_compressed(file_name, "rb") as file:
         self._values.append((file_name, file.tell()))
         for _ in file:
           self._values.append((file_name, file.tell()))
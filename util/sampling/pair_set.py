@@ -0,0 +1,109 @@
+import numpy as np
+
+# Marks an empty slot. Pair keys of row ids below 2^32 never take this value.
+_EMPTY = 2**64 - 1
+
+# Multiplier of the Fibonacci hashing of keys (2^64 / golden ratio) and the mask of 64-bit integers
+_GOLDEN = 0x9E3779B97F4A7C15
+_MASK = 2**64 - 1
+
+# Max. share of used slots. The table doubles when it is exceeded.
+_MAX_LOAD = 0.5
+
+def pair_key(id1: int, id2: int) -> int:
+  """Encodes the (unordered) pair of two row ids (below 2^32) as a 64-bit integer."""
+
+  if id1 > id2:
+    id1, id2 = id2, id1
+  return (id1 << 32) | id2
+
+class BloomFilter:
+  """
+    A Bloom filter of 64-bit keys. might_contain has no false negatives, the share of false positives is about
+    (1 - e^(-hashes * n / bits))^hashes after adding n keys. The bits are kept in a bytearray, whose items are cheaper to access than NumPy's.
+  """
+
+  def __init__(self, bits: int, hashes: int = 3):
+    self.bits = max(64, bits)
+    self.hashes = hashes
+    self._array = bytearray((self.bits + 7) // 8)
+
+  def add(self, key: int):
+    array = self._array
+    bit, step = self._start(key)
+    for _ in range(self.hashes):
+      array[bit >> 3] |= 1 << (bit & 7)
+      bit = (bit + step) % self.bits
+
+  def might_contain(self, key: int) -> bool:
+    array = self._array
+    bit, step = self._start(key)
+    for _ in range(self.hashes):
+      if not array[bit >> 3] & (1 << (bit & 7)):
+        return False
+      bit = (bit + step) % self.bits
+    return True
+
+  def _start(self, key: int) -> tuple:
+    """The first bit of key and the step to the next one (double hashing: the i-th bit is h1 + i * h2)."""
+    h = (key * _GOLDEN) & _MASK
+    return (h >> 32) % self.bits, ((h & 0xFFFFFFFF) | 1) % self.bits
+
+class PairSet:
+  """
+    A set of pair keys (see pair_key) in a NumPy array with open addressing (linear probing).
+    Uses 8 bytes per slot (at least two slots per key) instead of a Python string per key. The table is sized for capacity keys up front,
+    so that it does not grow (and rehash) while they are added.
+
+    With bloom_bits, lookups check a Bloom filter first, so that most keys that are not in the set are rejected without probing the table.
+  """
+
+  def __init__(self, capacity: int = 1024, bloom_bits: int = 0):
+    self._bits = max(4, int(np.ceil(np.log2(capacity / _MAX_LOAD))))
+    self._slots = np.full(2**self._bits, _EMPTY, dtype=np.uint64)
+    self._size = 0
+    self._bloom = BloomFilter(bloom_bits) if bloom_bits else None
+
+  def __len__(self) -> int:
+    return self._size
+
+  def __contains__(self, key: int) -> bool:
+    if self._bloom is not None and not self._bloom.might_contain(key):
+      return False
+    return self._slots.item(self._find(key)) != _EMPTY
+
+  def add(self, key: int) -> bool:
+    """Adds the key. Returns False if it was in the set already."""
+
+    slot = self._find(key)
+    if self._slots.item(slot) != _EMPTY:
+      return False
+
+    self._slots[slot] = key
+    self._size += 1
+    if self._bloom is not None:
+      self._bloom.add(key)
+
+    if self._size > _MAX_LOAD * len(self._slots):
+      self._grow()
+    return True
+
+  def _find(self, key: int) -> int:
+    """The slot of key or the empty slot where it would be inserted."""
+
+    slots = self._slots
+    mask = len(slots) - 1
+    slot = ((key * _GOLDEN) & _MASK) >> (64 - self._bits)
+    while True:
+      # item returns a Python int, which compares much faster than a NumPy scalar
+      value = slots.item(slot)
+      if value == _EMPTY or value == key:
+        return slot
+      slot = (slot + 1) & mask
+
+  def _grow(self):
+    keys = self._slots[self._slots != np.uint64(_EMPTY)]
+    self._bits += 1
+    self._slots = np.full(2**self._bits, _EMPTY, dtype=np.uint64)
+    for key in keys.tolist():
+      self._slots[self._find(key)] = key
@@ -0,0 +1,183 @@
+import logging
+import os
+import time
+import traceback
+from os.path import join, exists
+
+from util.io.json_codec import dumpb
+from util.metrics.stage_metrics import incr, flush_metrics
+
+REJECTS_DIR = ".rejects"
+
+# Key of the result of a task that failed after all retries (see is_failure)
+_FAILURE = "taskFailure"
+
+# The rejects of the task that runs in this process. Set by _Task for the duration of a task.
+_rejects = None
+
+class Rejects:
+  """
+    Quarantines the records (e.g. lines or documents) of a task that raised, so that the task can skip them and continue.
+    Each reject is appended to path as JSON line with the source, position, error and the record itself. The file is only created on the first reject.
+  """
+
+  def __init__(self, path: str, task: str):
+    self.path = path
+    self.task = task
+    self._file = None
+
+  def clear(self):
+    """Removes the rejects of a previous run."""
+    if exists(self.path):
+      os.remove(self.path)
+
+  def add(self, record, error: Exception, source: str = None, position=None):
+    if self._file is None:
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+      self._file = open(self.path, "wb")
+
+    if isinstance(record, bytes):
+      record = record.decode("utf-8", errors="replace")
+    entry = {"task": self.task, "source": source, "position": position, "error": f"{type(error).__name__}: {error}", "record": record}
+    try:
+      line = dumpb(entry)
+    except TypeError:
+      # records that are not JSON serializable (anymore) are stored as text
+      line = dumpb(dict(entry, record=repr(record)))
+    self._file.write(line + b"\n")
+    self._file.flush()
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+def reject(record, error: Exception, source: str = None, position=None):
+  """
+    Quarantines a record that raised error in the task of the current process to its rejects file (see TaskRunner).
+    Outside of a task run by a TaskRunner, the reject is logged only.
+  """
+
+  location = f" at {position} of {source}" if source is not None else ""
+  logging.warning(f"Rejected a record{location}: {type(error).__name__}: {error}")
+  incr("rejected_records")
+  if _rejects is not None:
+    _rejects.add(record, error, source, position)
+
+def is_failure(result) -> bool:
+  """Returns True if result is the result of a task that failed after all retries."""
+  return isinstance(result, dict) and len(result) == 1 and _FAILURE in result
+
+class _Task:
+  """
+    A task of a TaskRunner. Retries fn with exponential backoff and returns a failure (see is_failure) instead of raising after the last attempt.
+    Instances can be pickled and thus be passed to Pool.starmap or Pool.apply_async.
+  """
+
+  def __init__(self, fn, name: str, rejects_path: str, retries: int, backoff: float):
+    self.fn = fn
+    self.name = name
+    self.rejects_path = rejects_path
+    self.retries = retries
+    self.backoff = backoff
+
+  def __call__(self, *args):
+    global _rejects
+
+    for attempt in range(self.retries + 1):
+      # each attempt starts over, so are its rejects
+      _rejects = Rejects(self.rejects_path, self.name)
+      _rejects.clear()
+      try:
+        return self.fn(*args)
+      except Exception as e:
+        error = e
+        trace = traceback.format_exc()
+      finally:
+        _rejects.close()
+        _rejects = None
+
+      if attempt < self.retries:
+        delay = self.backoff * 2 ** attempt
+        logging.warning(f"Task {self.name} failed ({type(error).__name__}: {error}), retrying in {delay}s.")
+        incr("task_retries")
+        time.sleep(delay)
+
+    logging.error(f"Task {self.name} failed after {self.retries + 1} attempts:\n{trace}")
+    incr("failed_tasks")
+    flush_metrics()
+    return {_FAILURE: {"task": self.name, "error": f"{type(error).__name__}: {error}", "attempts": self.retries + 1}}
+
+class TaskRunner:
+  """
+    Runs the tasks of a stage (e.g. one per input file) on a pool, so that a single failing task or a bad record does not abort the whole stage.
+    A failing task is retried with exponential backoff (backoff, 2 * backoff, ... seconds) and skipped after the last retry.
+    Tasks quarantine records they can not process by reject, which appends them to <rejects_dir>/<task>.json.
+    summary logs the skipped tasks and rejected records and returns the failures, so that the stage can fail (e.g. with a non-zero exit code).
+  """
+
+  def __init__(self, stage: str, rejects_dir: str, retries: int = 2, backoff: float = 1):
+    self.stage = stage
+    self.rejects_dir = rejects_dir
+    self.retries = retries
+    self.backoff = backoff
+    self.tasks = []
+    self.failures = dict() # task -> failure
+
+  def wrap(self, fn, name: str) -> _Task:
+    """Returns fn as task with the given (unique) name, e.g. to run it by other means than starmap (see run_claimed)."""
+
+    self.tasks.append(name)
+    return _Task(fn, name, self.rejects_path(name), self.retries, self.backoff)
+
+  def starmap(self, pool, fn, input: list, names: list) -> list:
+    """Like pool.starmap(fn, input), but returns the results of the tasks that succeeded only. names are the names of the tasks."""
+
+    tasks = [self.wrap(fn, name) for name in names]
+    return self.collect(names, pool.starmap(_call, zip(tasks, input)))
+
+  def collect(self, names: list, results: list) -> list:
+    """Records the failures among the results of the tasks with the given names. Returns the results of the tasks that succeeded."""
+
+    succeeded = []
+    for name, result in zip(names, results):
+      if is_failure(result):
+        self.failures[name] = result[_FAILURE]
+      else:
+        succeeded.append(result)
+    return succeeded
+
+  def rejects_path(self, name: str) -> str:
+    return join(self.rejects_dir, f"{name}.json")
+
+  def rejected(self) -> dict:
+    """The number of rejected records of each task (with rejects)."""
+
+    counts = dict()
+    for name in self.tasks:
+      if exists(self.rejects_path(name)):
+        with open(self.rejects_path(name), "rb") as file:
+          counts[name] = sum([1 for _ in file])
+    return counts
+
+  def summary(self) -> dict:
+    """Logs the tasks that were skipped and the records that were rejected. Returns the failures of the skipped tasks by task (empty if there are none)."""
+
+    rejected = self.rejected()
+    if not self.failures and not rejected:
+      logging.info(f"[{self.stage}] All {len(self.tasks)} tasks succeeded without rejects.")
+      return self.failures
+
+    if self.failures:
+      logging.error(f"[{self.stage}] Skipped {len(self.failures)} of {len(self.tasks)} tasks that failed after {self.retries + 1} attempts:")
+      for name, failure in self.failures.items():
+        logging.error(f"  {name}: {failure['error']}")
+    if rejected:
+      logging.warning(f"[{self.stage}] Rejected {sum(rejected.values())} records of {len(rejected)} tasks, see {self.rejects_dir}:")
+      for name, count in rejected.items():
+        logging.warning(f"  {name}: {count}")
+
+    return self.failures
+
+def _call(task: _Task, args: tuple):
+  return task(*args)
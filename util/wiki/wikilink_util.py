@@ -4,6 +4,7 @@ import re
 from util.wiki.wikilink_result import WikilinkResult
 from util.wiki.wiki_constants import WIKIPEDIA_HOSTNANE, WIKI_DEFAULT_NAMESPACE
 from util.wiki.wikitemplate_util import replace_pagename
+from util.metrics.stage_metrics import incr
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, unquote, urljoin
 from typing import List
@@ -31,6 +32,7 @@ def extract_wikilink(content: str, page_title: str = None, col_idx: int = None,
   """
 
   soup = BeautifulSoup(content, "html.parser")
+  incr("bs4_parses")
   if(col_idx is not None):
     cols = soup.find_all("td")
     if len(cols) <= col_idx: